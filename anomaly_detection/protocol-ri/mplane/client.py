@@ -22,10 +22,12 @@
 #
 
 import mplane.model
+import mplane.resultstore
 import mplane.utils
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import html.parser
+import math
 import urllib3
 
 # FIXME HACK
@@ -36,9 +38,11 @@ try:
 except:
     pass
 
-from threading import Thread
+from threading import Thread, RLock
 import queue
 
+import tornado.concurrent
+import tornado.gen
 import tornado.web
 import tornado.httpserver
 import tornado.ioloop
@@ -53,6 +57,11 @@ DEFAULT_HOST = "127.0.0.1"
 DEFAULT_REGISTRATION_PATH = "register/capability"
 DEFAULT_SPECIFICATION_PATH = "show/specification"
 DEFAULT_RESULT_PATH = "register/result"
+# set on specification responses when the request was held open
+# until specifications were queued (or the requested wait ran out)
+LONG_POLL_HEADER = "MPlane-Long-Poll"
+# longest a component may ask a specification request to be held open
+MAX_SPEC_WAIT = 300
 
 class BaseClient(object):
     """
@@ -62,7 +71,8 @@ class BaseClient(object):
 
     """
 
-    def __init__(self, tls_state, supervisor=False, exporter=None):
+    def __init__(self, tls_state, supervisor=False, exporter=None,
+                 result_store=None):
         self._tls_state = tls_state
         self._capabilities = {}
         self._capability_labels = {}
@@ -70,8 +80,9 @@ class BaseClient(object):
         self._receipt_identities = {}
         self._receipts = {}
         self._receipt_labels = {}
-        self._results = {}
-        self._result_labels = {}
+        if result_store is None:
+            result_store = mplane.resultstore.MemoryResultStore()
+        self._result_store = result_store
         self._supervisor = supervisor
         if self._supervisor:
             self._exporter = exporter
@@ -261,22 +272,18 @@ class BaseClient(object):
                 self._remove_receipt(receipt)
         except KeyError:
             pass
-        self._results[msg.get_token()] = msg
 
+        label = None
         if not isinstance(msg, mplane.model.Exception):
             if msg.get_label():
-                self._result_labels[msg.get_label()] = msg
+                label = msg.get_label()
         else:
             if receipt is not None:
-                self._result_labels[receipt.get_label()] = msg
+                label = receipt.get_label()
+        self._result_store.add(msg, label)
 
     def _remove_result(self, msg):
-        token = msg.get_token()
-        if token in self._results:
-            label = self._results[token].get_label()
-            del self._results[token]
-            if label and label in self._result_labels:
-                del self._result_labels[label]
+        self._result_store.remove(msg.get_token())
 
     def result_for(self, token_or_label):
         """
@@ -288,12 +295,13 @@ class BaseClient(object):
             return self._receipt_labels[token_or_label]
         elif token_or_label in self._receipts:
             return self._receipts[token_or_label]
-        elif token_or_label in self._result_labels:
-            return self._result_labels[token_or_label]
-        elif token_or_label in self._results:
-            return self._results[token_or_label]
-        else:
+
+        result = self._result_store.get_by_label(token_or_label)
+        if result is None:
+            result = self._result_store.get(token_or_label)
+        if result is None:
             raise KeyError("no such token or label "+token_or_label)
+        return result
 
     def _handle_exception(self, msg, identity):
         self._add_result(msg)
@@ -333,16 +341,11 @@ class BaseClient(object):
         """
         forget all receipts and results for the given token or label
         """
-        if token_or_label in self._result_labels:
-            result = self._result_labels[token_or_label]
-            del self._result_labels[token_or_label]
-            del self._results[result.get_token()]
+        result = self._result_store.get_by_label(token_or_label)
+        if result is not None:
+            self._result_store.remove(result.get_token())
 
-        if token_or_label in self._results:
-            result = self._results[token_or_label]
-            del self._results[token_or_label]
-            if result.get_label():
-                del self._result_labels[result.get_label()]
+        self._result_store.remove(token_or_label)
 
         if token_or_label in self._receipt_labels:
             receipt = self._receipt_labels[token_or_label]
@@ -371,13 +374,13 @@ class BaseClient(object):
         """
         list all tokens for stored results
         """
-        return tuple(self._results.keys())
+        return self._result_store.tokens()
 
     def result_labels(self):
         """
         list all labels for stored results
         """
-        return tuple(self._result_labels.keys())
+        return self._result_store.labels()
 
     def capability_tokens(self):
         """
@@ -416,15 +419,28 @@ class HttpInitiatorClient(BaseClient):
     """
 
     def __init__(self, config, tls_state, default_url=None,
-                 supervisor=False, exporter=None):
+                 supervisor=False, exporter=None, result_store=None,
+                 timeout=None):
         """
         initialize a client with a given
-        default URL an a given TLS state
+        default URL an a given TLS state; requests to components
+        give up after timeout seconds if it is given
         """
         super().__init__(tls_state, supervisor=supervisor,
-                        exporter=exporter)
+                        exporter=exporter, result_store=result_store)
 
         self._default_url = default_url
+        if timeout is None:
+            self._timeout = urllib3.Timeout.DEFAULT_TIMEOUT
+        else:
+            self._timeout = timeout
+
+        # where each outstanding receipt's specification was sent
+        self._receipt_urls = {}
+
+        # components may be polled from several threads at once;
+        # this guards capabilities, receipts and receipt URLs
+        self._state_lock = RLock()
 
         # specification serial number
         # used to create labels programmatically
@@ -450,7 +466,8 @@ class HttpInitiatorClient(BaseClient):
 
         pool = self._tls_state.pool_for(dst_url.scheme, dst_url.host, dst_url.port)
 
-        headers = {"Content-Type": "application/x-mplane+json"}
+        headers = {"Content-Type": mplane.model.CONTENT_TYPE_JSON,
+                   "Accept": ", ".join(mplane.model.message_content_types())}
         if self._tls_state.forged_identity():
             headers[FORGED_DN_HEADER] = self._tls_state.forged_identity()
 
@@ -460,11 +477,12 @@ class HttpInitiatorClient(BaseClient):
             path = "/"
         res = pool.urlopen('POST', path,
                            body=mplane.model.unparse_json(msg).encode("utf-8"),
-                           headers=headers)
+                           headers=headers, timeout=self._timeout)
+        ctype = res.getheader("Content-Type")
         if (res.status == 200 and
-            res.getheader("Content-Type") == "application/x-mplane+json"):
+            ctype in mplane.model.message_content_types()):
             component_identity = self._tls_state.extract_peer_identity(dst_url)
-            self.handle_message(mplane.model.parse_json(res.data.decode("utf-8")), component_identity)
+            self.handle_message(mplane.model.parse_message(res.data, ctype), component_identity)
         else:
             # Didn't get an mPlane reply. What now?
             pass
@@ -498,10 +516,11 @@ class HttpInitiatorClient(BaseClient):
         self.send_message(mplane.model.Redemption(receipt=rr))
 
         # see if we got a result
-        if token_or_label in self._result_labels:
-            return self._result_labels[token_or_label]
-        elif token_or_label in self._results:
-            return self._results[token_or_label]
+        result = self._result_store.get_by_label(token_or_label)
+        if result is None:
+            result = self._result_store.get(token_or_label)
+        if result is not None:
+            return result
         else:
             # Nope. Return the receipt.
             return rr
@@ -517,9 +536,57 @@ class HttpInitiatorClient(BaseClient):
         spec.validate()
         dst_url = cap.get_link()
         print("Invoke capability with URL: " + str(dst_url))
+        with self._state_lock:
+            self._receipt_urls[spec.get_token()] = dst_url or self._default_url
         self.send_message(spec, dst_url)
+        with self._state_lock:
+            if spec.get_token() not in self._receipts:
+                # answered at once, nothing to redeem
+                self._receipt_urls.pop(spec.get_token(), None)
         return spec
 
+    def handle_message(self, msg, identity=None):
+        with self._state_lock:
+            super().handle_message(msg, identity)
+
+    def _remove_receipt(self, msg):
+        super()._remove_receipt(msg)
+        self._receipt_urls.pop(msg.get_token(), None)
+
+    def redeem_receipts(self, url=None):
+        """
+        Try to redeem every outstanding receipt for specifications
+        sent to the component at url (or to any component), sending
+        the redemptions for each component in a single envelope.
+
+        """
+        if isinstance(url, str):
+            url = urllib3.util.parse_url(url)
+
+        with self._state_lock:
+            receipts = [(receipt, self._receipt_urls.get(token, self._default_url))
+                        for (token, receipt) in self._receipts.items()]
+
+        redemptions = {}
+        for (receipt, dst_url) in receipts:
+            if dst_url is None:
+                continue
+            if isinstance(dst_url, str):
+                dst_url = urllib3.util.parse_url(dst_url)
+            if url is not None and (dst_url.host, dst_url.port) != (url.host, url.port):
+                continue
+            redemptions.setdefault(str(dst_url), []).append(
+                mplane.model.Redemption(receipt=receipt))
+
+        for (dst_url, msgs) in redemptions.items():
+            if len(msgs) == 1:
+                self.send_message(msgs[0], dst_url)
+            else:
+                env = mplane.model.Envelope()
+                for msg in msgs:
+                    env.append_message(msg)
+                self.send_message(env, dst_url)
+
     def interrupt_capability(self, cap_tol):
         # get the receipt
         rr = super().result_for(cap_tol)
@@ -560,14 +627,16 @@ class HttpInitiatorClient(BaseClient):
             path = url.path
         else:
             path = "/"
-        res = pool.request('GET', path)
+        res = pool.request('GET', path,
+                headers={"Accept": ", ".join(mplane.model.message_content_types())},
+                timeout=self._timeout)
 
         if res.status == 200:
             ctype = res.getheader("Content-Type")
-            if ctype == "application/x-mplane+json":
+            if ctype in mplane.model.message_content_types():
                 # Probably an envelope. Process the message.
                 self.handle_message(
-                    mplane.model.parse_json(res.data.decode("utf-8")), identity)
+                    mplane.model.parse_message(res.data, ctype), identity)
             elif ctype == "text/html":
                 # Treat as a list of links to capability messages.
                 parser = CrawlParser(strict=False)
@@ -586,9 +655,10 @@ class HttpListenerClient(BaseClient):
 
     """
     def __init__(self, config, tls_state=None,
-                 supervisor=False, exporter=None, io_loop=None):
+                 supervisor=False, exporter=None, io_loop=None,
+                 result_store=None):
         super().__init__(tls_state, supervisor=supervisor,
-                        exporter=exporter)
+                        exporter=exporter, result_store=result_store)
 
         listen_port = DEFAULT_PORT
         if "listen-port" in config["client"]:
@@ -612,6 +682,12 @@ class HttpListenerClient(BaseClient):
         # Outgoing messages per component identifier
         self._outgoing = {}
 
+        # long-polling specification requests per component identifier,
+        # resolved when messages are queued for it; only touched on the
+        # IOLoop's thread
+        self._io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self._spec_waiters = {}
+
         # specification serial number
         # used to create labels programmatically
         self._ssn = 0
@@ -651,6 +727,13 @@ class HttpListenerClient(BaseClient):
         if identity not in self._outgoing:
             self._outgoing[identity] = []
         self._outgoing[identity].append(msg)
+        # may be called from any thread
+        self._io_loop.add_callback(self._wake_spec_waiters, identity)
+
+    def _wake_spec_waiters(self, identity):
+        for waiter in self._spec_waiters.pop(identity, []):
+            if not waiter.done():
+                waiter.set_result(None)
 
     def invoke_capability(self, cap_tol, when, params, relabel=None, callback_when=None):
         """
@@ -711,12 +794,18 @@ class MPlaneHandler(tornado.web.RequestHandler):
 
     def _respond_message(self, msg):
         """
-        Returns an HTTP response containing a JSON message
+        Returns an HTTP response containing a message, in binary if
+        the request's Accept header asks for it and JSON otherwise
 
         """
+        ctype = mplane.model.negotiate_content_type(
+                    self.request.headers.get("Accept"))
         self.set_status(200)
-        self.set_header("Content-Type", "application/x-mplane+json")
-        self.write(mplane.model.unparse_json(msg))
+        self.set_header("Content-Type", ctype)
+        if ctype == mplane.model.CONTENT_TYPE_JSON:
+            self.write(mplane.model.unparse_json(msg))
+        else:
+            self.write(mplane.model.unparse_message(msg, ctype))
         self.finish()
 
     def _respond_plain_text(self, code, text = None):
@@ -753,9 +842,10 @@ class RegistrationHandler(MPlaneHandler):
 
 
     def post(self):
-        # unwrap json message from body
-        if (self.request.headers["Content-Type"] == "application/x-mplane+json"):
-            env = mplane.model.parse_json(self.request.body.decode("utf-8"))
+        # unwrap message from body
+        ctype = self.request.headers.get("Content-Type")
+        if ctype in mplane.model.message_content_types():
+            env = mplane.model.parse_message(self.request.body, ctype)
         else:
             self._respond_plain_text(400, "Invalid format")
             return
@@ -783,9 +873,47 @@ class SpecificationHandler(MPlaneHandler):
     def initialize(self, listenerclient, tlsState):
         self._listenerclient = listenerclient
         self._tls = tlsState
+        self._waiter = None
+        self._closed = False
+
+    def on_connection_close(self):
+        self._closed = True
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
 
+    @tornado.gen.coroutine
     def get(self):
         identity = self._tls.extract_peer_identity(self.request)
+
+        # long poll: hold the request until messages are queued for
+        # the component, or until the wait it asked for runs out
+        try:
+            wait = float(self.get_query_argument("wait", 0))
+        except ValueError:
+            wait = math.nan
+        if not math.isfinite(wait):
+            self._respond_plain_text(400, "Invalid wait")
+            return
+        wait = max(0, min(wait, MAX_SPEC_WAIT))
+        if wait > 0:
+            self.set_header(LONG_POLL_HEADER, str(wait))
+            if not self._listenerclient._outgoing.get(identity):
+                self._waiter = tornado.concurrent.Future()
+                waiters = self._listenerclient._spec_waiters
+                waiters.setdefault(identity, []).append(self._waiter)
+                try:
+                    yield tornado.gen.with_timeout(timedelta(seconds=wait),
+                                                   self._waiter)
+                except tornado.gen.TimeoutError:
+                    pass
+                if self._waiter in waiters.get(identity, []):
+                    waiters[identity].remove(self._waiter)
+                    if not waiters[identity]:
+                        del waiters[identity]
+                if self._closed:
+                    # the component went away; leave its messages queued
+                    return
+
         specs = self._listenerclient._outgoing.pop(identity, [])
         env = mplane.model.Envelope()
         for spec in specs:
@@ -794,7 +922,7 @@ class SpecificationHandler(MPlaneHandler):
                 print("Specification " + spec.get_label() + " successfully pulled by " + identity)
             else:
                 print("Interrupt " + spec.get_token() + " successfully pulled by " + identity)
-        self._respond_json_text(200, mplane.model.unparse_json(env))
+        self._respond_message(env)
 
 class ResultHandler(MPlaneHandler):
     """
@@ -807,9 +935,10 @@ class ResultHandler(MPlaneHandler):
         self._tls = tlsState
 
     def post(self):
-        # unwrap json message from body
-        if (self.request.headers["Content-Type"] == "application/x-mplane+json"):
-            env = mplane.model.parse_json(self.request.body.decode("utf-8"))
+        # unwrap message from body
+        ctype = self.request.headers.get("Content-Type")
+        if ctype in mplane.model.message_content_types():
+            env = mplane.model.parse_message(self.request.body, ctype)
         else:
             self._respond_plain_text(400, "Invalid format")
             return
@@ -28,11 +28,11 @@ import mplane.model
 import mplane.azn
 import mplane.tls
 import importlib
+import tornado.gen
 import tornado.web
 import tornado.httpserver
-from datetime import datetime
-import time
-from time import sleep
+from datetime import timedelta
+from time import sleep, monotonic
 import urllib3
 
 # FIXME HACK
@@ -43,18 +43,38 @@ try:
 except:
     pass
 
-from threading import Thread
+from threading import Thread, Condition, Lock
+import collections
 import json
 
 DEFAULT_MPLANE_PORT = 1228
-SLEEP_QUANTUM = 0.250
+# flush streamed JSON responses to the client every this many characters
+STREAM_FLUSH_SIZE = 65536
 CAPABILITY_PATH_ELEM = "capability"
 SPECIFICATION_PATH_ELEM = "/"
+# set by clients that held a specification request open until
+# specifications were queued (or the requested wait ran out)
+LONG_POLL_HEADER = "MPlane-Long-Poll"
+DEFAULT_SPEC_POLL_INTERVAL = 5
+DEFAULT_SPEC_LONG_POLL = 60
+# receipts and results queued for the same destination are sent
+# together in an envelope of up to this many messages
+DEFAULT_RESULT_BATCH_SIZE = 100
+# failed uploads are retried after 1, 2, 4, ... up to this many seconds
+MAX_UPLOAD_BACKOFF = 60
+# attempts made to upload a batch before dropping it
+MAX_UPLOAD_ATTEMPTS = 8
 
 class BaseComponent(object):
 
     def __init__(self, config):
         self.config = config
+        self._started_at = monotonic()
+
+        # keep parsed registries on disk between runs
+        if "registry_cache" in config["component"]:
+            mplane.model.set_registry_cache(
+                config["component"]["registry_cache"])
 
         # preload any registries necessary
         if "registry_preload" in config["component"]:
@@ -68,6 +88,20 @@ class BaseComponent(object):
             registry_uri = None
         mplane.model.initialize_registry(registry_uri)
 
+        # leave optional whitespace out of JSON sent on the wire
+        self._compact_json = config["component"].getboolean("json_compact",
+                                                            fallback=False)
+
+        # encoding of the messages this component sends unasked;
+        # replies are encoded as the requesting peer accepts
+        self._content_type = mplane.model.CONTENT_TYPE_JSON
+        if config["component"].get("message_encoding",
+                                   fallback="json") == "msgpack":
+            if mplane.model.msgpack is None:
+                print("msgpack module not available, sending messages as JSON")
+            else:
+                self._content_type = mplane.model.CONTENT_TYPE_MSGPACK
+
         self.tls = mplane.tls.TlsState(self.config)
         self.scheduler = mplane.scheduler.Scheduler(config)
 
@@ -103,10 +137,12 @@ class ListenerHttpComponent(BaseComponent):
 
         super(ListenerHttpComponent, self).__init__(config)
 
+        handler_args = {'scheduler': self.scheduler, 'tlsState': self.tls,
+                        'compact_json': self._compact_json}
         application = tornado.web.Application([
-            (r"/", MessagePostHandler, {'scheduler': self.scheduler, 'tlsState': self.tls}),
-            (r"/"+CAPABILITY_PATH_ELEM, DiscoveryHandler, {'scheduler': self.scheduler, 'tlsState': self.tls}),
-            (r"/"+CAPABILITY_PATH_ELEM+"/.*", DiscoveryHandler, {'scheduler': self.scheduler, 'tlsState': self.tls})
+            (r"/", MessagePostHandler, handler_args),
+            (r"/"+CAPABILITY_PATH_ELEM, DiscoveryHandler, handler_args),
+            (r"/"+CAPABILITY_PATH_ELEM+"/.*", DiscoveryHandler, handler_args)
         ])
         http_server = tornado.httpserver.HTTPServer(
                         application,
@@ -126,12 +162,33 @@ class MPlaneHandler(tornado.web.RequestHandler):
     """
     Abstract tornado RequestHandler that allows a
     handler to respond with an mPlane Message.
+    The message is sent in binary if the request's Accept header
+    asks for it; JSON is streamed, so large Results and Envelopes
+    are sent without being serialized in memory first. Streaming waits
+    for each flush to reach the peer, so a slow peer holds up the
+    serialization rather than letting it pile up in the write buffer.
 
     """
+    compact_json = False
+
+    @tornado.gen.coroutine
     def _respond_message(self, msg):
         self.set_status(200)
-        self.set_header("Content-Type", "application/x-mplane+json")
-        self.write(mplane.model.unparse_json(msg))
+        ctype = mplane.model.negotiate_content_type(
+                    self.request.headers.get("Accept"))
+        self.set_header("Content-Type", ctype)
+        if ctype != mplane.model.CONTENT_TYPE_JSON:
+            self.write(mplane.model.unparse_message(msg, ctype))
+            self.finish()
+            return
+
+        pending = 0
+        for chunk in mplane.model.iter_json(msg, compact=self.compact_json):
+            self.write(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_SIZE:
+                yield self.flush()
+                pending = 0
         self.finish()
 
 class DiscoveryHandler(MPlaneHandler):
@@ -142,10 +199,12 @@ class DiscoveryHandler(MPlaneHandler):
 
     """
 
-    def initialize(self, scheduler, tlsState):
+    def initialize(self, scheduler, tlsState, compact_json=False):
         self.scheduler = scheduler
         self.tls = tlsState
+        self.compact_json = compact_json
 
+    @tornado.gen.coroutine
     def get(self):
         # capabilities
         path = self.request.path.split("/")[1:]
@@ -153,7 +212,7 @@ class DiscoveryHandler(MPlaneHandler):
             if (len(path) == 1 or path[1] is None):
                 self._respond_capability_links()
             else:
-                self._respond_capability(path[1])
+                yield self._respond_capability(path[1])
         else:
             # FIXME how do we tell tornado we don't want to handle this?
             raise ValueError("I only know how to handle /"+CAPABILITY_PATH_ELEM+" URLs via HTTP GET")
@@ -169,20 +228,23 @@ class DiscoveryHandler(MPlaneHandler):
         self.finish()
 
     def _respond_capability(self, key):
-        self._respond_message(self.scheduler.capability_for_key(key))
+        return self._respond_message(self.scheduler.capability_for_key(key))
 
 class MessagePostHandler(MPlaneHandler):
     """
     Receives mPlane messages POSTed from a client, and passes them to a
     scheduler for processing. After waiting for a specified delay to see
     if a Result is immediately available, returns a receipt for future
-    redemption.
+    redemption. The wait does not block the IOLoop: the handler yields
+    on the job's completion future, so other requests keep being served.
 
     """
-    def initialize(self, scheduler, tlsState, immediate_ms = 5000):
+    def initialize(self, scheduler, tlsState, immediate_ms = 5000,
+                   compact_json=False):
         self.scheduler = scheduler
         self.tls = tlsState
         self.immediate_ms = immediate_ms
+        self.compact_json = compact_json
 
     def get(self):
         # message
@@ -198,13 +260,15 @@ class MessagePostHandler(MPlaneHandler):
         self.write("</body></html>")
         self.finish()
 
+    @tornado.gen.coroutine
     def post(self):
-        # unwrap json message from body
-        if (self.request.headers["Content-Type"] == "application/x-mplane+json"):
-            msg = mplane.model.parse_json(self.request.body.decode("utf-8"))
+        # unwrap message from body
+        ctype = self.request.headers.get("Content-Type")
+        if ctype in mplane.model.message_content_types():
+            msg = mplane.model.parse_message(self.request.body, ctype)
         else:
             # FIXME how do we tell tornado we don't want to handle this?
-            raise ValueError("I only know how to handle mPlane JSON messages via HTTP POST")
+            raise ValueError("I only know how to handle mPlane messages via HTTP POST")
 
         # hand message to scheduler
         reply = self.scheduler.process_message(self.tls.extract_peer_identity(self.request), msg)
@@ -214,15 +278,101 @@ class MessagePostHandler(MPlaneHandler):
            isinstance(msg, mplane.model.Specification) and \
            isinstance(reply, mplane.model.Receipt):
             job = self.scheduler.job_for_message(reply)
-            wait_start = datetime.utcnow()
-            while (datetime.utcnow() - wait_start).total_seconds() * 1000 < self.immediate_ms:
-                time.sleep(SLEEP_QUANTUM)
-                if job.failed() or job.finished():
-                    reply = job.get_reply()
-                    break
+            try:
+                yield tornado.gen.with_timeout(
+                        timedelta(milliseconds=self.immediate_ms),
+                        job.completion())
+            except tornado.gen.TimeoutError:
+                pass
+            if job.failed() or job.finished():
+                reply = job.get_reply()
 
         # return reply
-        self._respond_message(reply)
+        yield self._respond_message(reply)
+
+class _MessageUploader(object):
+    """
+    Sends the messages queued for one destination (a connection pool
+    and a path) from a background thread. Messages queued while an
+    upload is in flight, or within batch_delay seconds of the first,
+    are sent together in one envelope of up to batch_size messages.
+    Uploads which fail for lack of a connection or with a server
+    error are retried, backing off exponentially from backoff seconds;
+    a batch which still fails after max_attempts is dropped, so that it
+    does not hold up the messages queued behind it.
+
+    """
+    def __init__(self, component, pool, path, batch_size, batch_delay,
+                 max_attempts=MAX_UPLOAD_ATTEMPTS, backoff=1):
+        self._component = component
+        self._pool = pool
+        self._path = path
+        self._batch_size = batch_size
+        self._batch_delay = batch_delay
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._queue = collections.deque()
+        self._cond = Condition()
+        t = Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+    def put(self, msg):
+        with self._cond:
+            self._queue.append(msg)
+            self._cond.notify()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            if self._batch_delay > 0 and len(self._queue) < self._batch_size:
+                self._cond.wait_for(
+                        lambda: len(self._queue) >= self._batch_size,
+                        self._batch_delay)
+            count = min(len(self._queue), self._batch_size)
+            return [self._queue.popleft() for i in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._upload(batch)
+            except Exception as e:
+                # keep going for the messages queued behind this batch
+                print("Error returning " + str(len(batch)) +
+                      " message(s), dropping them: " + repr(e))
+
+    def _upload(self, batch):
+        if len(batch) == 1:
+            msg = batch[0]
+        else:
+            msg = mplane.model.Envelope()
+            for m in batch:
+                msg.append_message(m)
+
+        backoff = self._backoff
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                res = self._component._post_message(self._pool, self._path, msg)
+                if res.status < 500:
+                    break
+                reason = str(res.status) + " - " + res.data.decode("utf-8", "replace")
+            except (urllib3.exceptions.HTTPError, OSError) as e:
+                reason = str(e)
+            if attempt == self._max_attempts:
+                print("Error returning " + str(len(batch)) +
+                      " message(s), giving up after " + str(attempt) +
+                      " attempts: " + reason)
+                return
+            print("Error returning " + str(len(batch)) +
+                  " message(s), retrying in " + str(backoff) +
+                  " s: " + reason)
+            sleep(backoff)
+            backoff = min(backoff * 2, MAX_UPLOAD_BACKOFF)
+
+        for m in batch:
+            self._component._report_upload(m, res)
 
 class InitiatorHttpComponent(BaseComponent):
 
@@ -255,6 +405,22 @@ class InitiatorHttpComponent(BaseComponent):
         if not self.result_path.startswith("/"):
             self.result_path = "/" + self.result_path
 
+        # poll for specifications every spec_poll_interval seconds, or
+        # hold each poll open for up to spec_long_poll seconds on clients
+        # which support it (0 disables long polling)
+        self._spec_poll_interval = config["component"].getfloat(
+                "spec_poll_interval", fallback=DEFAULT_SPEC_POLL_INTERVAL)
+        self._spec_long_poll = config["component"].getfloat(
+                "spec_long_poll", fallback=DEFAULT_SPEC_LONG_POLL)
+
+        # coalesce receipts and results sent to the same destination
+        self._result_batch_size = config["component"].getint(
+                "result_batch_size", fallback=DEFAULT_RESULT_BATCH_SIZE)
+        self._result_batch_delay = config["component"].getfloat(
+                "result_batch_delay", fallback=0)
+        self._uploaders = {}
+        self._uploaders_lock = Lock()
+
         self.pool = self.tls.pool_for(self.url.scheme, self.url.host, self.url.port)
         self._result_url = dict()
         self.register_to_client()
@@ -304,12 +470,16 @@ class InitiatorHttpComponent(BaseComponent):
 
         # send the envelope to the client
         res = self.pool.urlopen('POST',self.registration_path,
-                    body=mplane.model.unparse_json(env).encode("utf-8"),
-                    headers={"content-type": "application/x-mplane+json"})
+                    body=mplane.model.unparse_message(env, self._content_type,
+                                                      compact=self._compact_json),
+                    headers={"content-type": self._content_type})
 
         # handle response message
         if res.status == 200:
             body = json.loads(res.data.decode("utf-8"))
+            if caps is None:
+                print("\nCapabilities registered %.3f s after component start" %
+                      (monotonic() - self._started_at))
             print("\nCapability registration outcome:")
             for key in body:
                 if body[key]['registered'] == "ok":
@@ -323,22 +493,44 @@ class InitiatorHttpComponent(BaseComponent):
 
     def check_for_specs(self):
         """
-        Poll the client for specifications
+        Poll the client for specifications. Clients which support it
+        hold the request open until they have specifications for us,
+        so these are handled as soon as they are queued; other clients
+        are polled every spec_poll_interval seconds.
 
         """
+        path = self.specification_path
+        timeout = None
+        if self._spec_long_poll > 0:
+            path = path + "?wait=" + str(self._spec_long_poll)
+            timeout = urllib3.Timeout(connect=self._spec_poll_interval,
+                                      read=self._spec_long_poll + 30)
+
         while(True):
-            # FIXME configurable default idle time.
-            self.idle_time = 5
-            # send a request for specifications
-            res = self.pool.request('GET', self.specification_path)
+            self.idle_time = self._spec_poll_interval
+            # send a request for specifications; if the Client/Supervisor
+            # can't be reached, or the poll times out, try again later
+            try:
+                res = self.pool.request('GET', path, timeout=timeout,
+                        headers={"accept": ", ".join(mplane.model.message_content_types())})
+            except urllib3.exceptions.HTTPError as e:
+                print("Error polling for specifications, retrying in " +
+                      str(self._spec_poll_interval) + " s: " + str(e))
+                sleep(self._spec_poll_interval)
+                continue
+            long_polled = res.getheader(LONG_POLL_HEADER) is not None
             if res.status == 200:
 
                 # specs retrieved: split them if there is more than one
-                env = mplane.model.parse_json(res.data.decode("utf-8"))
+                ctype = res.getheader("Content-Type")
+                if ctype != mplane.model.CONTENT_TYPE_MSGPACK:
+                    ctype = mplane.model.CONTENT_TYPE_JSON
+                env = mplane.model.parse_message(res.data, ctype)
                 for spec in env.messages():
                     # handle callbacks
                     if spec.get_label()  == "callback":
                         self.idle_time = spec.when().timer_delays()[1]
+                        long_polled = False
                         break
 
                     # hand spec to scheduler
@@ -347,20 +539,81 @@ class InitiatorHttpComponent(BaseComponent):
                         self._result_url[spec.get_token()] = spec.get_link()
 
                     # send receipt to the Client/Supervisor
-                    res = self.pool.urlopen('POST', self.result_path,
-                            body=mplane.model.unparse_json(reply).encode("utf-8"),
-                            headers={"content-type": "application/x-mplane+json"})
+                    self._send_message(self.pool, self.result_path, reply)
 
             # not registered on supervisor, need to re-register
             elif res.status == 428:
                 print("\nRe-registering capabilities on Client/Supervisor")
-                self.register_to_supervisor()
+                self.register_to_client()
 
-            sleep(self.idle_time)
+            # the client already waited for specifications on our behalf
+            if not long_polled:
+                sleep(self.idle_time)
+
+    def _post_message(self, pool, path, msg):
+        """
+        POSTs a message to the Client/Supervisor, streaming its
+        JSON with chunked transfer encoding (binary messages are
+        compact enough to be sent in one piece).
+
+        urllib3 must not retry by itself, since a streamed body can
+        only be sent once; callers retry with a fresh body instead.
+
+        """
+        if self._content_type != mplane.model.CONTENT_TYPE_JSON:
+            return pool.urlopen('POST', path,
+                        body=mplane.model.unparse_message(msg, self._content_type),
+                        headers={"content-type": self._content_type},
+                        retries=False)
+
+        body = (chunk.encode("utf-8") for chunk in
+                mplane.model.iter_json(msg, compact=self._compact_json))
+        return pool.urlopen('POST', path, body=body, chunked=True,
+                    headers={"content-type": "application/x-mplane+json"},
+                    retries=False)
+
+    def _send_message(self, pool, path, msg):
+        """
+        Queues a message for upload to the given pool and path.
+
+        """
+        key = (pool.scheme, pool.host, pool.port, path)
+        with self._uploaders_lock:
+            if key not in self._uploaders:
+                self._uploaders[key] = _MessageUploader(self, pool, path,
+                                                        self._result_batch_size,
+                                                        self._result_batch_delay)
+            uploader = self._uploaders[key]
+        uploader.put(msg)
+
+    def _report_upload(self, msg, res):
+        """
+        Reports the outcome of uploading a message.
+
+        """
+        if isinstance(msg, mplane.model.Receipt):
+            return
+        if isinstance(msg, mplane.model.Envelope):
+            for imsg in msg.messages():
+                label = imsg.get_label()
+                break
+        else:
+            if isinstance(msg, mplane.model.Exception):
+                print("Exception for " + msg.get_token() + " successfully returned!")
+                return
+
+            label = msg.get_label()
+        if res.status == 200:
+            print("Result for " + str(label) + " successfully returned!")
+        else:
+            print("Error returning Result for " + str(label))
+            print("Client/Supervisor said: " + str(res.status) + " - " +
+                  res.data.decode("utf-8", "replace"))
 
     def return_results(self, receipt):
         """
-        Checks if a job is complete, and in case sends it to the Client/Supervisor
+        Checks if a job is complete, and in case queues it for sending
+        to the Client/Supervisor
 
         """
         job = self.scheduler.job_for_message(receipt)
@@ -374,29 +627,7 @@ class InitiatorHttpComponent(BaseComponent):
         result_url = urllib3.util.parse_url(self._result_url[reply.get_token()])
         # send result to the Client/Supervisor
         if result_url != "" and self.pool.is_same_host(mplane.utils.parse_url(result_url)):
-            res = self.pool.urlopen('POST', self.result_path,
-                    body=mplane.model.unparse_json(reply).encode("utf-8"),
-                    headers={"content-type": "application/x-mplane+json"})
+            self._send_message(self.pool, self.result_path, reply)
         else:
             pool = self.tls.pool_for(result_url.scheme, result_url.host, result_url.port)
-            res = pool.urlopen('POST', result_url.path,
-                    body=mplane.model.unparse_json(reply).encode("utf-8"),
-                    headers={"content-type": "application/x-mplane+json"})
-
-        # handle response
-        if isinstance(reply, mplane.model.Envelope):
-            for msg in reply.messages():
-                label = msg.get_label()
-                break
-        else:
-            if isinstance(reply, mplane.model.Exception):
-                print("Exception for " + reply.get_token() + " successfully returned!")
-                return
-
-            label = reply.get_label()
-        if res.status == 200:
-            print("Result for " + label + " successfully returned!")
-        else:
-            print("Error returning Result for " + label)
-            print("Client/Supervisor said: " + str(res.status) + " - " + res.data.decode("utf-8"))
-        pass
+            self._send_message(pool, result_url.path, reply)
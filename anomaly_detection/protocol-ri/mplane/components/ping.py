@@ -200,11 +200,12 @@ class PingService(mplane.scheduler.Service):
         # are we returning aggregates or raw numbers?
         if res.has_result_column("delay.twoway.icmp.us"):
             # raw numbers
-            for i, oneping in enumerate(pings):
-                res.set_result_value("delay.twoway.icmp.us", oneping.usec, i)
             if res.has_result_column("time"):
-                for i, oneping in enumerate(pings):
-                    res.set_result_value("time", oneping.time, i)
+                res.append_rows(((oneping.time, oneping.usec) for oneping in pings),
+                                ["time", "delay.twoway.icmp.us"])
+            else:
+                res.append_rows(((oneping.usec,) for oneping in pings),
+                                ["delay.twoway.icmp.us"])
         else:
             # aggregates. single row.
             if res.has_result_column("delay.twoway.icmp.us.min"):
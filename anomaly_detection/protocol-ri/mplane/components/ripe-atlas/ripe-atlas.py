@@ -142,10 +142,11 @@ class RipeAtlasService(mplane.scheduler.Service):
 
         # set results values
         res_cnt = 0
+        res_lines = []
         for line in ripe_atlas_process.stdout:
             line_dec = line.decode("utf-8")
             line_dec = line_dec.rstrip("\n")
-            res.set_result_value(result_column_name, line_dec, res_cnt)
+            res_lines.append((line_dec,))
             if pg_cur is not None:
                 pg_cur.execute("INSERT INTO ripe_results VALUES ('"
                     + str(start_time) + "','"
@@ -154,6 +155,7 @@ class RipeAtlasService(mplane.scheduler.Service):
                     + str(line_dec) + "'"
                     + ")")
             res_cnt += 1
+        res.append_rows(res_lines, [result_column_name])
 
         # set endtime
         end_time = str(datetime.utcnow())
@@ -0,0 +1,85 @@
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+##
+# mPlane Protocol Reference Implementation
+# Crontab-repeated temporal scope iteration timing
+#
+# (c) 2015 mPlane Consortium (http://www.ict-mplane.eu)
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Measures how long sparse crontab-repeated temporal scopes take to iterate.
+
+    python3 -m mplane.cronbench [--stepper]
+
+iterates over the fire times of a year of a monthly crontab and a week
+of a daily crontab with When.iterator(), and reports the time taken.
+With --stepper, it also times stepping through every second of each
+scope and testing it against the crontab, which is slow.
+
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+import mplane.model
+
+# (stage, repeated temporal scope, start of iteration)
+SCHEDULES = (
+    ("a year of a monthly cron",
+     "repeat 2037-01-01 00:00:00 ... 2037-12-31 00:00:00 "
+     "cron 0 0 12 1 * * { now + 10s }",
+     datetime(2037, 1, 1)),
+    ("a week of a daily cron",
+     "repeat 2037-01-01 00:00:00 ... 2037-01-08 00:00:00 "
+     "cron 0 30 6 * * * { now + 10s }",
+     datetime(2037, 1, 1)))
+
+def cron_times(stepper=False):
+    """
+    Returns a list of (stage, fire count, seconds, stepper seconds)
+    for each schedule; stepper seconds are None unless stepper is set.
+
+    """
+    times = []
+    for (stage, scope, tzero) in SCHEDULES:
+        when = mplane.model.When(scope)
+
+        started_at = time.perf_counter()
+        fires = len(list(when.iterator(tzero=tzero)))
+        seconds = time.perf_counter() - started_at
+
+        stepper_seconds = None
+        if stepper:
+            started_at = time.perf_counter()
+            for fire in mplane.model._crontab_fires_brute_force(when, tzero):
+                pass
+            stepper_seconds = time.perf_counter() - started_at
+
+        times.append((stage, fires, seconds, stepper_seconds))
+    return times
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mPlane crontab iteration time")
+    parser.add_argument("--stepper", action="store_true",
+                        help="also time a per-second stepper over each scope")
+    args = parser.parse_args()
+
+    for (stage, fires, seconds, stepper_seconds) in cron_times(args.stepper):
+        line = "%-26s %3d fires %9.4fs" % (stage + ":", fires, seconds)
+        if stepper_seconds is not None:
+            line += " (stepper %.2fs)" % stepper_seconds
+        print(line)
@@ -0,0 +1,114 @@
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+##
+# mPlane Protocol Reference Implementation
+# Statement token and hash timing
+#
+# (c) 2015 mPlane Consortium (http://www.ict-mplane.eu)
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Measures how long statements take to compute their tokens and hashes.
+
+    python3 -m mplane.hashing [--count N] [--digest md5|fast]
+
+creates N specifications of a ping-like capability, and reports the
+time taken to
+
+  - give each its first token (retoken),
+  - compute its schema, parameter-value and extended hashes five times,
+  - change its temporal scope and give it a new token.
+
+Creating the specifications is not included. --digest selects the
+token digest, as set_token_digest() does: md5 (the default) or fast.
+
+"""
+
+import argparse
+import time
+
+import mplane.model
+
+def _bench_capability():
+    cap = mplane.model.Capability(label="bench-hashing")
+    cap.set_when("now ... future / 1s")
+    cap.add_parameter("source.ip4", "10.0.27.2")
+    cap.add_parameter("destination.ip4")
+    cap.add_result_column("time")
+    cap.add_result_column("delay.twoway.icmp.us.min")
+    cap.add_result_column("delay.twoway.icmp.us.mean")
+    cap.add_result_column("delay.twoway.icmp.us.max")
+    cap.add_result_column("delay.twoway.icmp.count")
+    return cap
+
+def hash_times(count=100000, digest=None):
+    """
+    Returns a list of (stage, seconds) for count specifications,
+    using the given token digest (the default if None).
+
+    """
+    mplane.model.initialize_registry()
+    if digest is not None:
+        mplane.model.set_token_digest(digest)
+    try:
+        cap = _bench_capability()
+        specs = []
+        for i in range(count):
+            spec = mplane.model.Specification(capability=cap)
+            spec.set_when("now + 1m / 1s")
+            spec.set_parameter_value("destination.ip4",
+                                     "10.%d.%d.%d" % (i // 65536 % 256,
+                                                      i // 256 % 256,
+                                                      i % 256))
+            specs.append(spec)
+
+        times = []
+
+        started_at = time.perf_counter()
+        for spec in specs:
+            spec.retoken(force=True)
+        times.append(("first retoken", time.perf_counter() - started_at))
+
+        started_at = time.perf_counter()
+        for spec in specs:
+            for i in range(5):
+                spec._schema_hash()
+                spec._pv_hash()
+                spec._mpcv_hash()
+        times.append(("5x schema+pv+mpcv hash",
+                      time.perf_counter() - started_at))
+
+        started_at = time.perf_counter()
+        for spec in specs:
+            spec.set_when("now + 2m / 1s")
+            spec.retoken(force=True)
+        times.append(("change when, then retoken",
+                      time.perf_counter() - started_at))
+
+        return times
+    finally:
+        if digest is not None:
+            mplane.model.set_token_digest()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mPlane statement hashing time")
+    parser.add_argument("--count", type=int, default=100000,
+                        help="number of specifications to hash")
+    parser.add_argument("--digest", choices=["md5", "fast"],
+                        help="token digest to use (md5 if not given)")
+    args = parser.parse_args()
+
+    for (stage, seconds) in hash_times(args.count, args.digest):
+        print("%-28s %.2fs" % (stage + ":", seconds))
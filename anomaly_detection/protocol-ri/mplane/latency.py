@@ -0,0 +1,143 @@
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+##
+# mPlane Protocol Reference Implementation
+# Relay latency measurement for the mPlane supervisor
+#
+# (c) 2015 mPlane Consortium (http://www.ict-mplane.eu)
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Measures how long the supervisor takes to relay a measurement.
+
+    python3 -m mplane.latency [--count N]
+
+relays N specifications through a supervisor's RelayService to a stub
+component that answers at once, and reports the time from the
+specification reaching the supervisor until its result is returned
+(relay), and from the result reaching the supervisor until it has
+been handled (dispatch). Neither includes any network time.
+
+"""
+
+import argparse
+import queue
+import threading
+import time
+
+import mplane.model
+import mplane.supervisor
+
+_IDENTITY = "org.mplane.Bench.Components.Component"
+
+def _bench_capability():
+    cap = mplane.model.Capability(label="bench-latency")
+    cap.set_when("now ... future / 1s")
+    cap.add_parameter("destination.ip4")
+    cap.add_result_column("delay.twoway.icmp.us.mean")
+    return cap
+
+class _StubClient(object):
+    """
+    Stands in for the supervisor's client: a specification
+    invoked on it is answered immediately by a result from the
+    component, delivered to the supervisor as the client would.
+
+    """
+    def __init__(self, cap, exporter):
+        self._cap = cap
+        self._exporter = exporter
+        self.sent_at = {}
+
+    def invoke_capability(self, label, when, params):
+        spec = mplane.model.Specification(capability=self._cap)
+        spec.set_when(when)
+        for (pname, pval) in params.items():
+            spec.set_parameter_value(pname, pval)
+        res = mplane.model.Result(specification=spec)
+        self.sent_at[res.get_token()] = time.perf_counter()
+        self._exporter.put_nowait([res, _IDENTITY])
+        return spec
+
+    def interrupt_capability(self, token):
+        pass
+
+class _BenchSupervisor(mplane.supervisor.BaseSupervisor):
+    """
+    A supervisor with only its message handling: no client,
+    component or listening server.
+
+    """
+    def __init__(self):
+        self._caps = []
+        self.from_cli = queue.Queue()
+        self._pending = mplane.supervisor.PendingRelays()
+        self._client = None
+        self.handled_at = {}
+
+    def handle_message(self, msg, identity):
+        super(_BenchSupervisor, self).handle_message(msg, identity)
+        self.handled_at[msg.get_token()] = time.perf_counter()
+
+def relay_latency(count=10):
+    """
+    Relays count specifications through a supervisor to a stub
+    component, and returns two lists of seconds: the dispatch
+    latency of each result and the relay latency of each
+    specification.
+
+    """
+    mplane.model.initialize_registry()
+    cap = _bench_capability()
+
+    supervisor = _BenchSupervisor()
+    dispatcher = threading.Thread(target=supervisor.dispatch_messages)
+    dispatcher.daemon = True
+    dispatcher.start()
+
+    client = _StubClient(cap, supervisor.from_cli)
+    supervisor._client = client
+    serv = mplane.supervisor.RelayService(cap, _IDENTITY, client,
+                                          supervisor._pending)
+
+    dispatch = []
+    relay = []
+    for i in range(count):
+        spec = mplane.model.Specification(capability=cap)
+        spec.set_label("bench-latency-" + str(i))
+        spec.set_when("now + 1s / 1s")
+        spec.set_parameter_value("destination.ip4", "10.0.0." + str(i % 256))
+        started_at = time.perf_counter()
+        serv.run(spec, lambda: False)
+        relay.append(time.perf_counter() - started_at)
+    for (token, sent_at) in client.sent_at.items():
+        dispatch.append(supervisor.handled_at[token] - sent_at)
+    return (dispatch, relay)
+
+def _print_latencies(name, latencies):
+    latencies = sorted(latencies)
+    print("%s: min %.3f ms, median %.3f ms, max %.3f ms" %
+          (name, latencies[0] * 1000, latencies[len(latencies) // 2] * 1000,
+           latencies[-1] * 1000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mPlane supervisor relay latency")
+    parser.add_argument("--count", type=int, default=10,
+                        help="number of specifications to relay")
+    args = parser.parse_args()
+
+    (dispatch, relay) = relay_latency(args.count)
+    _print_latencies("dispatch", dispatch)
+    _print_latencies("relay", relay)
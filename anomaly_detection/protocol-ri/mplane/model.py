@@ -309,22 +309,35 @@ The client receives the Envelope and decomposes the encapsulated messages:
 """
 
 try:
-    from ipaddress import ip_address
+    from ipaddress import ip_address, ip_network
 except ImportError:
     from ipaddr import IPAddress as ip_address
+    from ipaddr import IPNetwork as ip_network
 
 from datetime import datetime, timedelta, timezone
-from copy import copy, deepcopy
-import urllib.request
+from copy import copy
+from array import array
 import urllib.parse
 import collections
 import functools
+import itertools
 import operator
 import hashlib
 import json
-import yaml
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 import re
 import os
+import pickle
+import tempfile
+import time
+import sys
 
 from mplane.utils import normalize_path
 
@@ -374,6 +387,12 @@ KEY_REGISTRY = "registry"
 KEY_LABEL = "label"
 KEY_CONTENTS = "contents"
 
+# result values as packed columns, in binary encodings only
+KEY_RESULTPACKED = "resultvalues-packed"
+KEY_PACKEDTYPE = "type"
+KEY_PACKEDVALUES = "values"
+KEY_PACKEDMASK = "mask"
+
 KEY_MONTHS = "months"
 KEY_DAYS = "days"
 KEY_WEEKDAYS = "weekdays"
@@ -442,6 +461,50 @@ _innerwhen_pat = '\{ (.*?) \}'
 _innerwhen_re = re.compile(_innerwhen_pat)
 
 
+_iso8601_timespec = { 'us': 'microseconds',
+                       's': 'seconds',
+                       'm': 'minutes'}
+_iso8601_fixed_precision = { 10: 'd', 16: 'm', 19: 's' }
+
+# datetime.fromisoformat() needs Python 3.7 (and isoformat() with a
+# timespec 3.6); older interpreters go through strptime/strftime instead
+_isoformat_available = hasattr(datetime, "fromisoformat")
+
+@functools.lru_cache(maxsize=1024)
+def _parse_time_fixed(valstr):
+    """
+    Parses a timestamp in exactly one of the layouts YYYY-MM-DD,
+    YYYY-MM-DD HH:MM or YYYY-MM-DD HH:MM:SS; returns None for
+    anything else. Cached, since results tend to carry runs of
+    timestamps within the same second.
+
+    """
+    if valstr[4] != '-' or valstr[7] != '-':
+        return None
+    if len(valstr) > 10 and \
+       (valstr[10] != ' ' or valstr[13] != ':' or
+        (len(valstr) == 19 and valstr[16] != ':')):
+        return None
+    if not valstr.replace('-', '').replace(' ', '').replace(':', '').isdecimal():
+        return None
+    try:
+        if _isoformat_available:
+            return datetime.fromisoformat(valstr)
+        return datetime.strptime(valstr,
+                    _iso8601_fmt[_iso8601_fixed_precision[len(valstr)]])
+    except ValueError:
+        return None
+
+def _parse_time_fast(valstr):
+    n = len(valstr)
+    if n == 19 or n == 10 or n == 16:
+        return _parse_time_fixed(valstr)
+    elif 20 < n <= 26 and valstr[19] == '.' and valstr[20:].isdecimal():
+        dt = _parse_time_fixed(valstr[:19])
+        if dt is not None:
+            return dt.replace(microsecond=int(valstr[20:].ljust(6, '0')))
+    return None
+
 def parse_time(valstr):
     if valstr is None:
         return None
@@ -452,26 +515,40 @@ def parse_time(valstr):
     elif valstr == TIME_NOW:
         return time_now
     else:
-        m = _iso8601_re.match(valstr)
-        if m:
-            mstr = m.group(0)
-            mg = m.groups()
-            if mg[3]:
-                # FIXME this only handles millseconds; we should handle
-                # general precision fractional seconds correctly
-                dt = datetime.strptime(mstr, "%Y-%m-%d %H:%M:%S.%f")
-            elif mg[2]:
-                dt = datetime.strptime(mstr, "%Y-%m-%d %H:%M:%S")
-            elif mg[1]:
-                dt = datetime.strptime(mstr, "%Y-%m-%d %H:%M")
-            else:
-                dt = datetime.strptime(mstr, "%Y-%m-%d")
+        # canonical timestamps skip the regular expression and strptime
+        dt = _parse_time_fast(valstr)
+        if dt is not None:
             return dt
+        return _parse_time_strptime(valstr)
+
+def _parse_time_strptime(valstr):
+    m = _iso8601_re.match(valstr)
+    if m:
+        mstr = m.group(0)
+        mg = m.groups()
+        if mg[3]:
+            # FIXME this only handles millseconds; we should handle
+            # general precision fractional seconds correctly
+            dt = datetime.strptime(mstr, "%Y-%m-%d %H:%M:%S.%f")
+        elif mg[2]:
+            dt = datetime.strptime(mstr, "%Y-%m-%d %H:%M:%S")
+        elif mg[1]:
+            dt = datetime.strptime(mstr, "%Y-%m-%d %H:%M")
         else:
-            raise ValueError(repr(valstr)+" does not appear to be an mPlane timestamp")
+            dt = datetime.strptime(mstr, "%Y-%m-%d")
+        return dt
+    else:
+        raise ValueError(repr(valstr)+" does not appear to be an mPlane timestamp")
 
 def unparse_time(valts, precision="us"):
     if isinstance(valts, datetime):
+        # isoformat() matches the strftime() formats for naive times
+        # with four-digit years, and is much faster
+        if _isoformat_available and \
+           valts.tzinfo is None and valts.year >= 1000:
+            if precision == 'd':
+                return valts.date().isoformat()
+            return valts.isoformat(' ', _iso8601_timespec[precision])
         return valts.strftime(_iso8601_fmt[precision])
     else:
         return str(valts)
@@ -521,6 +598,10 @@ class _PastTime:
     def __repr__(self):
         return "mplane.model.time_past"
 
+    def __reduce__(self):
+        # unpickle to the singleton, so identity comparisons keep working
+        return "time_past"
+
     def strftime(self, ign):
         return str(self)
 
@@ -538,6 +619,10 @@ class _NowTime:
     def __repr__(self):
         return "mplane.model.time_now"
 
+    def __reduce__(self):
+        # unpickle to the singleton, so identity comparisons keep working
+        return "time_now"
+
     def strftime(self, ign):
         return str(self)
 
@@ -555,6 +640,10 @@ class _FutureTime:
     def __repr__(self):
         return "mplane.model.time_future"
 
+    def __reduce__(self):
+        # unpickle to the singleton, so identity comparisons keep working
+        return "time_future"
+
     def strftime(self, ign):
         return str(self)
 
@@ -619,15 +708,103 @@ class _Crontab(object):
     def __repr__(self):
         return "cron "+str(self)
 
+    def _matches(self, t):
+        """Returns True if the crontab fires during the second containing t"""
+        if len(self._seconds) and (t.second not in self._seconds):
+            return False
+        if len(self._minutes) and (t.minute not in self._minutes):
+            return False
+        if len(self._hours) and (t.hour not in self._hours):
+            return False
+        if len(self._days) and (t.day not in self._days):
+            return False
+        if len(self._weekdays) and ((t.weekday() + 1) % 7 not in self._weekdays):
+            return False
+        if len(self._months) and (t.month not in self._months):
+            return False
+        return True
+
+    def next_fire(self, t, limit=None):
+        """
+        Returns the earliest time not before t at which the crontab fires,
+        or None if it never does (or not before limit, if given). Skips
+        whole months, days, hours and minutes which cannot match instead
+        of checking every second.
+
+        """
+        if self._matches(t):
+            return t
+
+        # a crontab which hasn't fired within a full 400-year
+        # Gregorian cycle never will
+        year_limit = t.year + 400
+        t = t.replace(microsecond=0) + timedelta(seconds=1)
+        while t.year <= year_limit:
+            if limit is not None and t > limit:
+                break
+            if len(self._months) and t.month not in self._months:
+                if t.month == 12:
+                    t = datetime(t.year + 1, 1, 1)
+                else:
+                    t = datetime(t.year, t.month + 1, 1)
+                continue
+            if (len(self._days) and t.day not in self._days) or \
+               (len(self._weekdays) and (t.weekday() + 1) % 7 not in self._weekdays):
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+            if len(self._hours) and t.hour not in self._hours:
+                later = [h for h in self._hours if t.hour < h < 24]
+                if len(later):
+                    t = t.replace(hour=min(later), minute=0, second=0)
+                else:
+                    t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+            if len(self._minutes) and t.minute not in self._minutes:
+                later = [m for m in self._minutes if t.minute < m < 60]
+                if len(later):
+                    t = t.replace(minute=min(later), second=0)
+                else:
+                    t = t.replace(minute=0, second=0) + timedelta(hours=1)
+                continue
+            if len(self._seconds) and t.second not in self._seconds:
+                later = [s for s in self._seconds if t.second < s < 60]
+                if len(later):
+                    t = t.replace(second=min(later))
+                else:
+                    t = t.replace(second=0) + timedelta(minutes=1)
+                continue
+            return t
+
+        return None
+
+# marks a When duration that depends on tzero
+_unknown_duration = object()
+
 class When(object):
     """
     Defines the temporal scopes for capabilities, results, or
     single measurement specifications.
 
+    When objects are immutable and hashable. Those built from a
+    string alone are interned, so parsing a scope string that has
+    been seen recently returns the same When object.
+
     """
+    def __new__(cls, valstr=None, *args, **kwargs):
+        if cls is When and valstr is not None and not args and not kwargs:
+            return _interned_when(valstr)
+        return super().__new__(cls)
+
     def __init__(self, valstr=None, a=None, b=None, duration=None, period=None,
                  repeated=False, inner_duration=None, inner_period=None, crontab=None):
-        super().__init__()
+        if "_key" in self.__dict__:
+            # interned, already initialized by _interned_when()
+            return
+        self._setup(valstr, a, b, duration, period, repeated,
+                    inner_duration, inner_period, crontab)
+
+    def _setup(self, valstr, a, b, duration, period, repeated,
+               inner_duration, inner_period, crontab):
         self._a = a
         self._b = b
         self._duration = duration
@@ -640,6 +817,48 @@ class When(object):
         if valstr is not None:
             self._parse(valstr)
 
+        # precompute what doesn't depend on tzero
+        if self._a is not time_now and self._b is not time_now and \
+           (self._b is not None or isinstance(self._a, datetime)):
+            self._datetimes = self._datetimes_at(None)
+        else:
+            self._datetimes = None
+
+        if self._duration is not None:
+            self._total_duration = self._duration
+        elif self._b is None:
+            self._total_duration = timedelta()
+        elif self._b is time_future:
+            self._total_duration = None
+        elif self._datetimes is not None and None not in self._datetimes:
+            self._total_duration = self._datetimes[1] - self._datetimes[0]
+        else:
+            self._total_duration = _unknown_duration
+
+        # setting _key freezes the When
+        self._key = (self._a, self._b, self._duration, self._period,
+                     self._repeated, self._inner_duration, self._inner_period,
+                     None if self._crontab is None else str(self._crontab))
+
+    def __setattr__(self, name, value):
+        if "_key" in self.__dict__:
+            raise AttributeError("When objects are immutable")
+        super().__setattr__(name, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, When):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def _parse(self, valstr):
         # First check if this is a repeated measurement
         valsplit = valstr.split(WHEN_REPEAT)
@@ -813,7 +1032,11 @@ class When(object):
         Return start and end times as absolute timestamps
         for this temporal scope, relative to a given tzero.
         """
+        if self._datetimes is not None:
+            return self._datetimes
+        return self._datetimes_at(tzero)
 
+    def _datetimes_at(self, tzero):
         if tzero is None:
             tzero = datetime.utcnow()
 
@@ -829,8 +1052,8 @@ class When(object):
         elif self._b is time_future:
             end = None
         elif self._b is None:
-            if self.duration() is not None:
-                end = start + self.duration()
+            if self._duration is not None:
+                end = start + self._duration
             else:
                 end = start
         else:
@@ -844,15 +1067,10 @@ class When(object):
 
         If the temporal scope is indefinite in the future, returns None.
         """
-        if self._duration is not None:
-            return self._duration
-        elif self._b is None:
-            return timedelta()
-        elif self._b is time_future:
-            return None
-        else:
-            (start, end) = self.datetimes(tzero)
-            return end - start
+        if self._total_duration is not _unknown_duration:
+            return self._total_duration
+        (start, end) = self.datetimes(tzero)
+        return end - start
 
     def period(self):
         """Returns the period of this temporal scope."""
@@ -982,29 +1200,25 @@ class When(object):
 
         tzero = t
 
-        # loop through time by period and check for match
-        t -= period
-        # repeat with cron
+        # repeat with cron: jump to the next time the crontab fires,
+        # then to the first step of the period at or after it
         if self._crontab:
+            limit = self.datetimes(tzero)[1]
             while True:
-                t += period
+                fire = self._crontab.next_fire(t, limit)
+                if fire is None:
+                    break
+                if fire > t:
+                    t = tzero + period * -((tzero - fire) // period)
                 if self.sort_scope(t, tzero) > 0:
                     break
-                if len(self._crontab._seconds) and (t.second not in self._crontab._seconds):
-                    continue
-                if len(self._crontab._minutes) and (t.minute not in self._crontab._minutes):
-                    continue
-                if len(self._crontab._hours) and (t.hour not in self._crontab._hours):
-                    continue
-                if len(self._crontab._days) and (t.day not in self._crontab._days):
-                    continue
-                if len(self._crontab._weekdays) and ((t.weekday() + 1) % 7 not in self._crontab._weekdays):
-                    continue
-                if len(self._crontab._months) and (t.month not in self._crontab._months):
-                    continue
-                yield When(a=t, period=self._inner_period, duration=self._inner_duration)
+                if self._crontab._matches(t):
+                    yield When(a=t, period=self._inner_period, duration=self._inner_duration)
+                    t += period
         # repeat without cron
         else:
+            # loop through time by period
+            t -= period
             while True:
                 t += period
                 if self.sort_scope(t, tzero) > 0:
@@ -1012,8 +1226,105 @@ class When(object):
 
                 yield When(a=t, period=self._inner_period, duration=self._inner_duration)
 
+@functools.lru_cache(maxsize=256)
+def _interned_when(valstr):
+    when = object.__new__(When)
+    when._setup(valstr, None, None, None, None, False, None, None, None)
+    return when
+
 when_infinite = When(a=time_past, b=time_future)
 
+def _crontab_fires_brute_force(when, tzero):
+    # step through every second, as When.iterator() used to
+    period = timedelta(seconds=1)
+    t = tzero - period
+    while True:
+        t += period
+        if when.sort_scope(t, tzero) > 0:
+            return
+        if when._crontab._matches(t):
+            yield t
+
+def test_when_iterator_crontab():
+    import random
+    rnd = random.Random(1228)
+
+    def field(lo, hi, current=None):
+        # mostly "*" or a set holding the start's value, so that most
+        # schedules fire within the few hours each case covers
+        if rnd.random() < 0.5:
+            return "*"
+        vals = set(rnd.sample(range(lo, hi), rnd.randint(1, 4)))
+        if current is not None and rnd.random() < 0.8:
+            vals.add(current)
+        return ",".join(str(v) for v in sorted(vals))
+
+    cases = 40
+    nonempty = 0
+    for i in range(cases):
+        start = datetime(2037, rnd.randint(1, 12), rnd.randint(1, 28),
+                         rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59))
+        end = start + timedelta(seconds=rnd.randint(60, 3 * 3600))
+        cron = " ".join((field(0, 60), field(0, 60), field(0, 24, start.hour),
+                         field(1, 32, start.day),
+                         field(0, 7, (start.weekday() + 1) % 7),
+                         field(1, 13, start.month)))
+        when = When("repeat " + unparse_time(start) + " ... " +
+                    unparse_time(end) + " cron " + cron + " { now + 1s }")
+        expected = list(_crontab_fires_brute_force(when, start))
+        fires = [w._a for w in when.iterator(tzero=start)]
+        assert fires == expected, cron
+        if expected:
+            nonempty += 1
+
+        fire = when._crontab.next_fire(start, end)
+        assert fire == (expected[0] if len(expected) else None), cron
+
+    # the comparison above is only meaningful for schedules that fire
+    assert nonempty >= cases // 2, nonempty
+
+    # sparse schedules spanning months
+    when = When("repeat 2037-01-01 00:00:00 ... 2037-12-31 00:00:00 "
+                "cron 0 0 12 1 * * { now + 10s }")
+    fires = [w._a for w in when.iterator(tzero=datetime(2036, 12, 31))]
+    assert fires == [datetime(2037, m, 1, 12) for m in range(1, 13)]
+
+    when = When("repeat 2037-01-01 00:00:00 ... 2040-01-01 00:00:00 "
+                "cron 0 0 0 29 * 2 { now + 10s }")
+    fires = [w._a for w in when.iterator(tzero=datetime(2036, 12, 31))]
+    assert fires == []
+
+def test_when_interning():
+    import copy
+    import pickle
+
+    when = When("now ... future / 1s")
+    assert when is When("now ... future / 1s")
+    assert copy.deepcopy(when) is when
+    assert pickle.loads(pickle.dumps(when)) == when
+
+    # equal scopes are equal however they were built
+    when = When("2009-02-20 13:02:15 ... 2009-02-20 14:02:15")
+    built = When(a=parse_time("2009-02-20 13:02:15"),
+                 b=parse_time("2009-02-20 14:02:15"))
+    assert when == built and hash(when) == hash(built)
+    assert when != When("2009-02-20 13:02:15 + 1h")
+    assert len({when, built, when_infinite}) == 2
+
+    try:
+        when._a = time_now
+        assert False, "When should be immutable"
+    except AttributeError:
+        pass
+
+    # precomputed for absolute scopes, derived from tzero otherwise
+    assert when.duration() == timedelta(hours=1)
+    assert when.datetimes(tzero=parse_time("2000-01-01")) == \
+           (parse_time("2009-02-20 13:02:15"), parse_time("2009-02-20 14:02:15"))
+    when = When("past ... now")
+    tzero = parse_time("2009-02-20 13:02:15")
+    assert when.datetimes(tzero=tzero) == (None, tzero)
+
 # class Schedule(object):
 #     """
 #     Defines a schedule for repeated operations based on crontab-like
@@ -1132,6 +1443,44 @@ when_infinite = When(a=time_past, b=time_future)
 #                 continue
 #             yield t
 
+def test_time_formats():
+    global _isoformat_available
+    available = _isoformat_available
+    try:
+        for _isoformat_available in (available, False):
+            _parse_time_fixed.cache_clear()
+            _check_time_formats()
+    finally:
+        _isoformat_available = available
+        _parse_time_fixed.cache_clear()
+
+def _check_time_formats():
+    # the fast paths must agree with the regular expression and strptime
+    for (valstr, dt) in (("2009-02-20", datetime(2009, 2, 20)),
+                         ("2009-02-20 13:02", datetime(2009, 2, 20, 13, 2)),
+                         ("2009-02-20 13:02:15", datetime(2009, 2, 20, 13, 2, 15)),
+                         ("2009-02-20 13:02:15.5", datetime(2009, 2, 20, 13, 2, 15, 500000)),
+                         ("2009-02-20 13:02:15.000123", datetime(2009, 2, 20, 13, 2, 15, 123)),
+                         ("2009-2-3 4:05:06", datetime(2009, 2, 3, 4, 5, 6)),
+                         ("2009-02-20T13:02:15", datetime(2009, 2, 20)),
+                         ("2009-02-20 13:02:15Z", datetime(2009, 2, 20, 13, 2, 15)),
+                         ("2009-02-20  13:02:15", datetime(2009, 2, 20, 13, 2, 15))):
+        assert parse_time(valstr) == dt
+        assert parse_time(valstr) == parse_time(valstr)
+
+    for valstr in ("2009-02-30 13:02:15", "2009-02-20 13:02:15.1234567", "20090220"):
+        try:
+            parse_time(valstr)
+            assert False
+        except ValueError:
+            pass
+
+    for dt in (datetime(2009, 2, 20, 13, 2, 15), datetime(2009, 2, 20, 13, 2, 15, 42),
+               datetime(999, 1, 1), datetime(2009, 2, 20, tzinfo=timezone.utc)):
+        for precision in ('us', 's', 'm', 'd'):
+            assert unparse_time(dt, precision) == \
+                   dt.strftime(_iso8601_fmt[precision])
+
 def test_tscope():
     # Definite scope
     wdef = When("2009-02-20 13:00:00 ... 2009-02-20 15:00:00")
@@ -1161,6 +1510,18 @@ def test_tscope():
     assert wrel.follows(wdef, tzero=parse_time("2009-02-20 13:30:00"))
     assert wrel.timer_delays(tzero=parse_time("2009-02-20 12:00:00")) == (0, 1800)
 
+    # Scopes open at one end
+    wpast = When("past ... 2009-02-20 13:00:00")
+    assert not wpast.is_definite()
+    assert wpast.datetimes() == (None, parse_time("2009-02-20 13:00:00"))
+    assert wpast.in_scope(parse_time("2009-02-20 12:15:16"))
+    assert not wpast.in_scope(parse_time("2009-02-20 14:15:16"))
+    wfut = When("2009-02-20 13:00:00 ... future")
+    assert wfut.is_forever()
+    assert wfut.duration() is None
+    assert wfut.datetimes() == (parse_time("2009-02-20 13:00:00"), None)
+    assert wfut.in_scope(parse_time("2010-07-27 22:30:15"))
+
     # Infinite scope
     assert when_infinite.duration() is None
     assert when_infinite.period() is None
@@ -1268,6 +1629,11 @@ class _Primitive(object):
     def __repr__(self):
         return "<special mplane primitive "+self.name+">"
 
+    def __reduce__(self):
+        # unpickle to the module's instance, so identity comparisons
+        # (e.g. in ResultColumn) keep working
+        return (_primitive, (self.name,))
+
     def parse(self, sval):
         """
         Converts a string to a value; default implementation
@@ -1430,9 +1796,13 @@ class _TimePrimitive(_Primitive):
         return "mplane.model.prim_time"
 
     def parse(self, valstr):
+        if valstr == VALUE_NONE:
+            return None
         return parse_time(valstr)
 
     def unparse(self, val):
+        if val is None:
+            return VALUE_NONE
         return unparse_time(val)
 
 prim_string = _StringPrimitive()
@@ -1451,6 +1821,9 @@ _prim = {x.name: x for x in [prim_string,
                              prim_address,
                              prim_url]}
 
+def _primitive(name):
+    return _prim[name]
+
 def test_primitives():
     import math
     assert prim_string.parse("foo") == 'foo'
@@ -1598,12 +1971,9 @@ class Registry(object):
             self._add_element(elem)
 
     def _parse_json_bytestream(self, stream):
-        # Turn the stream into a dict
-        s = stream.read()
-        if isinstance(s, bytes):
-            s = s.decode("utf-8")
-        d = json.loads(s)
+        self._from_dict(_read_registry_json(stream))
 
+    def _from_dict(self, d):
         # check format
         if d[KEY_REGFMT] != REGFMT_FLAT:
             raise ValueError("Unsupported registry format "+str(d[KEY_REGFMT]))
@@ -1639,13 +2009,15 @@ class Registry(object):
     def _parse_from_file(self, filename=None):
         if filename is None:
             filename = os.path.join(os.path.dirname(__file__), "registry.json")
+        if _registry_cache_dir is not None:
+            self._from_dict(_load_registry_file(filename))
+            return
         with open(filename, "r") as stream:
             self._parse_json_bytestream(stream)
 
     def _parse_from_uri(self, uri):
         if uri == REGURI_DEFAULT:
-            with open(os.path.join(os.path.dirname(__file__), "registry.json"), "r") as stream:
-                self._parse_json_bytestream(stream)
+            self._parse_from_file()
         else:
             # normalize path if is a file or if no scheme is given
             # (we assume that is is a file)
@@ -1654,7 +2026,16 @@ class Registry(object):
                 uri = "file://" + normalize_path(uri)
 
             try:
-                with urllib.request.urlopen(uri) as stream:
+                if scheme == "file" or scheme == "":
+                    # read local registries directly, without urllib.request
+                    self._parse_from_file(
+                        urllib.parse.unquote(uri[len("file://"):]))
+                    return
+                if _registry_cache_dir is not None:
+                    self._from_dict(_load_registry_uri(uri))
+                    return
+                from urllib.request import urlopen
+                with urlopen(uri) as stream:
                     self._parse_json_bytestream(stream)
             except:
                 raise ValueError("Invalid Registry uri: " + uri)
@@ -1683,13 +2064,149 @@ class Registry(object):
          """
         return self._uri
 
+def _read_registry_json(stream):
+    # Turn the stream into a dict
+    s = stream.read()
+    if isinstance(s, bytes):
+        s = s.decode("utf-8")
+    return json.loads(s)
+
+# directory holding parsed registries, see set_registry_cache()
+_registry_cache_dir = None
+_registry_cache_max_age = 86400
+
+def set_registry_cache(directory=None, max_age=86400):
+    """
+    Keeps parsed registries in the given directory, so that later runs
+    load them without fetching or parsing JSON. Cached local registries
+    are revalidated against the file's modification time; remote ones
+    are used as-is for max_age seconds, then revalidated by ETag or
+    Last-Modified, and still used if the registry host is unreachable.
+    Pass None to turn the cache off (the default).
+
+    Call this before loading any registries.
+
+    """
+    global _registry_cache_dir, _registry_cache_max_age
+    if directory is not None:
+        directory = normalize_path(os.path.expanduser(directory))
+    _registry_cache_dir = directory
+    _registry_cache_max_age = max_age
+
+def _registry_cache_path(uri):
+    key = hashlib.sha1(uri.encode("utf-8")).hexdigest()
+    return os.path.join(_registry_cache_dir, key + ".pickle")
+
+def _read_registry_cache(uri):
+    try:
+        with open(_registry_cache_path(uri), "rb") as f:
+            entry = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        # missing or unreadable: fetch the registry again
+        return None
+    if not isinstance(entry, dict) or entry.get("uri") != uri:
+        return None
+    return entry
+
+def _write_registry_cache(entry):
+    try:
+        os.makedirs(_registry_cache_dir, exist_ok=True)
+        (fd, tmpname) = tempfile.mkstemp(dir=_registry_cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, _registry_cache_path(entry["uri"]))
+    except OSError as e:
+        print("Could not cache registry " + entry["uri"] + ": " + str(e))
+
+def _load_registry_file(filename):
+    filename = os.path.abspath(filename)
+    uri = "file://" + filename
+    st = os.stat(filename)
+    validator = (st.st_mtime_ns, st.st_size)
+
+    entry = _read_registry_cache(uri)
+    if entry is not None and entry["validator"] == validator:
+        return entry["registry"]
+
+    with open(filename, "r") as stream:
+        d = _read_registry_json(stream)
+    _write_registry_cache({"uri": uri, "validator": validator,
+                           "fetched": time.time(), "registry": d})
+    return d
+
+def _load_registry_uri(uri):
+    import urllib.request
+    import urllib.error
+
+    parsed = urllib.parse.urlparse(uri)
+    if parsed.scheme == "file":
+        return _load_registry_file(urllib.parse.unquote(parsed.path))
+
+    entry = _read_registry_cache(uri)
+    if entry is not None and \
+       time.time() - entry["fetched"] < _registry_cache_max_age:
+        return entry["registry"]
+
+    request = urllib.request.Request(uri)
+    if entry is not None:
+        (etag, modified) = entry["validator"]
+        if etag is not None:
+            request.add_header("If-None-Match", etag)
+        if modified is not None:
+            request.add_header("If-Modified-Since", modified)
+
+    try:
+        with urllib.request.urlopen(request) as stream:
+            d = _read_registry_json(stream)
+            validator = (stream.headers.get("ETag"),
+                         stream.headers.get("Last-Modified"))
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        if entry is None:
+            raise
+        if isinstance(e, urllib.error.HTTPError) and e.code == 304:
+            entry["fetched"] = time.time()
+            _write_registry_cache(entry)
+        else:
+            # registry host unreachable, fall back to the cached copy
+            print("Using cached registry " + uri + ": " + str(e))
+        return entry["registry"]
+
+    _write_registry_cache({"uri": uri, "validator": validator,
+                           "fetched": time.time(), "registry": d})
+    return d
+
 _base_registry = None
 _registries = collections.OrderedDict()
 
+# all elements from all loaded registries, by name; built lazily by
+# element() and dropped whenever a registry is loaded
+_element_index = None
+
+def _invalidate_element_index():
+    global _element_index
+    _element_index = None
+
+def _build_element_index():
+    """
+    Merge the loaded registries into a single name -> Element table,
+    giving earlier registries precedence over later ones and all of
+    them precedence over the base registry, as element() always has.
+
+    """
+    index = {}
+    for reg in _registries.values():
+        for name, elem in reg._elements.items():
+            index.setdefault(name, elem)
+    if _base_registry is not None:
+        for name, elem in _base_registry._elements.items():
+            index.setdefault(name, elem)
+    return index
+
 def preload_registry(filename=None):
     global _registries
     preloaded = Registry(filename=filename)
     _registries[preloaded.uri()] = preloaded
+    _invalidate_element_index()
 
 def registry_for_uri(uri):
     """
@@ -1701,6 +2218,7 @@ def registry_for_uri(uri):
 
     if uri not in _registries:
         _registries[uri] = Registry(uri=uri)
+        _invalidate_element_index()
 
     return _registries[uri]
 
@@ -1714,6 +2232,7 @@ def initialize_registry(uri=REGURI_DEFAULT):
     """
     global _base_registry
     _base_registry = registry_for_uri(uri)
+    _invalidate_element_index()
 
 def element(name, reguri=None):
     """
@@ -1721,14 +2240,14 @@ def element(name, reguri=None):
     If reguri is given, searches the speficied Registry,
     otherwise searches the base Registry.
     """
-    global _base_registry
-    global _registries
+    global _element_index
 
-    for reg in _registries:
-        if _registries[reg][name] != None:
-            return _registries[reg][name]
-    if _base_registry[name] != None:
-        return _base_registry[name]
+    if _element_index is None:
+        _element_index = _build_element_index()
+
+    elem = _element_index.get(name, None)
+    if elem is not None:
+        return elem
 
     # fall-through: no results
     raise KeyError("Key error: " + name + " not present in registries")
@@ -1766,6 +2285,56 @@ def test_registry():
     assert element("start").primitive_name() == "time"
     assert element("start").desc() == "Start time of an event/flow that may have a non-zero duration"
 
+    # the element index follows registry load order, and is rebuilt
+    # when another registry is loaded
+    global _registries
+    saved_registries = _registries
+    _registries = collections.OrderedDict(saved_registries)
+    try:
+        try:
+            element("testName")
+            assert False
+        except KeyError:
+            pass
+        preload_registry(os.path.join(os.path.dirname(__file__), os.pardir, "testdata", "registry_with_parent.json"))
+        assert element("testName").desc() == "testDesc"
+        for reg in _registries.values():
+            for name in reg._elements:
+                first = next(r[name] for r in _registries.values() if r[name] is not None)
+                assert element(name) is first
+    finally:
+        _registries = saved_registries
+        _invalidate_element_index()
+
+def test_registry_cache():
+    import shutil
+    tmpdir = tempfile.mkdtemp()
+    try:
+        set_registry_cache(os.path.join(tmpdir, "cache"))
+
+        # local registries are cached and revalidated by mtime
+        regfile = os.path.join(tmpdir, "registry.json")
+        shutil.copy(os.path.join(os.path.dirname(__file__), os.pardir, "testdata", "registry_with_parent.json"), regfile)
+        assert Registry(filename=regfile)["end"].desc() == "overwritten end"
+        assert os.path.exists(_registry_cache_path("file://" + regfile))
+        entry = _read_registry_cache("file://" + regfile)
+        entry["registry"][KEY_ELEMENTS][1][KEY_ELEMDESC] = "cached end"
+        _write_registry_cache(entry)
+        assert Registry(filename=regfile)["end"].desc() == "cached end"
+        os.utime(regfile, ns=(0, 0))
+        assert Registry(filename=regfile)["end"].desc() == "overwritten end"
+
+        # remote registries fall back to the cache when unreachable
+        uri = "http://127.0.0.1:9/registry.json"
+        entry["uri"] = uri
+        entry["validator"] = ("\"etag\"", None)
+        entry["fetched"] = 0
+        _write_registry_cache(entry)
+        assert Registry(uri=uri)["end"].desc() == "cached end"
+    finally:
+        set_registry_cache(None)
+        shutil.rmtree(tmpdir)
+
 #######################################################################
 # Constraints
 #######################################################################
@@ -1795,6 +2364,14 @@ class _Constraint(object):
         """Determines if this constraint is met by a given value."""
         return True
 
+    def met_by_values(self, vals):
+        """
+        Determines for each of an iterable of values whether it meets
+        this constraint, returning a list of booleans.
+
+        """
+        return [True for val in vals]
+
     def single_value(self):
         """
         If this constraint only allows a single value, return it.
@@ -1838,6 +2415,11 @@ class _RangeConstraint(_Constraint):
         """Determines if the value is within the range"""
         return (val >= self.a) and (val <= self.b)
 
+    def met_by_values(self, vals):
+        """Determines for each value whether it is within the range"""
+        (a, b) = (self.a, self.b)
+        return [a <= val <= b for val in vals]
+
     def single_value(self):
         """If this constraint only allows a single value, return it. Otherwise, return None."""
         if self.a == self.b:
@@ -1845,19 +2427,69 @@ class _RangeConstraint(_Constraint):
         else:
             return None
 
+class _AddressPrefixSet(object):
+    """
+    A set of IPv4 and/or IPv6 networks. Membership of an address is
+    checked with one set lookup per distinct prefix length, however
+    many networks there are.
+
+    """
+    def __init__(self, networks):
+        self.networks = list(networks)
+        prefixes = {}
+        for net in self.networks:
+            shift = net.max_prefixlen - net.prefixlen
+            prefixes.setdefault((net.version, shift), set()).add(
+                    int(net.network_address) >> shift)
+        self._prefixes = [(version, shift, nets)
+                          for ((version, shift), nets) in prefixes.items()]
+
+    def __len__(self):
+        return len(self.networks)
+
+    def __contains__(self, addr):
+        try:
+            (version, val) = (addr.version, int(addr))
+        except (AttributeError, TypeError):
+            return False
+        for (net_version, shift, nets) in self._prefixes:
+            if net_version == version and (val >> shift) in nets:
+                return True
+        return False
+
 class _SetConstraint(_Constraint):
-    """Represents acceptable values as a discrete set."""
+    """
+    Represents acceptable values as a discrete set. Address sets
+    may also contain networks (e.g. 10.0.0.0/8), which accept all
+    addresses within them.
+
+    """
     def __init__(self, prim, sval=None, vs=None):
         super().__init__(prim)
+        self._networks = None
         if sval is not None:
-            self.vs = set(map(self._prim.parse, sval.split(SET_SEP)))
+            svals = sval.split(SET_SEP)
+            if prim is prim_address and any("/" in v for v in svals):
+                self._networks = _AddressPrefixSet(
+                        ip_network(v.strip(), strict=False)
+                        for v in svals if "/" in v)
+                svals = [v for v in svals if "/" not in v]
+            self.vs = set(map(self._prim.parse, svals))
         elif vs is not None:
             self.vs = vs
         else:
             self.vs = set()
 
+        if len(self.vs) == 1 and self._networks is None:
+            self._single = next(iter(self.vs))
+        else:
+            self._single = None
+
     def __str__(self):
-        return SET_SEP.join(map(self._prim.unparse, self.vs))
+        strs = list(map(self._prim.unparse, self.vs))
+        if self._networks is not None:
+            strs.extend(map(str, self._networks.networks))
+        return SET_SEP.join(strs)
 
     def __repr__(self):
         return "mplane.model.SetConstraint("+repr(self._prim)+\
@@ -1865,14 +2497,20 @@ class _SetConstraint(_Constraint):
 
     def met_by(self, val):
         """Determines if the value is a mamber of the set"""
-        return val in self.vs
+        return val in self.vs or \
+               (self._networks is not None and val in self._networks)
+
+    def met_by_values(self, vals):
+        """Determines for each value whether it is a member of the set"""
+        vs = self.vs
+        if self._networks is None:
+            return [val in vs for val in vals]
+        networks = self._networks
+        return [val in vs or val in networks for val in vals]
 
     def single_value(self):
         """If this constraint only allows a single value, return it. Otherwise, return None."""
-        if len(self.vs) == 1:
-            return list(self.vs)[0]
-        else:
-            return None
+        return self._single
 
 def parse_constraint(prim, sval):
     """
@@ -1903,11 +2541,65 @@ def test_constraints():
     sc = parse_constraint(prim_address,"10.0.27.100,10.0.28.103")
     assert sc.met_by(ip_address('10.0.28.103'))
     assert not sc.met_by(ip_address('10.0.27.103'))
+    assert sc.single_value() is None
+    assert parse_constraint(prim_natural, "7").single_value() == 7
+
+    # batch checks
+    assert rc.met_by_values([-1, 0, 99, 100]) == [False, True, True, False]
+    assert constraint_all.met_by_values([1, None]) == [True, True]
+    nc = parse_constraint(prim_address,
+                          "10.0.0.0/8,192.168.1.0/24,10.1.2.3,2001:db8::/32")
+    addrs = ["10.0.27.103", "192.168.1.17", "192.168.2.17",
+             "2001:db8::1", "2001:db9::1", "11.0.0.1"]
+    assert nc.met_by_values(map(ip_address, addrs)) == \
+           [True, True, False, True, False, False]
+    assert nc.met_by(ip_address("10.1.2.3"))
+    assert nc.single_value() is None
+    assert parse_constraint(prim_address, str(nc)).met_by_values(
+            map(ip_address, addrs)) == [True, True, False, True, False, False]
+    param = Parameter(Element("destination.ip4", prim_address), constraint=nc)
+    assert param.can_set_values(addrs) == [True, True, False, True, False, False]
 
 #######################################################################
 # Statements
 #######################################################################
 
+def _md5_digest(hstr):
+    return hashlib.md5(hstr.encode('utf-8')).hexdigest()
+
+def _fast_digest(hstr):
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(hstr.encode('utf-8'))
+    return hashlib.blake2b(hstr.encode('utf-8'), digest_size=16).hexdigest()
+
+def _copy_params(params):
+    """
+    Copies a statement's parameters. Elements, primitives and constraints
+    are immutable, so the copies share them with the originals.
+
+    """
+    return collections.OrderedDict((k, copy(v)) for (k, v) in params.items())
+
+def _copy_schema_columns(resultcolumns):
+    """Makes empty result columns with the same names and primitives."""
+    return collections.OrderedDict((k, ResultColumn(v))
+                                   for (k, v) in resultcolumns.items())
+
+_token_digests = {"md5": _md5_digest, "fast": _fast_digest}
+_token_digest = _md5_digest
+
+def set_token_digest(name="md5"):
+    """
+    Selects the digest used for statement tokens and schema hashes.
+    "md5" (the default) produces the tokens other mPlane implementations
+    expect; "fast" uses xxh3 (if the xxhash module is available) or
+    BLAKE2b, and is only suitable where all parties use this setting.
+    Call this before creating any statements.
+
+    """
+    global _token_digest
+    _token_digest = _token_digests[name]
+
 class Parameter(Element):
     """
     A Parameter is an element which can take a constraint and a value.
@@ -1979,6 +2671,17 @@ class Parameter(Element):
 
         return self._constraint.met_by(val)
 
+    def can_set_values(self, vals):
+        """
+        Checks an iterable of values at once, as can_set_value() does
+        for each, returning a list of booleans.
+
+        """
+        parse = self._prim.parse
+        return self._constraint.met_by_values(
+                    [parse(val) if isinstance(val, str) else val
+                     for val in vals])
+
     def set_value(self, val):
         """
         Sets the value of the Parameter.
@@ -2039,6 +2742,57 @@ class Metavalue(Element):
     def _as_tuple(self):
         return (self._name, self._prim.unparse(self._val))
 
+_EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+
+class _ColumnCodec(object):
+    """
+    Describes how the values of a primitive are packed into an
+    array.array: the array type code, the type of values which can be
+    stored without changing their type, a test for such values, and
+    conversions in and out. Codecs pickle by the name of their
+    primitive, so columns holding them can be pickled.
+
+    """
+    def __init__(self, name, typecode, vtype, accepts, encode=None, decode=None):
+        self.name = name
+        self.typecode = typecode
+        self.vtype = vtype
+        self.accepts = accepts
+        self.encode = encode
+        self.decode = decode
+
+    def __reduce__(self):
+        return (_column_codec, (self.name,))
+
+def _column_codec(name):
+    return _column_codecs[name]
+
+def _is_natural(v):
+    return type(v) is int
+
+def _is_real(v):
+    return type(v) is float
+
+def _is_boolean(v):
+    return type(v) is bool
+
+def _is_naive_time(v):
+    return type(v) is datetime and v.tzinfo is None
+
+def _encode_time(v):
+    return (v - _EPOCH) // _ONE_US
+
+def _decode_time(v):
+    return _EPOCH + timedelta(microseconds=v)
+
+_column_codecs = {
+    "natural": _ColumnCodec("natural", "q", int, _is_natural),
+    "real": _ColumnCodec("real", "d", float, _is_real),
+    "boolean": _ColumnCodec("boolean", "b", bool, _is_boolean, int, bool),
+    "time": _ColumnCodec("time", "q", datetime, _is_naive_time,
+                         _encode_time, _decode_time) }
+
 class ResultColumn(Element):
     """
     A ResultColumn is an element which can take an array of values.
@@ -2046,10 +2800,16 @@ class ResultColumn(Element):
     Results it has one or more values, such that all the ResultColumns
     in the Result have the same number of values.
 
+    Natural, real, boolean and time columns are stored in a typed
+    array with a mask marking missing values. A column falls back to
+    a plain list as soon as it is given a value the array cannot hold
+    unchanged (e.g. a float in a natural column, or a special time).
+
     """
     def __init__(self, parent_element):
         super().__init__(parent_element._name, parent_element._prim)
-        self._vals = []
+        self._codec = _column_codecs.get(self._prim.name)
+        self.clear()
 
     def __repr__(self):
         return "<ResultColumn "+str(self)+" "+repr(self._prim)+\
@@ -2058,33 +2818,286 @@ class ResultColumn(Element):
     def __len__(self):
         return len(self._vals)
 
+    def _decode(self, i):
+        if not self._mask[i]:
+            return None
+        val = self._vals[i]
+        if self._codec.decode is not None:
+            val = self._codec.decode(val)
+        return val
+
+    def _to_list(self):
+        self._vals = list(self)
+        self._mask = None
+        self._codec = None
+
     def __getitem__(self, key):
-        return self._vals[key]
+        if self._mask is None:
+            return self._vals[key]
+        elif isinstance(key, slice):
+            return [self._decode(i) for i in range(*key.indices(len(self)))]
+        else:
+            return self._decode(key)
 
     def __setitem__(self, key, val):
         # Automatically parse strings
         if isinstance(val, str):
             val = self._prim.parse(val)
 
+        if self._mask is not None and \
+                val is not None and not self._codec.accepts(val):
+            self._to_list()
+
         # Automatically extend column to fit
-        while len(self) < key:
-            self._vals.append(None)
+        if len(self) < key:
+            self._pad(key - len(self))
+
+        if self._mask is None:
+            if len(self) == key:
+                self._vals.append(val)
+            else:
+                self._vals[key] = val
+            return
 
-        # Append or replace value
-        if len(self) == key:
-            self._vals.append(val)
+        if val is None:
+            (present, val) = (0, 0)
+        else:
+            present = 1
+            if self._codec.encode is not None:
+                val = self._codec.encode(val)
+
+        try:
+            if len(self) == key:
+                self._vals.append(val)
+                self._mask.append(present)
+            else:
+                self._vals[key] = val
+                self._mask[key] = present
+        except OverflowError:
+            # only naturals beyond 64 bits get here, and those are
+            # stored unencoded
+            self._to_list()
+            self[key] = val
+
+    def _pad(self, count):
+        if self._mask is None:
+            self._vals.extend([None] * count)
         else:
-            self._vals[key] = val
+            self._vals.frombytes(bytes(count * self._vals.itemsize))
+            self._mask.extend(bytes(count))
 
     def __delitem__(self, key):
         del(self._vals[key])
+        if self._mask is not None:
+            del(self._mask[key])
 
     def __iter__(self):
-        return iter(self._vals)
+        if self._mask is None:
+            return iter(self._vals)
+        decode = self._codec.decode
+        if 0 not in self._mask:
+            if decode is None:
+                return iter(self._vals)
+            return map(decode, self._vals)
+        if decode is None:
+            return (v if present else None
+                    for (v, present) in zip(self._vals, self._mask))
+        return (decode(v) if present else None
+                for (v, present) in zip(self._vals, self._mask))
 
     def clear(self):
         """ Clears values. """
-        self._vals.clear()
+        if self._codec is None:
+            self._vals = []
+            self._mask = None
+        else:
+            self._vals = array(self._codec.typecode)
+            self._mask = bytearray()
+
+    def set_values(self, vals):
+        """
+        Replaces this column's values with those in an iterable.
+        Strings are parsed as for single values.
+
+        """
+        self._codec = _column_codecs.get(self._prim.name)
+        self.clear()
+        self.extend(vals)
+
+    def extend(self, vals):
+        """
+        Appends the values in an iterable to this column.
+        Strings are parsed as for single values.
+
+        """
+        vals = list(vals)
+        types = set(map(type, vals))
+        if str in types:
+            parse = self._prim.parse
+            vals = [parse(v) if isinstance(v, str) else v for v in vals]
+            types = set(map(type, vals))
+
+        codec = self._codec
+        has_none = type(None) in types
+        types.discard(type(None))
+        if self._mask is not None and types <= {codec.vtype}:
+            encode = codec.encode
+            try:
+                if has_none:
+                    mask = bytes(v is not None for v in vals)
+                    if encode is None:
+                        packed = [0 if v is None else v for v in vals]
+                    else:
+                        packed = [0 if v is None else encode(v) for v in vals]
+                else:
+                    mask = b"\x01" * len(vals)
+                    packed = vals if encode is None else list(map(encode, vals))
+                self._vals.extend(array(codec.typecode, packed))
+                self._mask.extend(mask)
+                return
+            except (OverflowError, TypeError):
+                # naturals beyond 64 bits, or times with a timezone
+                pass
+
+        if self._mask is not None:
+            self._to_list()
+        self._vals.extend(vals)
+
+    def _numpy_dtype(self):
+        """
+        Returns the NumPy dtype of this column's values: typed when
+        the column is, object otherwise.
+
+        """
+        import numpy
+
+        if self._mask is None:
+            return numpy.dtype(object)
+        elif self._prim is prim_time:
+            return numpy.dtype("datetime64[us]")
+        elif self._prim is prim_boolean:
+            return numpy.dtype(bool)
+        return numpy.dtype(self._codec.typecode)
+
+    def _has_missing(self, length):
+        """
+        Returns True if any of the first length values of
+        this column is missing.
+
+        """
+        if len(self) < length:
+            return True
+        elif self._mask is None:
+            return any(v is None for v in self._vals[:length])
+        return 0 in self._mask[:length]
+
+    def _numpy_values(self, start, stop):
+        """
+        Returns this column's values from row start up to row stop
+        as a NumPy array of the column's _numpy_dtype(), along with a
+        boolean array marking missing values. Missing reals and times
+        become NaN and NaT, other missing typed values zero.
+
+        """
+        import numpy
+
+        count = stop - start
+        if self._mask is None:
+            # rows beyond the end of the column stay None
+            vals = numpy.empty(count, dtype=object)
+            for (i, val) in enumerate(self[start:stop]):
+                vals[i] = val
+            missing = numpy.fromiter((v is None for v in vals),
+                                     dtype=bool, count=count)
+            return (vals, missing)
+
+        vals = self._vals[start:stop]
+        mask = bytes(self._mask[start:stop])
+        if len(mask) < count:
+            vals.frombytes(bytes((count - len(mask)) * vals.itemsize))
+            mask += bytes(count - len(mask))
+        missing = numpy.frombuffer(mask, dtype=numpy.uint8) == 0
+        vals = numpy.frombuffer(vals, dtype=numpy.dtype(vals.typecode))
+        if self._prim is prim_time:
+            vals = vals.view("datetime64[us]").copy()
+            vals[missing] = numpy.datetime64("NaT")
+        elif self._prim is prim_real:
+            vals = vals.copy()
+            vals[missing] = numpy.nan
+        else:
+            vals = vals.astype(self._numpy_dtype())
+        return (vals, missing)
+
+    def _unparse_values(self, start, stop):
+        """
+        Returns a list of strings representing this column's values
+        from row start up to row stop, padded with the representation
+        of missing values.
+
+        """
+        unparse = self._prim.unparse
+        none_str = unparse(None)
+        vals = self._vals[start:stop]
+        if self._mask is None:
+            strs = [unparse(v) for v in vals]
+        elif self._prim is prim_natural or self._prim is prim_real:
+            strs = [str(v) if present else none_str
+                    for (v, present) in zip(vals, self._mask[start:stop])]
+        else:
+            decode = self._codec.decode
+            strs = [unparse(decode(v)) if present else none_str
+                    for (v, present) in zip(vals, self._mask[start:stop])]
+        if len(strs) < stop - start:
+            strs.extend([none_str] * (stop - start - len(strs)))
+        return strs
+
+    def _packed(self, length):
+        """
+        Returns the first length values of this column for binary
+        encodings: typed columns as their array's little-endian bytes
+        plus the mask, other columns as a list of strings, as for JSON.
+
+        """
+        if self._mask is None:
+            return self._unparse_values(0, length)
+
+        vals = self._vals[:length]
+        mask = bytes(self._mask[:length])
+        if len(vals) < length:
+            vals.frombytes(bytes((length - len(vals)) * vals.itemsize))
+            mask += bytes(length - len(mask))
+        if sys.byteorder != "little":
+            vals.byteswap()
+
+        return {KEY_PACKEDTYPE: vals.typecode,
+                KEY_PACKEDVALUES: vals.tobytes(),
+                KEY_PACKEDMASK: mask}
+
+    def _set_packed(self, packed):
+        """
+        Replaces this column's values with those returned by _packed().
+
+        """
+        if not isinstance(packed, dict):
+            self.set_values(packed)
+            return
+
+        codec = _column_codecs.get(self._prim.name)
+        if codec is None or packed[KEY_PACKEDTYPE] != codec.typecode:
+            raise ValueError("Cannot unpack "+repr(packed[KEY_PACKEDTYPE])+
+                             " values into "+repr(self))
+        vals = array(codec.typecode)
+        vals.frombytes(packed[KEY_PACKEDVALUES])
+        if sys.byteorder != "little":
+            vals.byteswap()
+        mask = bytearray(packed[KEY_PACKEDMASK])
+        if len(mask) != len(vals):
+            raise ValueError("Packed values and mask of "+repr(self)+
+                             " differ in length")
+
+        self._codec = codec
+        self._vals = vals
+        self._mask = mask
 
 class Statement(object):
     """
@@ -2100,6 +3113,7 @@ class Statement(object):
     def __init__(self, dictval=None, verb=VERB_MEASURE, label=None, token=None, when=None, reguri=None):
         super().__init__()
         # Make a blank statement
+        self._hashes = {}
         self._version = MPLANE_VERSION
         self._params = collections.OrderedDict()
         self._metadata = collections.OrderedDict()
@@ -2158,6 +3172,7 @@ class Statement(object):
         self._params[elem_name] = Parameter(element(elem_name, reguri=self._reguri),
                                             constraint=constraint,
                                             val = val)
+        self._invalidate_hashes()
 
     def has_parameter(self, elem_name):
         """Returns True if the statement has a parameter with the given name."""
@@ -2195,12 +3210,20 @@ class Statement(object):
         """Programatically sets a value for a parameter on this Statement."""
         elem = self._params[elem_name]
         elem.set_value(value)
+        self._invalidate_hashes()
 
     def can_set_parameter_value(self, elem_name, value):
         """Determines whether a given Parameter can take a value."""
         elem = self._params[elem_name]
         return elem.can_set_value(value)
 
+    def can_set_parameter_values(self, elem_name, values):
+        """
+        Determines for each of an iterable of values whether a given
+        Parameter can take it, returning a list of booleans.
+        """
+        return self._params[elem_name].can_set_values(values)
+
     def get_single_parameter_value(self, elem_name):
         """
         If a given parameter is single-valued returns
@@ -2211,6 +3234,7 @@ class Statement(object):
     def add_metadata(self, elem_name, val):
         """Programatically adds a metadata element to this Statement."""
         self._metadata[elem_name] = Metavalue(element(elem_name, reguri=self._reguri), val)
+        self._invalidate_hashes()
 
     def has_metadata(self, elem_name):
         """Returns True if the statement has a metadata element with the given name."""
@@ -2227,6 +3251,7 @@ class Statement(object):
     def add_result_column(self, elem_name):
         """Programatically adds a result column to this Statement."""
         self._resultcolumns[elem_name] = ResultColumn(element(elem_name, reguri=self._reguri))
+        self._invalidate_hashes()
 
     def has_result_column(self, elem_name):
         """Returns True if the statement has results column with the given name."""
@@ -2266,6 +3291,7 @@ class Statement(object):
     def set_export(self, export):
         """Sets the Statement's export URL."""
         self._export = export
+        self._invalidate_hashes()
 
     def get_label(self):
         """Returns the Statement's label."""
@@ -2294,6 +3320,27 @@ class Statement(object):
             raise ValueError("Cannot set temporal scope "+str(when)+
                              " within "+str(self._when))
         self._when = when
+        self._invalidate_hashes(when_only=True)
+
+    def _invalidate_hashes(self, when_only=False):
+        """
+        Forgets memoized hashes after this statement has changed.
+        If only the temporal scope changed, the parts of the hashed
+        strings which do not depend on it are kept.
+
+        """
+        if when_only:
+            for key in ("pv", "mpcv"):
+                self._hashes.pop(key, None)
+        else:
+            self._hashes.clear()
+
+    def _memo_hash(self, key, hstr_fn):
+        hstr = self._hashes.get(key)
+        if hstr is None:
+            hstr = hstr_fn()
+            self._hashes[key] = hstr
+        return hstr
 
     def _schema_hash(self, lim=None):
         """
@@ -2301,15 +3348,34 @@ class Statement(object):
         and result columns (the schema) of this statement.
 
         """
-        sstr = self._reguri + \
-               " p " + " ".join(sorted(self._params.keys())) + \
-               " r " + " ".join(sorted(self._resultcolumns.keys()))
-        hstr = hashlib.md5(sstr.encode('utf-8')).hexdigest()
+        hstr = self._memo_hash("schema", lambda: _token_digest(
+                    self._reguri +
+                    " p " + " ".join(sorted(self._params.keys())) +
+                    " r " + " ".join(sorted(self._resultcolumns.keys()))))
         if lim is not None:
             return hstr[:lim]
         else:
             return hstr
 
+    def _pv_tail(self):
+        spk = sorted(self._params.keys())
+        spv = [self._params[k].unparse(self._params[k].get_value()) for k in spk]
+        return " pk " + " ".join(spk) + \
+               " pv " + " ".join(spv) + \
+               " r " + " ".join(sorted(self._resultcolumns.keys()))
+
+    def _mpcv_tail(self):
+        spk = sorted(self._params.keys())
+        spc = [str(self._params[k]._constraint) for k in spk]
+        spv = [self._params[k].unparse(self._params[k].get_value()) for k in spk]
+        smk = sorted(self._metadata.keys())
+        smv = [self._metadata[k].unparse(self._metadata[k].get_value()) for k in smk]
+        return " pk " + " ".join(spk) + \
+               " pc " + " ".join(spc) + " pv " + " ".join(spv) + \
+               " mk " + " ".join(smk) + " mv " + " ".join(smv) + \
+               " r " + " ".join(sorted(self._resultcolumns.keys())) + \
+               " ex " + str(self._export)
+
     def _pv_hash(self, lim=None, astr=None):
         """
         Returns a hex string uniquely identifying the set of parameters,
@@ -2317,15 +3383,14 @@ class Statement(object):
         of this statement. Used as a specification key.
 
         """
-        spk = sorted(self._params.keys())
-        spv = [self._params[k].unparse(self._params[k].get_value()) for k in spk]
-        tstr = self._reguri + self._verb + " w " + str(self._when) +\
-               " pk " + " ".join(spk) + \
-               " pv " + " ".join(spv) + \
-               " r " + " ".join(sorted(self._resultcolumns.keys()))
+        def pv_str():
+            return self._reguri + self._verb + " w " + str(self._when) + \
+                   self._memo_hash("pv_tail", self._pv_tail)
+
         if astr:
-            tstr += astr
-        hstr = hashlib.md5(tstr.encode('utf-8')).hexdigest()
+            hstr = _token_digest(pv_str() + astr)
+        else:
+            hstr = self._memo_hash("pv", lambda: _token_digest(pv_str()))
         if lim is not None:
             return hstr[:lim]
         else:
@@ -2339,21 +3404,14 @@ class Statement(object):
         Used as a complete token for statements.
 
         """
-        spk = sorted(self._params.keys())
-        spc = [str(self._params[k]._constraint) for k in spk]
-        spv = [self._params[k].unparse(self._params[k].get_value()) for k in spk]
-        smk = sorted(self._metadata.keys())
-        smv = [self._metadata[k].unparse(self._metadata[k].get_value()) for k in smk]
-        tstr = self._reguri + self._verb + \
-               " w " + str(self._when) + \
-               " pk " + " ".join(spk) + \
-               " pc " + " ".join(spc) + " pv " + " ".join(spv) + \
-               " mk " + " ".join(smk) + " mv " + " ".join(smv) + \
-               " r " + " ".join(sorted(self._resultcolumns.keys())) + \
-               " ex " + str(self._export)
+        def mpcv_str():
+            return self._reguri + self._verb + " w " + str(self._when) + \
+                   self._memo_hash("mpcv_tail", self._mpcv_tail)
+
         if astr:
-            tstr += astr
-        hstr = hashlib.md5(tstr.encode('utf-8')).hexdigest()
+            hstr = _token_digest(mpcv_str() + astr)
+        else:
+            hstr = self._memo_hash("mpcv", lambda: _token_digest(mpcv_str()))
         if lim is not None:
             return hstr[:lim]
         else:
@@ -2378,18 +3436,17 @@ class Statement(object):
     def _default_token(self):
       return self._mpcv_hash()
 
-    def _result_rows(self):
-        rows = []
-        for row_index in range(self.count_result_rows()):
-            row = []
-            rows.append(row)
-            for col in self._resultcolumns.values():
-                try:
-                    valstr = col._prim.unparse(col[row_index])
-                except IndexError:
-                    valstr = VALUE_NONE
-                row.append(valstr)
-        return rows
+    def _result_rows(self, start=0, stop=None):
+        if stop is None:
+            stop = self.count_result_rows()
+        columns = [col._unparse_values(start, stop)
+                   for col in self._resultcolumns.values()]
+        return [list(row) for row in zip(*columns)]
+
+    def _result_row_chunks(self, size):
+        row_count = self.count_result_rows()
+        for start in range(0, row_count, size):
+            yield self._result_rows(start, min(start + size, row_count))
 
     def to_dict(self, token_only=False):
         """
@@ -2398,6 +3455,9 @@ class Statement(object):
         argument of the appropriate statement constructor.
 
         """
+        return self._to_dict(token_only)
+
+    def _to_dict(self, token_only=False, with_values=True):
         self.validate()
         d = collections.OrderedDict()
         d[self.kind_str()] = self._verb
@@ -2430,7 +3490,7 @@ class Statement(object):
 
         if self.count_result_columns() > 0:
             d[KEY_RESULTS] = [k for k in self._resultcolumns.keys()]
-            if self.count_result_rows() > 0:
+            if with_values and self.count_result_rows() > 0:
                 d[KEY_RESULTVALUES] = self._result_rows()
 
         return d
@@ -2489,9 +3549,12 @@ class Statement(object):
             for v in d[KEY_RESULTS]:
                 self.add_result_column(v)
 
+        self._invalidate_hashes()
+
     def _clear_constraints(self):
         for param in self._params.values():
             param._clear_constraint()
+        self._invalidate_hashes()
 
 class Capability(Statement):
     """
@@ -2569,8 +3632,8 @@ class Specification(Statement):
             self._verb = capability._verb
             self._label = capability._label
             self._metadata = capability._metadata
-            self._params = deepcopy(capability._params)
-            self._resultcolumns = deepcopy(capability._resultcolumns)
+            self._params = _copy_params(capability._params)
+            self._resultcolumns = _copy_schema_columns(capability._resultcolumns)
             self._reguri = capability._reguri
 
             # inherit from capability only when necessary
@@ -2646,18 +3709,28 @@ class Specification(Statement):
         (i.e., has a repeated Temporal Scope); otherwise yields self once. Each subordinate
         specification has an absolute temporal scope derived from this specification's
         relative temporal scope and schedule.
+
+        Subordinate specifications share their parameters, metadata and result
+        columns with this specification and only own their temporal scope and
+        token, so they must not be modified.
         """
         if self._when.is_repeated():
-            subspec = deepcopy(self)  # Brian does not like that but he said it is okay
+            # hash the parts shared by all subspecs only once
+            self._memo_hash("pv_tail", self._pv_tail)
 
-            iter = self._when.iterator()
-            while 1:
-                subspec._when = next(iter)
-                subspec.retoken(True)
-                yield subspec
+            for when in self._when.iterator():
+                yield self._subspec(when)
         else:
             yield self
 
+    def _subspec(self, when):
+        subspec = copy(self)
+        subspec._when = when
+        subspec._hashes = dict(self._hashes)
+        subspec._invalidate_hashes(when_only=True)
+        subspec.retoken(True)
+        return subspec
+
 
 class Result(Statement):
     """
@@ -2673,8 +3746,8 @@ class Result(Statement):
             self._verb = specification._verb
             self._label = specification._label
             self._metadata = specification._metadata
-            self._params = deepcopy(specification._params)
-            self._resultcolumns = deepcopy(specification._resultcolumns)
+            self._params = _copy_params(specification._params)
+            self._resultcolumns = _copy_schema_columns(specification._resultcolumns)
             self._reguri = specification._reguri
             # assign token from specification
             self._token = specification.get_token()
@@ -2720,9 +3793,18 @@ class Result(Statement):
         column_key = list(self._resultcolumns.keys())
 
         if KEY_RESULTVALUES in d:
-            for i, row in enumerate(d[KEY_RESULTVALUES]):
-                for j, val in enumerate(row):
-                    self._resultcolumns[column_key[j]][i] = val
+            rows = d[KEY_RESULTVALUES]
+            if all(len(row) == len(column_key) for row in rows):
+                # fill in whole columns at once
+                for (key, vals) in zip(column_key, zip(*rows)):
+                    self._resultcolumns[key].set_values(vals)
+            else:
+                for i, row in enumerate(rows):
+                    for j, val in enumerate(row):
+                        self._resultcolumns[column_key[j]][i] = val
+        elif KEY_RESULTPACKED in d:
+            for (key, packed) in zip(column_key, d[KEY_RESULTPACKED]):
+                self._resultcolumns[key]._set_packed(packed)
 
     def set_result_value(self, elem_name, val, row_index=0):
         """
@@ -2730,18 +3812,327 @@ class Result(Statement):
         """
         self._resultcolumns[elem_name][row_index] = val
 
+    def set_result_column(self, elem_name, vals):
+        """
+        Sets all values of a result column at once from an iterable,
+        replacing any values already in the column.
+        """
+        self._resultcolumns[elem_name].set_values(vals)
+
+    def append_rows(self, rows, columns=None):
+        """
+        Appends rows of result values from an iterable of tuples, after
+        any rows already in this result. Each tuple holds the values of
+        the named columns, in order; columns defaults to all result
+        columns, in schema order. Columns not named are left without
+        values in the new rows.
+
+        """
+        if columns is None:
+            columns = list(self._resultcolumns.keys())
+        targets = [self._resultcolumns[name] for name in columns]
+
+        rows = list(rows)
+        if set(map(len, rows)) - {len(targets)}:
+            raise ValueError("Rows must have one value for each of "+
+                             repr(columns))
+
+        if not rows:
+            return
+
+        start = self.count_result_rows()
+        for (j, col) in enumerate(targets):
+            if len(col) < start:
+                col._pad(start - len(col))
+            col.extend(map(operator.itemgetter(j), rows))
+
+    def iter_rows(self, columns=None, chunk_size=None):
+        """
+        Iterates over the rows in this result, yielding a tuple of the
+        values of the named columns (all result columns, in schema
+        order, by default) for each row.
+
+        If chunk_size is given, yields NumPy structured arrays of up to
+        chunk_size rows each instead, with one field per column. Each
+        field has the same dtype in every chunk: typed for natural,
+        real, boolean and time columns stored in typed arrays, object
+        otherwise. If any value in the result is missing, every chunk
+        is a masked array, with missing values masked.
+
+        """
+        if columns is None:
+            columns = list(self._resultcolumns.keys())
+        targets = [self._resultcolumns[name] for name in columns]
+        row_count = self.count_result_rows()
+
+        if chunk_size is not None:
+            import numpy
+            # settle the layout once, so that all chunks share it
+            dtype = numpy.dtype([(name, col._numpy_dtype())
+                                 for (name, col) in zip(columns, targets)])
+            masked = any(col._has_missing(row_count) for col in targets)
+            for start in range(0, row_count, chunk_size):
+                stop = min(start + chunk_size, row_count)
+                chunk = numpy.empty(stop - start, dtype=dtype)
+                if masked:
+                    mask = numpy.empty(stop - start,
+                                       dtype=[(name, bool) for name in columns])
+                for (name, col) in zip(columns, targets):
+                    (vals, missing) = col._numpy_values(start, stop)
+                    chunk[name] = vals
+                    if masked:
+                        mask[name] = missing
+                if masked:
+                    chunk = numpy.ma.array(chunk, mask=mask)
+                yield chunk
+            return
+
+        iters = []
+        for col in targets:
+            if len(col) < row_count:
+                iters.append(itertools.chain(col,
+                                itertools.repeat(None, row_count - len(col))))
+            else:
+                iters.append(iter(col))
+        yield from zip(*iters)
+
     def schema_dict_iterator(self):
         """
         Iterates over each row in this result, yielding a dictionary
         mapping all parameter and result column names to their values.
 
         """
-        for i in range(self.count_result_rows()):
-            d = self.parameter_values()
-            for k in self.result_column_names():
-                d[k] = self._resultcolumns[k][i]
+        pv = self.parameter_values()
+        names = list(self._resultcolumns.keys())
+        for row in self.iter_rows(names):
+            d = dict(pv)
+            d.update(zip(names, row))
             yield d
 
+def test_statement_hashes():
+    initialize_registry()
+    cap = Capability()
+    cap.set_when("now ... future / 1s")
+    cap.add_parameter("destination.ip4")
+    cap.add_result_column("delay.twoway.icmp.us")
+    schema = cap._schema_hash()
+    cap.add_result_column("packets.lost")
+    assert cap._schema_hash() != schema
+
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    spec.set_when("2037-12-24 22:18:42 + 1m / 1s")
+    token = spec._pv_hash()
+    assert spec._pv_hash() == token
+    spec.set_parameter_value("destination.ip4", "10.0.37.3")
+    assert spec._pv_hash() != token
+
+    # memoized hashes match a freshly built statement
+    other = Specification(capability=cap)
+    other.set_parameter_value("destination.ip4", "10.0.37.3")
+    other.set_when("2037-12-24 22:18:42 + 1m / 1s")
+    assert other._pv_hash() == spec._pv_hash()
+    assert other._mpcv_hash() == spec._mpcv_hash()
+
+    token = spec._pv_hash()
+    spec.set_when("2037-12-24 22:18:42 + 30s / 1s")
+    assert spec._pv_hash() != token
+
+    md5_token = spec._pv_hash()
+    set_token_digest("fast")
+    try:
+        spec._invalidate_hashes()
+        assert len(spec._pv_hash()) == len(md5_token)
+        assert spec._pv_hash() != md5_token
+    finally:
+        set_token_digest("md5")
+
+def test_result_columns():
+    initialize_registry()
+    cap = Capability()
+    cap.set_when("now ... future")
+    cap.add_parameter("destination.ip4")
+    for col in ("time", "delay.twoway.icmp.us", "snr", "connectivity.ip"):
+        cap.add_result_column(col)
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    res = Result(specification=spec)
+    res.set_when("2037-12-24 22:18:42 ... 2037-12-24 22:19:42")
+
+    t0 = datetime(2037, 12, 24, 22, 18, 42, 250)
+    res.set_result_column("time", [t0, t0 + timedelta(seconds=1), None])
+    res.set_result_column("snr", ["1.5", 2.25, 3.0])
+    res.set_result_value("delay.twoway.icmp.us", 1200, 2)
+    res.set_result_value("connectivity.ip", True, 1)
+    res.set_result_value("connectivity.ip", None, 2)
+
+    delay = res._resultcolumns["delay.twoway.icmp.us"]
+    assert delay._mask is not None
+    assert list(delay) == [None, None, 1200]
+    assert list(res._resultcolumns["time"]) == [t0, t0 + timedelta(seconds=1), None]
+    assert res._resultcolumns["connectivity.ip"][1] is True
+    assert res._resultcolumns["snr"][0:2] == [1.5, 2.25]
+    assert res.count_result_rows() == 3
+
+    # values the array can't hold unchanged turn the column into a list
+    delay[0] = 2 ** 70
+    delay[1] = 12.5
+    assert delay._mask is None
+    assert list(delay) == [2 ** 70, 12.5, 1200]
+    del(delay[0:2])
+    delay[1] = 1300
+    delay[2] = 1400
+
+    back = Result(dictval=res.to_dict())
+    for name in res.result_column_names():
+        assert list(back._resultcolumns[name]) == list(res._resultcolumns[name])
+    assert back._result_rows() == res._result_rows()
+
+    # typed columns pickle, e.g. to reach a process pool worker
+    import pickle
+    back = pickle.loads(pickle.dumps(res))
+    assert back._result_rows() == res._result_rows()
+    assert back._resultcolumns["time"]._codec is _column_codecs["time"]
+    assert back._resultcolumns["snr"]._prim is prim_real
+    assert pickle.loads(pickle.dumps(spec)).get_token() == spec.get_token()
+    assert res._result_rows()[2] == ["*", "1400", "3.0", "*"]
+
+    # times with a timezone are kept as given, in a plain list
+    aware = datetime(2037, 12, 24, 22, 18, 42, tzinfo=timezone.utc)
+    col = Result(specification=spec)._resultcolumns["time"]
+    col.set_values([aware, None])
+    assert list(col) == [aware, None]
+    col[2] = t0
+    assert list(col) == [aware, None, t0]
+    col = Result(specification=spec)._resultcolumns["time"]
+    col[0] = t0
+    col[1] = aware
+    assert col._mask is None
+    assert list(col) == [t0, aware]
+
+def test_result_rows():
+    initialize_registry()
+    cap = Capability()
+    cap.set_when("now ... future")
+    cap.add_parameter("destination.ip4")
+    for col in ("time", "delay.twoway.icmp.us", "snr", "connectivity.ip"):
+        cap.add_result_column(col)
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    res = Result(specification=spec)
+    res.set_when("2037-12-24 22:18:42 ... 2037-12-24 22:19:42")
+
+    t0 = datetime(2037, 12, 24, 22, 18, 42)
+    res.append_rows([(t0, 1200, 1.5, True),
+                     (None, None, None, False),
+                     ("2037-12-24 22:18:44", "1400", "2.5", "True")])
+    assert res._resultcolumns["delay.twoway.icmp.us"]._mask is not None
+    res.append_rows([(1500,), (2 ** 70,)], ["delay.twoway.icmp.us"])
+    assert res.count_result_rows() == 5
+
+    rows = list(res.iter_rows())
+    assert rows[0] == (t0, 1200, 1.5, True)
+    assert rows[1] == (None, None, None, False)
+    assert rows[2] == (t0 + timedelta(seconds=2), 1400, 2.5, True)
+    assert rows[4] == (None, 2 ** 70, None, None)
+    assert list(res.iter_rows(["snr", "time"]))[0] == (1.5, t0)
+
+    # the same rows set cell by cell
+    other = Result(specification=spec)
+    other.set_when(res.when())
+    for (i, row) in enumerate(rows):
+        for (name, val) in zip(res.result_column_names(), row):
+            if val is not None:
+                other.set_result_value(name, val, i)
+    assert other._result_rows() == res._result_rows()
+
+    res.append_rows([(t0, 1, 1.0, True)])
+    assert res.count_result_rows() == 6
+    dicts = list(res.schema_dict_iterator())
+    assert dicts[5]["destination.ip4"] == ip_address("10.0.37.2")
+    assert dicts[5]["time"] == t0
+
+    try:
+        res.append_rows([(t0, 1)])
+        assert False, "rows must match the columns"
+    except ValueError:
+        pass
+
+    # times with a timezone are kept as given, in a plain list
+    aware = datetime(2037, 12, 24, 22, 18, 42, tzinfo=timezone.utc)
+    col = Result(specification=spec)._resultcolumns["time"]
+    col.set_values([aware, None])
+    assert list(col) == [aware, None]
+    col.extend([t0])
+    assert list(col) == [aware, None, t0]
+    aware_res = Result(specification=spec)
+    aware_res.append_rows([(aware,)], ["time"])
+    assert list(aware_res.iter_rows(["time"])) == [(aware,)]
+
+def test_result_row_chunks():
+    try:
+        import numpy
+    except ImportError:
+        from unittest import SkipTest
+        raise SkipTest("numpy is not installed")
+
+    initialize_registry()
+    cap = Capability()
+    cap.set_when("now ... future")
+    cap.add_parameter("destination.ip4")
+    for col in ("delay.twoway.icmp.us", "connectivity.ip", "source.ip4"):
+        cap.add_result_column(col)
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    res = Result(specification=spec)
+    res.set_when("2037-12-24 22:18:42 ... 2037-12-24 22:19:42")
+
+    # complete rows give plain arrays
+    res.append_rows([(1200, True, "10.0.27.2"), (1300, False, "10.0.27.3")])
+    chunks = list(res.iter_rows(chunk_size=1))
+    assert [type(c) for c in chunks] == [numpy.ndarray] * 2
+    assert chunks[0].dtype == chunks[1].dtype
+    assert chunks[1]["delay.twoway.icmp.us"][0] == 1300
+
+    # a value missing from the last chunk only masks every chunk,
+    # each with the same dtype
+    res.append_rows([(1400,)], ["delay.twoway.icmp.us"])
+    chunks = list(res.iter_rows(chunk_size=2))
+    assert len(chunks) == 2
+    assert all(isinstance(c, numpy.ma.MaskedArray) for c in chunks)
+    assert chunks[0].dtype == chunks[1].dtype
+    assert chunks[0].dtype["delay.twoway.icmp.us"] == numpy.int64
+    assert chunks[0].dtype["connectivity.ip"] == numpy.bool_
+    assert chunks[0].dtype["source.ip4"] == numpy.dtype(object)
+    assert not chunks[0].mask["connectivity.ip"].any()
+    assert list(chunks[1].mask["connectivity.ip"]) == [True]
+    assert list(chunks[1].mask["source.ip4"]) == [True]
+    assert chunks[1]["delay.twoway.icmp.us"][0] == 1400
+
+def test_subspecs():
+    initialize_registry()
+    cap = Capability()
+    cap.set_when("now ... future / 1s")
+    cap.add_parameter("source.ip4", "10.0.27.2")
+    cap.add_parameter("destination.ip4")
+    cap.add_result_column("delay.twoway.icmp.us")
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    spec.set_when("repeat now + 1m / 10s { now + 1s / 1s }")
+
+    subspecs = list(spec.subspec_iterator())
+    assert len(subspecs) == 7
+    assert len(set(str(s.when()) for s in subspecs)) == 7
+    assert len(set(s.get_token() for s in subspecs)) == 7
+    assert all(s._params is spec._params for s in subspecs)
+    assert subspecs[0].get_token() == subspecs[0]._pv_hash()
+
+    res = Result(specification=subspecs[0])
+    assert res.get_token() == subspecs[0].get_token()
+    assert res._params["source.ip4"]._constraint is constraint_all
+    assert spec._params["source.ip4"]._constraint is not constraint_all
+    res.set_result_value("delay.twoway.icmp.us", 1000)
+    assert spec.count_result_rows() == 0
 
 #######################################################################
 # Notifications
@@ -2831,8 +4222,8 @@ class _StatementNotification(Statement):
             self._when = statement._when
             self._reguri = statement._reguri
             self._metadata = statement._metadata
-            self._params = deepcopy(statement._params)
-            self._resultcolumns = deepcopy(statement._resultcolumns)
+            self._params = _copy_params(statement._params)
+            self._resultcolumns = _copy_schema_columns(statement._resultcolumns)
             self._token = statement.get_token()
             self._reguri = statement._reguri
 
@@ -2977,11 +4368,15 @@ class Envelope(object):
         return KIND_ENVELOPE
 
     def to_dict(self, token_only=False):
+        return self._to_dict(token_only)
+
+    def _to_dict(self, token_only=False, with_contents=True):
         d = {}
         d[self.kind_str()] = self._content_type
         d[KEY_VERSION] = self._version
 
-        d[KEY_CONTENTS] = [m.to_dict(token_only=token_only) for m in self.messages()]
+        if with_contents:
+            d[KEY_CONTENTS] = [m.to_dict(token_only=token_only) for m in self.messages()]
 
         if self._token is not None:
             d[KEY_TOKEN] = self._token
@@ -3010,8 +4405,13 @@ class Envelope(object):
         if KEY_LABEL in d:
           self._label = d[KEY_LABEL]
 
+        # contents are only decoded when used (see _LazyMessage)
         for md in d[KEY_CONTENTS]:
-            self.append_message(message_from_dict(md))
+            cls = _message_class(md)
+            if cls is Envelope:
+                self.append_message(cls(dictval=md))
+            else:
+                self.append_message(_LazyMessage(cls, md))
 
     def get_label(self):
         """ Returns the label or None if no label has been set """
@@ -3035,12 +4435,7 @@ class Envelope(object):
 # Utility methods
 #######################################################################
 
-def message_from_dict(d):
-    """
-    Given a dictionary returned from to_dict(), return a decoded
-    mPlane message (statement or notification).
-
-    """
+def _message_class(d):
     classmap = { KIND_CAPABILITY : Capability,
                  KIND_SPECIFICATION : Specification,
                  KIND_RESULT : Result,
@@ -3053,9 +4448,82 @@ def message_from_dict(d):
 
     for k in classmap.keys():
         if k in d:
-            return classmap[k](dictval = d)
+            return classmap[k]
     raise ValueError("Cannot determine message type from "+repr(d))
 
+def message_from_dict(d):
+    """
+    Given a dictionary returned from to_dict(), return a decoded
+    mPlane message (statement or notification).
+
+    """
+    return _message_class(d)(dictval = d)
+
+class _LazyMessage(object):
+    """
+    Stands in for a message in a decoded Envelope, keeping the dictionary
+    it came from and only decoding it the first time it is used.
+    isinstance(), kind_str(), and (where the dictionary carries them)
+    get_token() and get_label() work without decoding; anything else
+    is passed on to the decoded message.
+
+    """
+    __slots__ = ("_lazy_class", "_lazy_dict", "_lazy_msg")
+
+    def __init__(self, cls, d):
+        object.__setattr__(self, "_lazy_class", cls)
+        object.__setattr__(self, "_lazy_dict", d)
+        object.__setattr__(self, "_lazy_msg", None)
+
+    @property
+    def __class__(self):
+        return self._lazy_class
+
+    def _decoded(self):
+        msg = self._lazy_msg
+        if msg is None:
+            msg = self._lazy_class(dictval=self._lazy_dict)
+            object.__setattr__(self, "_lazy_msg", msg)
+            object.__setattr__(self, "_lazy_dict", None)
+        return msg
+
+    def __getattr__(self, name):
+        return getattr(self._decoded(), name)
+
+    def __setattr__(self, name, val):
+        setattr(self._decoded(), name, val)
+
+    def __repr__(self):
+        return repr(self._decoded())
+
+    def __copy__(self):
+        return copy(self._decoded())
+
+    def __deepcopy__(self, memo):
+        from copy import deepcopy
+        return deepcopy(self._decoded(), memo)
+
+    def __reduce_ex__(self, protocol):
+        return self._decoded().__reduce_ex__(protocol)
+
+    def kind_str(self):
+        return self._lazy_class.kind_str(self)
+
+    def get_token(self, *args, **kwargs):
+        d = self._lazy_dict
+        if d is not None:
+            if self._lazy_class is Exception:
+                return d[KIND_EXCEPTION]
+            if KEY_TOKEN in d and not (args or kwargs):
+                return d[KEY_TOKEN]
+        return self._decoded().get_token(*args, **kwargs)
+
+    def get_label(self):
+        d = self._lazy_dict
+        if d is not None and issubclass(self._lazy_class, Statement):
+            return d.get(KEY_LABEL, None)
+        return self._decoded().get_label()
+
 def parse_json(jstr):
     """
     Parse a JSON object in a string and return the associated mPlane message.
@@ -3063,20 +4531,212 @@ def parse_json(jstr):
     """
     return message_from_dict(json.loads(jstr))
 
-def unparse_json(msg, token_only=False):
+def read_json(stream):
+    """
+    Read a JSON object from a file-like object and return the associated
+    mPlane message. Result values are filled in a column at a time.
+
+    """
+    return message_from_dict(json.load(stream))
+
+def _json_encoder(compact):
+    if compact:
+        return json.JSONEncoder(sort_keys=True, separators=(',',':'))
+    else:
+        return json.JSONEncoder(sort_keys=True, indent=2, separators=(',',': '))
+
+def unparse_json(msg, token_only=False, compact=False):
     """
     Transform an mPlane message into a JSON object representing it. If
     token_only is True, uses tokens only for message types for which that is
     appropriate (i.e. Reciepts, Redemptions, Withdrawals, and Interrupts).
+    If compact is True, leaves out all optional whitespace, for the wire.
+
+    """
+    return _json_encoder(compact).encode(msg.to_dict(token_only=token_only))
 
+JSON_STREAM_ROWS = 1000
+
+def iter_json(msg, token_only=False, compact=False):
+    """
+    Transform an mPlane message into JSON as unparse_json() does, but
+    yield it in pieces: result values JSON_STREAM_ROWS rows at a time,
+    and the contents of envelopes one message at a time. The whole
+    message never exists as a single dictionary or string.
+
+    """
+    yield from _iter_json(msg, token_only, compact, _json_encoder(compact))
+
+_json_row_encoder = json.JSONEncoder(separators=(',',':'))
+
+def _iter_json(msg, token_only, compact, encoder):
+    # one result row or envelope message per line unless compact
+    sep = "," if compact else ",\n"
+    if isinstance(msg, Envelope):
+        key = KEY_CONTENTS
+        head = encoder.encode(msg._to_dict(token_only, with_contents=False))
+        items = (''.join(_iter_json(m, token_only, compact, encoder))
+                 for m in msg.messages())
+    elif isinstance(msg, Statement) and msg.count_result_rows() > 0:
+        key = KEY_RESULTVALUES
+        head = encoder.encode(msg._to_dict(token_only, with_values=False))
+        items = (sep.join(map(_json_row_encoder.encode, rows))
+                 for rows in msg._result_row_chunks(JSON_STREAM_ROWS))
+    else:
+        yield encoder.encode(msg.to_dict(token_only=token_only))
+        return
+
+    # reopen the object and append the key whose value is streamed
+    if compact:
+        yield head[:head.rindex("}")] + ',"' + key + '":['
+    else:
+        yield head[:head.rindex("}")].rstrip() + ',\n"' + key + '": ['
+
+    first = True
+    for item in items:
+        if first:
+            yield item
+            first = False
+        else:
+            yield sep + item
+    yield "]}"
+
+def write_json(msg, stream, token_only=False, compact=False):
+    """
+    Write an mPlane message as JSON to a file-like object,
+    piece by piece (see iter_json()).
+
+    """
+    for chunk in iter_json(msg, token_only=token_only, compact=compact):
+        stream.write(chunk)
+
+CONTENT_TYPE_JSON = "application/x-mplane+json"
+CONTENT_TYPE_MSGPACK = "application/x-mplane+msgpack"
+
+def _packed_dict(msg, token_only):
+    if isinstance(msg, Envelope):
+        d = msg._to_dict(token_only, with_contents=False)
+        d[KEY_CONTENTS] = [_packed_dict(m, token_only) for m in msg.messages()]
+    elif isinstance(msg, Result) and msg.count_result_rows() > 0:
+        d = msg._to_dict(token_only, with_values=False)
+        rows = msg.count_result_rows()
+        d[KEY_RESULTPACKED] = [col._packed(rows)
+                               for col in msg._resultcolumns.values()]
+    else:
+        d = msg.to_dict(token_only=token_only)
+    return d
+
+def unparse_msgpack(msg, token_only=False):
+    """
+    Transform an mPlane message into MessagePack bytes. Natural, real,
+    boolean and time result columns travel as packed arrays (times in
+    microseconds since the epoch) rather than rows of strings.
+    Requires the msgpack module.
+
+    """
+    if msgpack is None:
+        raise ValueError("MessagePack encoding requires the msgpack module")
+    return msgpack.packb(_packed_dict(msg, token_only), use_bin_type=True)
+
+def parse_msgpack(data):
+    """
+    Parse MessagePack bytes produced by unparse_msgpack()
+    and return the associated mPlane message.
+
+    """
+    if msgpack is None:
+        raise ValueError("MessagePack encoding requires the msgpack module")
+    return message_from_dict(msgpack.unpackb(data, raw=False))
+
+def message_content_types():
+    """
+    Returns the content types of the mPlane message encodings
+    available, most compact first.
+
+    """
+    if msgpack is None:
+        return [CONTENT_TYPE_JSON]
+    return [CONTENT_TYPE_MSGPACK, CONTENT_TYPE_JSON]
+
+def _accept_ranges(accept):
+    """
+    Parses an HTTP Accept header into a dictionary
+    mapping each media range to its quality value.
+
+    """
+    ranges = {}
+    for item in accept.split(","):
+        params = item.split(";")
+        mrange = params[0].strip().lower()
+        if not mrange:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            (name, _, value) = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        ranges[mrange] = max(q, ranges.get(mrange, 0.0))
+    return ranges
+
+def negotiate_content_type(accept):
+    """
+    Given the Accept header of a request (or None), returns the content
+    type to encode the reply with: the available type with the highest
+    quality value, matched by its most specific media range. JSON
+    unless the peer names binary explicitly and prefers it at least as
+    much; JSON also if the peer accepts neither.
+
+    """
+    if msgpack is None or accept is None:
+        return CONTENT_TYPE_JSON
+    ranges = _accept_ranges(accept)
+    (best_key, best_type) = ((0.0,), CONTENT_TYPE_JSON)
+    for ctype in (CONTENT_TYPE_JSON, CONTENT_TYPE_MSGPACK):
+        matches = ((2, ctype), (1, ctype.split("/")[0] + "/*"), (0, "*/*"))
+        for (specificity, mrange) in matches:
+            if mrange in ranges:
+                key = (ranges[mrange], specificity,
+                       ctype == CONTENT_TYPE_MSGPACK and specificity == 2)
+                if ranges[mrange] > 0 and key > best_key:
+                    (best_key, best_type) = (key, ctype)
+                break
+    return best_type
+
+def parse_message(data, content_type):
+    """
+    Parse an mPlane message from a bytes or string body
+    according to its HTTP Content-Type.
+
+    """
+    if content_type is not None:
+        content_type = content_type.split(";")[0].strip().lower()
+    if content_type == CONTENT_TYPE_MSGPACK:
+        return parse_msgpack(data)
+    elif content_type == CONTENT_TYPE_JSON:
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return parse_json(data)
+    raise ValueError("Unsupported message content type "+repr(content_type))
+
+def unparse_message(msg, content_type, token_only=False, compact=False):
     """
-    return json.dumps(msg.to_dict(token_only=token_only),
-                      sort_keys=True, indent=2, separators=(',',': '))
+    Transform an mPlane message into bytes in the given encoding.
+
+    """
+    if content_type == CONTENT_TYPE_MSGPACK:
+        return unparse_msgpack(msg, token_only=token_only)
+    return unparse_json(msg, token_only=token_only,
+                        compact=compact).encode("utf-8")
 
 def parse_yaml(ystr):
-    return mplane.model.message_from_dict(yaml.load(ystr))
+    import yaml
+    return message_from_dict(yaml.safe_load(ystr))
 
 def unparse_yaml(msg):
+    import yaml
     return yaml.dump(dict(msg.to_dict()), default_flow_style=False, indent=4)
 
 def render_text(message):
@@ -3117,3 +4777,118 @@ def render(msg):
             out += "        %s\n" % (element)
 
     return out
+
+def test_json_streaming():
+    import io
+    initialize_registry()
+    cap = Capability()
+    cap.set_when("now ... future")
+    cap.add_parameter("destination.ip4")
+    cap.add_result_column("delay.twoway.icmp.us")
+    cap.add_result_column("snr")
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    env = Envelope(token="multijob", label="stream")
+    for i in range(3):
+        res = Result(specification=spec)
+        res.set_when("2037-12-24 22:18:42 ... 2037-12-24 22:19:42")
+        res.set_result_column("delay.twoway.icmp.us",
+                              range(i * JSON_STREAM_ROWS + 7))
+        res.set_result_column("snr", [0.5] * (i + 1))
+        env.append_message(res)
+    env.append_message(Exception(token="failed", errmsg="no route"))
+
+    for msg in (env, spec, Envelope()):
+        for compact in (False, True):
+            text = "".join(iter_json(msg, compact=compact))
+            assert json.loads(text) == \
+                   json.loads(unparse_json(msg, compact=compact))
+    assert "\n" not in unparse_json(env, compact=True)
+
+    stream = io.StringIO()
+    write_json(env, stream, compact=True)
+    stream.seek(0)
+    back = read_json(stream)
+    assert [m.count_result_rows() for m in back.messages()
+            if isinstance(m, Result)] == [7, 1007, 2007]
+
+def test_packed_results():
+    initialize_registry()
+    cap = Capability()
+    cap.set_when("now ... future")
+    cap.add_parameter("destination.ip4")
+    cap.add_result_column("time")
+    cap.add_result_column("delay.twoway.icmp.us")
+    cap.add_result_column("snr")
+    cap.add_result_column("source.ip4")
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    res = Result(specification=spec)
+    res.set_when("2037-12-24 22:18:42 ... 2037-12-24 22:19:42")
+    res.set_result_column("time", [datetime(2037, 12, 24, 22, 18, 42, 5),
+                                   None, datetime(1969, 7, 20, 20, 17)])
+    res.set_result_column("delay.twoway.icmp.us", [2**40, 0, None])
+    res.set_result_column("snr", [0.5])
+    res.set_result_column("source.ip4", ["10.0.27.2", None, "10.0.27.3"])
+    env = Envelope()
+    env.append_message(res)
+    env.append_message(spec)
+
+    # binary encodings carry the same messages as JSON
+    d = _packed_dict(env, False)
+    packed = d[KEY_CONTENTS][0][KEY_RESULTPACKED]
+    assert packed[0][KEY_PACKEDTYPE] == "q"
+    assert len(packed[2][KEY_PACKEDVALUES]) == 3 * 8
+    assert packed[2][KEY_PACKEDMASK] == b"\x01\x00\x00"
+    assert isinstance(packed[3], list)
+    back = message_from_dict(d)
+    assert unparse_json(back) == unparse_json(env)
+
+    try:
+        res._resultcolumns["snr"]._set_packed(packed[0])
+        assert False
+    except ValueError:
+        pass
+
+    # content type negotiation falls back to JSON
+    assert negotiate_content_type(None) == CONTENT_TYPE_JSON
+    assert negotiate_content_type("application/json") == CONTENT_TYPE_JSON
+    assert CONTENT_TYPE_JSON in message_content_types()
+    body = unparse_message(env, CONTENT_TYPE_JSON, compact=True)
+    assert unparse_json(parse_message(body, CONTENT_TYPE_JSON + "; charset=utf-8")) == \
+           unparse_json(env)
+    if msgpack is not None:
+        body = unparse_message(env, CONTENT_TYPE_MSGPACK)
+        assert unparse_json(parse_message(body, CONTENT_TYPE_MSGPACK)) == \
+               unparse_json(env)
+
+def test_lazy_envelope():
+    initialize_registry()
+    cap = Capability(label="lazy", token="captoken")
+    cap.set_when("now ... future")
+    cap.add_parameter("destination.ip4")
+    cap.add_result_column("delay.twoway.icmp.us")
+    spec = Specification(capability=cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    env = Envelope()
+    env.append_message(cap)
+    env.append_message(spec)
+    env.append_message(Exception(token="failed", errmsg="no route"))
+
+    back = parse_json(unparse_json(env))
+    (lcap, lspec, lexc) = back.messages()
+    assert isinstance(lcap, Capability) and not isinstance(lcap, Result)
+    assert isinstance(lexc, Exception)
+    assert lcap.kind_str() == KIND_CAPABILITY
+    assert lcap.get_label() == "lazy" and lcap.get_token() == "captoken"
+    assert lexc.get_token() == "failed"
+    assert lcap._lazy_msg is None and lexc._lazy_msg is None
+
+    # the spec carries no token, so asking for one decodes it
+    assert lspec.get_token() == spec.get_token()
+    assert lspec._lazy_msg is not None
+    assert lspec.get_parameter_value("destination.ip4") == ip_address("10.0.37.2")
+    lspec.set_label("relabeled")
+    assert lspec.get_label() == "relabeled"
+    assert copy(lspec).get_label() == "relabeled"
+    assert unparse_json(back) == unparse_json(parse_json(unparse_json(back)))
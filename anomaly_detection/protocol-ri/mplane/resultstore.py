@@ -0,0 +1,440 @@
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+##
+# mPlane Protocol Reference Implementation
+# Result stores for clients and supervisors
+#
+# (c) 2015 mPlane Consortium (http://www.ict-mplane.eu)
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Stores the results a client or supervisor has received.
+
+Results are recallable by token and by label, and are indexed by
+capability label, parameter values and temporal scope, so that
+the results of a measurement series within a time range can be
+found without looking at every result stored.
+
+A store optionally keeps at most max_results results, and drops
+results max_age seconds after they were stored.
+
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+import collections
+import json
+import sqlite3
+import threading
+import time
+
+import mplane.model
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+
+def parameter_key(parameters):
+    """
+    Returns a string identifying a set of parameter values, given as
+    a dictionary mapping parameter names to values or their string
+    representations.
+
+    """
+    return json.dumps(sorted((k, str(v)) for (k, v) in parameters.items()))
+
+def _key_matches(key, parameters):
+    """
+    Tells whether every parameter value identified by key (as returned
+    by parameter_key()) has the same value in the parameters given.
+    Parameters in the dictionary but not in key are ignored.
+
+    """
+    return all(name in parameters and str(parameters[name]) == value
+               for (name, value) in json.loads(key))
+
+def _series_of(msg):
+    """
+    Returns the label, parameter key, start and end time under which
+    a result is indexed, or None for messages which are not indexed.
+
+    """
+    if not isinstance(msg, mplane.model.Result) or msg.get_label() is None:
+        return None
+    (start, end) = msg.when().datetimes()
+    if not isinstance(start, datetime) or not isinstance(end, datetime):
+        return None
+    params = {name: msg.get_parameter_value(name)
+              for name in msg.parameter_names()}
+    return (msg.get_label(), parameter_key(params), start, end)
+
+class ResultStore(object):
+    """
+    Interface of result stores. Subclasses implement the storage.
+
+    """
+    def __init__(self, max_results=None, max_age=None):
+        self._max_results = max_results
+        self._max_age = max_age
+        self._lock = threading.RLock()
+
+    def add(self, msg, label=None):
+        """
+        Stores a result (or exception, or envelope), replacing any
+        stored under the same token. If a label is given, the result
+        is also recallable by that label.
+
+        """
+        raise NotImplementedError("Cannot instantiate an abstract ResultStore")
+
+    def remove(self, token):
+        """Removes the result with the given token, if any."""
+        raise NotImplementedError("Cannot instantiate an abstract ResultStore")
+
+    def get(self, token):
+        """Returns the result with the given token, or None."""
+        raise NotImplementedError("Cannot instantiate an abstract ResultStore")
+
+    def get_by_label(self, label):
+        """Returns the result last stored with the given label, or None."""
+        raise NotImplementedError("Cannot instantiate an abstract ResultStore")
+
+    def tokens(self):
+        """Returns a tuple of the tokens of all stored results."""
+        raise NotImplementedError("Cannot instantiate an abstract ResultStore")
+
+    def labels(self):
+        """Returns a tuple of the labels of all stored results."""
+        raise NotImplementedError("Cannot instantiate an abstract ResultStore")
+
+    def query(self, label, parameters=None, start=None, end=None):
+        """
+        Returns the results of the capability with the given label,
+        whose parameter values all appear in parameters (any, if None),
+        and whose temporal scope overlaps the time range from start to
+        end (unbounded where None), in order of start time. Entries in
+        parameters which a result has no parameter for are ignored.
+
+        """
+        raise NotImplementedError("Cannot instantiate an abstract ResultStore")
+
+    def close(self):
+        pass
+
+class _Series(object):
+    """
+    The results in one measurement series, ordered by start time.
+
+    """
+    def __init__(self):
+        self.starts = []
+        self.tokens = []
+        self.max_span = timedelta()
+
+    def add(self, start, end, token):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.tokens.insert(i, token)
+        if end - start > self.max_span:
+            self.max_span = end - start
+
+    def remove(self, start, token):
+        i = bisect_left(self.starts, start)
+        while self.tokens[i] != token:
+            i += 1
+        del self.starts[i]
+        del self.tokens[i]
+
+    def tokens_between(self, start, end):
+        # a result overlapping the range starts at most max_span before it
+        if start is None:
+            lo = 0
+        else:
+            lo = bisect_left(self.starts, start - self.max_span)
+        if end is None:
+            hi = len(self.starts)
+        else:
+            hi = bisect_right(self.starts, end)
+        return zip(self.starts[lo:hi], self.tokens[lo:hi])
+
+class MemoryResultStore(ResultStore):
+    """
+    Keeps results in memory.
+
+    """
+    def __init__(self, max_results=None, max_age=None):
+        super().__init__(max_results, max_age)
+        # token -> (message, label, time stored), oldest first
+        self._results = collections.OrderedDict()
+        self._labels = {}
+        # token -> (label, parameter key, start, end)
+        self._indexed = {}
+        # label -> parameter key -> _Series
+        self._series = {}
+
+    def __len__(self):
+        return len(self._results)
+
+    def add(self, msg, label=None):
+        token = msg.get_token()
+        with self._lock:
+            self.remove(token)
+            self._results[token] = (msg, label, time.time())
+            if label is not None:
+                self._labels[label] = token
+
+            index = _series_of(msg)
+            if index is not None:
+                (series_label, key, start, end) = index
+                self._indexed[token] = index
+                self._series.setdefault(series_label, {}) \
+                            .setdefault(key, _Series()).add(start, end, token)
+
+            self._expire()
+
+    def _expire(self):
+        if self._max_age is not None:
+            limit = time.time() - self._max_age
+            while self._results and \
+                    next(iter(self._results.values()))[2] < limit:
+                self.remove(next(iter(self._results)))
+        if self._max_results is not None:
+            while len(self._results) > self._max_results:
+                self.remove(next(iter(self._results)))
+
+    def remove(self, token):
+        with self._lock:
+            if token not in self._results:
+                return
+            (msg, label, stored) = self._results.pop(token)
+            if label is not None and self._labels.get(label) == token:
+                del self._labels[label]
+
+            index = self._indexed.pop(token, None)
+            if index is not None:
+                (series_label, key, start, end) = index
+                by_key = self._series[series_label]
+                by_key[key].remove(start, token)
+                if not by_key[key].starts:
+                    del by_key[key]
+                    if not by_key:
+                        del self._series[series_label]
+
+    def get(self, token):
+        with self._lock:
+            entry = self._results.get(token)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def get_by_label(self, label):
+        with self._lock:
+            token = self._labels.get(label)
+            if token is None:
+                return None
+            return self.get(token)
+
+    def tokens(self):
+        with self._lock:
+            return tuple(self._results.keys())
+
+    def labels(self):
+        with self._lock:
+            return tuple(self._labels.keys())
+
+    def query(self, label, parameters=None, start=None, end=None):
+        with self._lock:
+            by_key = self._series.get(label, {})
+            if parameters is None:
+                series = list(by_key.values())
+            else:
+                series = [s for (key, s) in by_key.items()
+                          if _key_matches(key, parameters)]
+
+            found = []
+            for s in series:
+                for (t, token) in s.tokens_between(start, end):
+                    if start is None or self._indexed[token][3] >= start:
+                        found.append((t, self._results[token][0]))
+
+        found.sort(key=lambda entry: entry[0])
+        return [msg for (t, msg) in found]
+
+def _us(t):
+    return (t - _EPOCH) // _ONE_US
+
+class SqliteResultStore(ResultStore):
+    """
+    Keeps results in an SQLite database at the given path, which
+    persists between runs. Results are stored as JSON.
+
+    """
+    def __init__(self, path, max_results=None, max_age=None):
+        super().__init__(max_results, max_age)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # one commit per result; don't wait for the disk on each
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                             "token TEXT PRIMARY KEY, label TEXT, "
+                             "series_label TEXT, params TEXT, "
+                             "t_start INTEGER, t_end INTEGER, "
+                             "stored REAL, message TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_series "
+                             "ON results (series_label, params, t_start)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_label "
+                             "ON results (label)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_stored "
+                             "ON results (stored)")
+
+        # longest result per series, to bound time range queries
+        self._max_span = {}
+        for (series_label, params, span) in self._db.execute(
+                "SELECT series_label, params, MAX(t_end - t_start) "
+                "FROM results WHERE series_label IS NOT NULL "
+                "GROUP BY series_label, params"):
+            self._max_span[(series_label, params)] = span
+        (self._count,) = self._db.execute(
+                "SELECT COUNT(*) FROM results").fetchone()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, msg, label=None):
+        index = _series_of(msg)
+        if index is None:
+            index = (None, None, None, None)
+            row_times = (None, None)
+        else:
+            row_times = (_us(index[2]), _us(index[3]))
+
+        with self._lock, self._db:
+            if index[0] is not None:
+                span = row_times[1] - row_times[0]
+                if span > self._max_span.get(index[0:2], -1):
+                    self._max_span[index[0:2]] = span
+            self.remove(msg.get_token())
+            if label is not None:
+                # a label refers to the result last stored with it
+                self._db.execute("UPDATE results SET label = NULL "
+                                 "WHERE label = ?", (label,))
+            self._db.execute("INSERT INTO results VALUES (?,?,?,?,?,?,?,?)",
+                             (msg.get_token(), label, index[0], index[1],
+                              row_times[0], row_times[1], time.time(),
+                              mplane.model.unparse_json(msg, compact=True)))
+            self._count += 1
+            self._expire()
+
+    def _expire(self):
+        if self._max_age is not None:
+            cursor = self._db.execute("DELETE FROM results WHERE stored < ?",
+                                      (time.time() - self._max_age,))
+            self._count -= cursor.rowcount
+        if self._max_results is not None and self._count > self._max_results:
+            cursor = self._db.execute(
+                    "DELETE FROM results WHERE token IN (SELECT token "
+                    "FROM results ORDER BY stored LIMIT ?)",
+                    (self._count - self._max_results,))
+            self._count -= cursor.rowcount
+
+    def remove(self, token):
+        with self._lock, self._db:
+            cursor = self._db.execute("DELETE FROM results WHERE token = ?",
+                                      (token,))
+            self._count -= cursor.rowcount
+
+    def _parse(self, row):
+        if row is None:
+            return None
+        return mplane.model.parse_json(row[0])
+
+    def get(self, token):
+        with self._lock:
+            return self._parse(self._db.execute(
+                "SELECT message FROM results WHERE token = ?",
+                (token,)).fetchone())
+
+    def get_by_label(self, label):
+        with self._lock:
+            return self._parse(self._db.execute(
+                "SELECT message FROM results WHERE label = ?",
+                (label,)).fetchone())
+
+    def tokens(self):
+        with self._lock:
+            return tuple(row[0] for row in self._db.execute(
+                "SELECT token FROM results ORDER BY stored"))
+
+    def labels(self):
+        with self._lock:
+            return tuple(row[0] for row in self._db.execute(
+                "SELECT label FROM results WHERE label IS NOT NULL "
+                "ORDER BY stored"))
+
+    def query(self, label, parameters=None, start=None, end=None):
+        sql = "SELECT message FROM results WHERE series_label = ?"
+        args = [label]
+        with self._lock:
+            if parameters is None:
+                spans = [span for ((l, p), span) in self._max_span.items()
+                         if l == label]
+            else:
+                keys = [p for (l, p) in self._max_span
+                        if l == label and _key_matches(p, parameters)]
+                if not keys:
+                    return []
+                sql += " AND params IN (" + ",".join("?" * len(keys)) + ")"
+                args.extend(keys)
+                spans = [self._max_span[(label, key)] for key in keys]
+            if start is not None:
+                sql += " AND t_start >= ? AND t_end >= ?"
+                args.extend((_us(start) - max(spans, default=0), _us(start)))
+            if end is not None:
+                sql += " AND t_start <= ?"
+                args.append(_us(end))
+            sql += " ORDER BY t_start"
+
+            rows = self._db.execute(sql, args).fetchall()
+        return [self._parse(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def store_from_config(config):
+    """
+    Returns the result store configured in the [client] section of
+    a configuration: result_store is either 'memory' (the default) or
+    'sqlite:' followed by a database path; result_max_count and
+    result_max_age (in seconds) limit how many results are kept,
+    and for how long.
+
+    """
+    options = config["client"] if "client" in config else {}
+    max_results = None
+    max_age = None
+    if "result_max_count" in options:
+        max_results = int(options["result_max_count"])
+    if "result_max_age" in options:
+        max_age = float(options["result_max_age"])
+
+    kind = options.get("result_store", "memory")
+    if kind == "memory":
+        return MemoryResultStore(max_results, max_age)
+    elif kind.startswith("sqlite:"):
+        return SqliteResultStore(kind[len("sqlite:"):], max_results, max_age)
+    else:
+        raise ValueError("result_store must be 'memory' or 'sqlite:<path>', not "
+                         + repr(kind))
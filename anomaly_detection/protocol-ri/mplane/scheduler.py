@@ -29,10 +29,28 @@ results within the mPlane reference component.
 """
 
 from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+import collections
 import threading
+import heapq
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
 import mplane.model
 import mplane.azn
 
+# Default size of the worker thread pool shared by all jobs of a scheduler
+DEFAULT_MAX_WORKERS = 32
+DEFAULT_JOB_TTL = 3600
+DEFAULT_PRUNE_INTERVAL = 60
+
+def _never_interrupted():
+    # check_interrupt stand-in for services run in a worker process,
+    # which cannot see the job's interrupt event
+    return False
+
 class Service(object):
     """
     A Service binds some runnable code to an
@@ -79,6 +97,320 @@ class Service(object):
         return "<Service for "+repr(self._capability)+">"
 
 
+class TimerHandle(object):
+    """
+    Handle for a callback scheduled on a DelayQueue;
+    use cancel() to drop the callback before it runs.
+
+    """
+    __slots__ = ("deadline", "_fn", "_queue")
+
+    def __init__(self, queue, deadline, fn):
+        self._queue = queue
+        self.deadline = deadline
+        self._fn = fn
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+    def cancel(self):
+        """
+        Cancel the callback. Returns True if it had not yet
+        run (or been cancelled), False otherwise.
+
+        """
+        return self._queue._cancel(self)
+
+    def cancelled(self):
+        """Returns True if the callback has been cancelled or has run."""
+        return self._fn is None
+
+class DelayQueue(object):
+    """
+    Runs callbacks after a delay from a single timer thread, keeping
+    pending callbacks in a heap ordered by deadline. Replaces one
+    threading.Timer (and so one sleeping OS thread) per delay.
+
+    Cancelled callbacks are dropped lazily when they reach the top of
+    the heap; the heap is compacted when more than half of it is
+    cancelled, so withdrawn jobs do not hold on to memory.
+
+    Callbacks run on the timer thread, so they should be short;
+    anything long-running should be handed to an Executor. close()
+    drops pending callbacks and stops the timer thread.
+
+    """
+    def __init__(self):
+        super(DelayQueue, self).__init__()
+        self._heap = []
+        self._cancelled = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __len__(self):
+        """Returns the number of callbacks waiting to run."""
+        return len(self._heap) - self._cancelled
+
+    def call_later(self, delay, fn):
+        """
+        Call fn (without arguments) after delay seconds.
+        Returns a TimerHandle which can be used to cancel the call.
+
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("cannot schedule a callback on a closed DelayQueue")
+            handle = TimerHandle(self, time.monotonic() + delay, fn)
+            heapq.heappush(self._heap, handle)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="mplane-timer")
+                self._thread.daemon = True
+                self._thread.start()
+            # only wake the timer thread if its next deadline changed
+            if self._heap[0] is handle:
+                self._cond.notify()
+        return handle
+
+    def _cancel(self, handle):
+        with self._cond:
+            if handle._fn is None:
+                return False
+            handle._fn = None
+            self._cancelled += 1
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [h for h in self._heap if h._fn is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+            return True
+
+    def close(self, wait=True):
+        """
+        Drop all pending callbacks and stop the timer thread,
+        waiting for a running callback to return if wait is true.
+        Callbacks can no longer be scheduled once closed.
+
+        """
+        with self._cond:
+            self._closed = True
+            for handle in self._heap:
+                handle._fn = None
+            self._heap = []
+            self._cancelled = 0
+            self._cond.notify()
+            thread = self._thread
+        if wait and thread is not None and \
+                thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    head = self._heap[0]
+                    if head._fn is None:
+                        heapq.heappop(self._heap)
+                        self._cancelled -= 1
+                        continue
+                    wait = head.deadline - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        fn = head._fn
+                        head._fn = None
+                        break
+                    self._cond.wait(wait)
+            try:
+                fn()
+            except Exception as e:
+                print("Got exception in timer callback: "+repr(e))
+
+class Executor(object):
+    """
+    Runs Jobs on a bounded pool of worker threads instead of a thread
+    per job, with a single DelayQueue for start and interrupt timers.
+
+    max_workers bounds the number of jobs running concurrently.
+    max_queue (if nonzero) bounds the number of jobs waiting for a
+    worker; submissions beyond it are refused. service_limits maps a
+    capability label to the maximum number of concurrently running jobs
+    for that service; further jobs for it wait in a per-service backlog
+    without occupying a worker. If process_workers is nonzero, services
+    with a true cpu_bound attribute have their run() method called in a
+    pool of worker processes; such services must be picklable, and
+    cannot be interrupted once running. The worker thread which hands
+    a job to the process pool is freed at once; the job completes from
+    a callback when the process returns, and only then makes room for
+    the next job of its service.
+
+    Functions submitted with dedicated=True (the jobs of relay services,
+    which block until a remote measurement ends) run on a thread of
+    their own rather than a pool worker, so that long relays cannot
+    starve the pool; max_queue and service_limits still apply to them.
+
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_queue=0,
+                 service_limits=None, process_workers=0):
+        super(Executor, self).__init__()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        if process_workers > 0:
+            # multiprocessing is only imported when a process pool is used
+            from concurrent.futures import ProcessPoolExecutor
+            self._process_pool = ProcessPoolExecutor(max_workers=process_workers)
+        else:
+            self._process_pool = None
+        self._timers = DelayQueue()
+        self._max_queue = max_queue
+        self._service_limits = dict(service_limits or {})
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = collections.Counter()
+        self._backlog = collections.defaultdict(collections.deque)
+
+    def call_later(self, delay, fn):
+        """
+        Call fn after delay seconds from the shared timer thread.
+        Returns a TimerHandle for cancellation.
+
+        """
+        return self._timers.call_later(delay, fn)
+
+    def timer_count(self):
+        """Returns the number of pending timers."""
+        return len(self._timers)
+
+    def submit(self, fn, key=None, dedicated=False):
+        """
+        Run fn on a worker thread, or on a new thread of its own if
+        dedicated is true, subject to the limit for the service
+        identified by key. Returns False if the queue is full and fn
+        was not accepted.
+
+        """
+        with self._lock:
+            if self._max_queue and self._queued >= self._max_queue:
+                return False
+            self._queued += 1
+            limit = self._service_limits.get(key)
+            if limit and self._running[key] >= limit:
+                self._backlog[key].append(fn)
+                return True
+            self._running[key] += 1
+        if dedicated:
+            t = threading.Thread(target=self._work, args=(fn, key))
+            t.daemon = True
+            t.start()
+        else:
+            self._pool.submit(self._work, fn, key)
+        return True
+
+    def _work(self, fn, key):
+        while fn is not None:
+            with self._lock:
+                self._queued -= 1
+            try:
+                pending = fn()
+            except Exception as e:
+                print("Got exception in worker: "+repr(e))
+                pending = None
+
+            # a function returning an unfinished Future (a job running in
+            # a worker process) keeps its service's slot until it is done,
+            # but not this thread
+            if isinstance(pending, Future) and not pending.done():
+                pending.add_done_callback(lambda f: self._release(key))
+                return
+
+            fn = self._next_for(key)
+
+    def _next_for(self, key):
+        # take the next job for the same service, if one is waiting
+        with self._lock:
+            if self._backlog.get(key):
+                return self._backlog[key].popleft()
+            self._running[key] -= 1
+            return None
+
+    def _release(self, key):
+        fn = self._next_for(key)
+        if fn is not None:
+            self._pool.submit(self._work, fn, key)
+
+    def submit_service(self, service, specification, check_interrupt):
+        """
+        Start service.run(), in a worker process if the service is
+        CPU-bound and a process pool is configured, in the calling
+        thread otherwise. Returns a concurrent.futures.Future for the
+        result, which is already resolved unless a worker process runs
+        the service.
+
+        """
+        if self._process_pool is not None and \
+           getattr(service, 'cpu_bound', False):
+            return self._process_pool.submit(service.run, specification,
+                                             _never_interrupted)
+        future = Future()
+        try:
+            future.set_result(service.run(specification, check_interrupt))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run_service(self, service, specification, check_interrupt):
+        """
+        Call service.run() as submit_service() does, and wait for
+        its result.
+
+        """
+        return self.submit_service(service, specification,
+                                   check_interrupt).result()
+
+    def queue_length(self):
+        """Returns the number of jobs waiting for a worker."""
+        return self._queued
+
+    def running_count(self, key=None):
+        """
+        Returns the number of running jobs,
+        for the given service key or in total.
+
+        """
+        with self._lock:
+            if key is not None:
+                return self._running[key]
+            return sum(self._running.values())
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting jobs, drops pending timers, and releases
+        the timer thread and worker pools.
+
+        """
+        self._timers.close(wait=wait)
+        self._pool.shutdown(wait=wait)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait)
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+def default_executor():
+    """
+    Returns the executor used by Jobs created without one,
+    creating it on first use.
+
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = Executor()
+        return _default_executor
+
 class Job(object):
     """
     A Job binds some running code to an mPlane.model.Specification
@@ -101,23 +433,50 @@ class Job(object):
     receipt = None
     _interrupt = None
 
-    def __init__(self, service, specification, session=None, callback=None):
+    def __init__(self, service, specification, session=None, callback=None,
+                 executor=None):
         super(Job, self).__init__()
         self.service = service
         self.session = session
         self.specification = specification
         self.receipt = mplane.model.Receipt(specification=specification)
         self._interrupt = threading.Event()
+        self._completion = Future()
         self._callback = callback
+        if executor is None:
+            executor = default_executor()
+        self._executor = executor
+        self._start_timer = None
+        self._end_timer = None
 
     def __repr__(self):
         return "<Job for "+repr(self.specification)+">"
 
+    def _complete(self):
+        # free the interrupt timer, then wake up anyone waiting
+        # for this job before notifying the owner
+        if self._ended_at is None:
+            self._ended_at = datetime.utcnow()
+        if self._end_timer is not None:
+            self._end_timer.cancel()
+        self._completion.set_result(self)
+
+        if self._callback:
+            self._callback(self.receipt)
+
     def _run(self):
         self._started_at = datetime.utcnow()
+        # services run in a worker process complete from the future's
+        # callback, so no worker thread waits for them
+        future = self._executor.submit_service(self.service,
+                                               self.specification,
+                                               self._check_interrupt)
+        future.add_done_callback(self._service_done)
+        return future
+
+    def _service_done(self, future):
         try:
-            self.result = self.service.run(self.specification,
-                                           self._check_interrupt)
+            self.result = future.result()
         except Exception as e:
             self.exception = mplane.model.Exception(
                             token=self.specification.get_token(),
@@ -125,16 +484,28 @@ class Job(object):
             print("Got exception in _run(), returning "+str(self.exception))
             self._exception_at = datetime.utcnow()
         self._ended_at = datetime.utcnow()
-
-        if self._callback:
-            self._callback(self.receipt)
+        self._complete()
 
     def _check_interrupt(self):
         return self._interrupt.is_set()
 
     def _schedule_now(self):
-        # spawn a thread to run the service
-        threading.Thread(target=self._run).start()
+        # a job interrupted while it was being scheduled is not started
+        if self._interrupt.is_set():
+            self._fail_before_start()
+            return
+
+        # hand the job to a worker; relays wait on a remote component for
+        # the whole measurement, so they get a thread outside the pool
+        if not self._executor.submit(self._run,
+                                     key=self.service.capability().get_label(),
+                                     dedicated=hasattr(self.service, 'relay')):
+            self.exception = mplane.model.Exception(
+                            token=self.specification.get_token(),
+                            errmsg="Scheduler queue full")
+            print("Queue full, refusing "+repr(self))
+            self._exception_at = datetime.utcnow()
+            self._complete()
 
     def schedule(self):
         """
@@ -151,20 +522,46 @@ class Job(object):
 
         # start interrupt timer
         if end_delay is not None and not hasattr(self.service, 'relay'):
-            threading.Timer(end_delay, self.interrupt).start()
+            self._end_timer = self._executor.call_later(end_delay, self.interrupt)
             print("Will interrupt "+repr(self)+" after "+str(end_delay)+" sec")
 
         # start start timer
         if start_delay > 0:
             print("Scheduling "+repr(self)+" after "+str(start_delay)+" sec")
-            threading.Timer(start_delay, self._schedule_now).start()
+            self._start_timer = self._executor.call_later(start_delay,
+                                                          self._schedule_now)
         else:
             print("Scheduling "+repr(self)+" immediately")
             self._schedule_now()
 
     def interrupt(self):
-        """Interrupt this job."""
+        """
+        Interrupt this job. A job which has not started yet is
+        not started at all, and fails immediately.
+
+        """
         self._interrupt.set()
+        if self._start_timer is not None and self._start_timer.cancel():
+            self._fail_before_start()
+        elif self._end_timer is not None:
+            self._end_timer.cancel()
+
+    def _fail_before_start(self):
+        self.exception = mplane.model.Exception(
+                        token=self.specification.get_token(),
+                        errmsg="Interrupted before start")
+        self._exception_at = datetime.utcnow()
+        self._complete()
+
+    def completion(self):
+        """
+        Return a concurrent.futures.Future which is resolved (with this
+        Job as its result) as soon as the job has finished running,
+        successfully or not. Lets callers wait for a result without
+        polling finished() and failed().
+
+        """
+        return self._completion
 
     def failed(self):
         """A job only fails if it is finished and has no results"""
@@ -178,6 +575,15 @@ class Job(object):
         """
         return self.result is not None
 
+    def redeemed(self):
+        """
+        Return True if this job has completed and its final reply
+        has been retrieved since.
+
+        """
+        return (self._completion.done() and self._replied_at is not None and
+                self._replied_at >= self._ended_at)
+
     def get_reply(self):
         """
         If a result is available for this Job (i.e., if the job is
@@ -201,28 +607,40 @@ class MultiJob(object):
     Each MultiJob will result in multiple result rows, one for each sub-job.
     """
 
-    jobs = []
+    jobs = None
     results = None
     service = None
     session = None
     specification = None
     receipt = None
     _replied_at = None
+    _ended_at = None
     _scheduling_finished = False
     _subspec_iterator = None
 
-    def __init__(self, service, specification, session=None, max_results=0, callback=None):
+    def __init__(self, service, specification, session=None, max_results=0,
+                 callback=None, executor=None):
         super(MultiJob, self).__init__()
         self.service = service
         self.session = session
         self.specification = specification
         self.receipt = mplane.model.Receipt(specification=specification)
+        self.jobs = []
         self.results = mplane.model.Envelope(token=specification.get_token(),
                                              label=specification.get_label(),
                                              when=specification.when())
         self._subspec_iterator = specification.subspec_iterator()
         self._max_results = int(max_results)
         self._callback = callback
+        self._completion = Future()
+        self._running = 0
+        self._running_lock = threading.Lock()
+        self._interrupted = False
+        if executor is None:
+            executor = default_executor()
+        self._executor = executor
+        self._next_timer = None
+        self._end_timer = None
 
     def __repr__(self):
         return "<MultiJob for "+repr(self.specification)+">"
@@ -231,12 +649,21 @@ class MultiJob(object):
         """
         Schedule a job.
         """
-        new_job = Job(service=self.service,
-                      specification=self._subspec,
-                      session=self.session,
-                      callback=self._job_callback)
-
-        self.jobs.append(new_job)
+        # checked and appended under the lock, so that interrupt()
+        # either sees the new job or stops it from being created
+        with self._running_lock:
+            interrupted = self._interrupted
+            if not interrupted:
+                new_job = Job(service=self.service,
+                              specification=self._subspec,
+                              session=self.session,
+                              callback=self._job_callback,
+                              executor=self._executor)
+                self.jobs.append(new_job)
+                self._running += 1
+        if interrupted:
+            self._finish_scheduling()
+            return
         new_job.schedule()
 
         self._next_job()
@@ -245,23 +672,33 @@ class MultiJob(object):
         """
         Gets the next job and schedules it.
         """
+        if self._interrupted:
+            self._finish_scheduling()
+            return
+
         try:
             self._subspec = next(self._subspec_iterator)
         except StopIteration:
-            self._scheduling_finished = True
+            self._finish_scheduling()
             return
 
         (start_delay, end_delay) = self._subspec.when().timer_delays()
 
         # if no start_delay for the next run was found we should stop this MultiJob
         if start_delay is None:
-            self._scheduling_finished = True
+            self._finish_scheduling()
             return
 
         # start start timer
         if start_delay > 0:
             print("Scheduling "+repr(self._subspec)+" from "+repr(self)+" after "+str(start_delay)+" sec")
-            threading.Timer(start_delay, self._schedule_job).start()
+            with self._running_lock:
+                interrupted = self._interrupted
+                if not interrupted:
+                    self._next_timer = self._executor.call_later(
+                                            start_delay, self._schedule_job)
+            if interrupted:
+                self._finish_scheduling()
         else:
             print("Scheduling "+repr(self._subspec)+" from "+repr(self)+" immediately")
             self._schedule_job()
@@ -277,22 +714,55 @@ class MultiJob(object):
 
         # if no start_delay for the next run was found we should stop this MultiJob
         if start_delay is None:
-            self._scheduling_finished = True
+            self._finish_scheduling()
             return
 
         # start interrupt timer
         if end_delay is not None:
-            threading.Timer(end_delay, self.interrupt).start()
+            self._end_timer = self._executor.call_later(end_delay,
+                                                        self.interrupt)
             print("Will interrupt "+repr(self)+" after "+str(end_delay)+" sec")
 
         # begin scheduling of all jobs
         self._next_job()
 
     def interrupt(self):
-        """Interrupt all jobs."""
-        for job in self.jobs:
+        """Interrupt all jobs, and stop scheduling new ones."""
+        with self._running_lock:
+            self._interrupted = True
+            next_timer = self._next_timer
+            jobs = list(self.jobs)
+        if next_timer is not None and next_timer.cancel():
+            self._finish_scheduling()
+        if self._end_timer is not None:
+            self._end_timer.cancel()
+        for job in jobs:
             job.interrupt()
 
+    def completion(self):
+        """
+        Return a concurrent.futures.Future which is resolved once
+        scheduling has finished and every sub-job has run.
+
+        """
+        return self._completion
+
+    def _finish_scheduling(self):
+        with self._running_lock:
+            if self._scheduling_finished:
+                return
+            self._scheduling_finished = True
+            done = self._running == 0
+        if done:
+            self._complete()
+
+    def _complete(self):
+        self._ended_at = datetime.utcnow()
+        if self._end_timer is not None:
+            self._end_timer.cancel()
+        if not self._completion.done():
+            self._completion.set_result(self)
+
     def failed(self):
         """A multijob will only fail if it is finished and has no results"""
         if self.finished() and len(self.results) == 0:
@@ -319,6 +789,15 @@ class MultiJob(object):
 
         self.results.trim(self._max_results)
 
+    def redeemed(self):
+        """
+        Return True if every sub-job has run and the final
+        results have been retrieved since.
+
+        """
+        return (self._completion.done() and self._replied_at is not None and
+                self._replied_at >= self._ended_at)
+
     def get_reply(self):
         """
         If results are available for this MultiJob, return them.
@@ -333,10 +812,37 @@ class MultiJob(object):
             return self.receipt
 
     def _job_callback(self, arg):
+        with self._running_lock:
+            self._running -= 1
+            done = self._scheduling_finished and self._running == 0
+        if done:
+            self._complete()
+
         if self._callback:
             self._callback(self.receipt)
 
 
+def _component_setting(config, key, default):
+    if config and "component" in config.sections() and \
+            key in config["component"]:
+        return config["component"][key]
+    return default
+
+def _parse_service_limits(valstr):
+    """
+    Parses a scheduler_service_limits setting
+    (label:count,label:count,...) into a dictionary.
+
+    """
+    limits = {}
+    for item in valstr.split(","):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+        (label, count) = item.rsplit(":", 1)
+        limits[label.strip()] = int(count)
+    return limits
+
 class Scheduler(object):
     """
     Scheduler implements the common runtime of a Component within the
@@ -344,6 +850,21 @@ class Scheduler(object):
     Capabilities with add_service(), and submit jobs for scheduling using
     submit_job().
 
+    Jobs are run by an Executor, configured from the following optional
+    keys in the [component] section of the configuration:
+
+    - scheduler_max_workers: maximum number of concurrently running jobs
+    - scheduler_max_queue: maximum number of jobs waiting for a worker
+      (0, the default, is unbounded)
+    - scheduler_process_workers: size of the process pool for services
+      declaring themselves cpu_bound (0, the default, disables it)
+    - scheduler_service_limits: comma-separated label:count pairs
+      limiting concurrently running jobs per capability label
+
+    Finished jobs are pruned every scheduler_prune_interval seconds
+    (default 60, 0 disables) once their results have been retrieved,
+    or scheduler_job_ttl seconds (default 3600) after they finished.
+
     """
     def __init__(self, config=None):
         super(Scheduler, self).__init__()
@@ -361,9 +882,30 @@ class Scheduler(object):
             self._max_results = 0
             self.azn = mplane.azn.Authorization()
 
+        self.executor = Executor(
+            max_workers=int(_component_setting(config,
+                            "scheduler_max_workers", DEFAULT_MAX_WORKERS)),
+            max_queue=int(_component_setting(config,
+                            "scheduler_max_queue", 0)),
+            service_limits=_parse_service_limits(_component_setting(config,
+                            "scheduler_service_limits", "")),
+            process_workers=int(_component_setting(config,
+                            "scheduler_process_workers", 0)))
+
         self.services = []
         self.jobs = {}
         self._capability_cache = {}
+        self._service_index = {}
+
+        self._job_ttl = float(_component_setting(config,
+                            "scheduler_job_ttl", DEFAULT_JOB_TTL))
+        self._prune_interval = float(_component_setting(config,
+                            "scheduler_prune_interval", DEFAULT_PRUNE_INTERVAL))
+        self._pruned_count = 0
+        self._prune_timer = None
+        if self._prune_interval > 0:
+            self._prune_timer = self.executor.call_later(self._prune_interval,
+                                                         self._prune_periodically)
 
     def process_message(self, user, msg, session=None, callback=None):
         """
@@ -371,11 +913,18 @@ class Scheduler(object):
         the callback parameter is set to a function this function is
         called with a mplane.model.Receipt each time a result is available.
 
-        Returns a message to send in reply.
+        Returns a message to send in reply; an Envelope of messages
+        is answered with an Envelope of the replies to each.
 
         """
         reply = None
-        if isinstance(msg, mplane.model.Specification):
+        if isinstance(msg, mplane.model.Envelope):
+            reply = mplane.model.Envelope()
+            for imsg in msg.messages():
+                reply.append_message(self.process_message(user, imsg,
+                                                          session=session,
+                                                          callback=callback))
+        elif isinstance(msg, mplane.model.Specification):
             reply = self.submit_job(user, specification=msg, session=session, callback=callback)
         elif isinstance(msg, mplane.model.Redemption):
             job_key = msg.get_token()
@@ -410,6 +959,26 @@ class Scheduler(object):
         self.services.append(service)
         cap = service.capability()
         self._capability_cache[cap.get_token()] = cap
+        schema = cap._schema_hash()
+        self._service_index[schema] = self._service_index.get(schema, []) + [service]
+
+    def remove_service(self, service):
+        """
+        Remove a service from this Scheduler. Jobs already running
+        on the service are left alone; no new ones will be matched to it.
+
+        """
+        print("Removed "+repr(service))
+        self.services.remove(service)
+        cap = service.capability()
+        self._capability_cache.pop(cap.get_token(), None)
+        schema = cap._schema_hash()
+        candidates = [s for s in self._service_index.get(schema, [])
+                        if s is not service]
+        if len(candidates) > 0:
+            self._service_index[schema] = candidates
+        else:
+            self._service_index.pop(schema, None)
 
     def capability_keys(self):
         """
@@ -429,12 +998,16 @@ class Scheduler(object):
         """
         Search the available Services for one which can
         service the given Specification, then create and schedule
-        a new Job to execute the statement.
+        a new Job to execute the statement. Services are indexed
+        by the schema hash of their capabilities, so only those with
+        a matching schema are checked.
 
         """
-        # linearly search the available services
-        for service in self.services:
-            if specification.fulfills(service.capability()):
+        # look up services with the same schema, in the order they were
+        # added, and take the first one covering the temporal scope
+        candidates = self._service_index.get(specification._schema_hash(), ())
+        for service in candidates:
+            if specification.when().follows(service.capability().when()):
                 if self.azn.check(service.capability(), user):
                     # Found. Create a new job.
                     print(repr(service)+" matches "+repr(specification))
@@ -446,12 +1019,14 @@ class Scheduler(object):
                                            specification=specification,
                                            session=session,
                                            max_results=self._max_results,
-                                           callback=callback)
+                                           callback=callback,
+                                           executor=self.executor)
                     else:
                         new_job = Job(service=service,
                                       specification=specification,
                                       session=session,
-                                      callback=callback)
+                                      callback=callback,
+                                      executor=self.executor)
 
                     # Key by the receipt's token, and return
                     job_key = new_job.receipt.get_token()
@@ -484,11 +1059,81 @@ class Scheduler(object):
         """
         return self.jobs[msg.get_token()]
 
-    def prune_jobs(self):
+    def prune_jobs(self, now=None):
+        """
+        Remove Jobs which are finished and whose Results have been
+        retrieved, as well as finished Jobs nobody has asked for
+        within the configured time to live (scheduler_job_ttl).
+
+        Returns the number of Jobs removed.
+
+        """
+        if now is None:
+            now = datetime.utcnow()
+
+        pruned = 0
+        for job_key, job in list(self.jobs.items()):
+            if not job.completion().done():
+                continue
+            if job.redeemed() or \
+                    (now - job._ended_at).total_seconds() >= self._job_ttl:
+                if self.jobs.pop(job_key, None) is not None:
+                    pruned += 1
+
+        self._pruned_count += pruned
+        return pruned
+
+    def _prune_periodically(self):
+        pruned = self.prune_jobs()
+        if pruned > 0:
+            print("Pruned "+str(pruned)+" jobs, "+repr(self.stats()))
+        if self._prune_timer is not None:
+            self._prune_timer = self.executor.call_later(self._prune_interval,
+                                                         self._prune_periodically)
+
+    def shutdown(self, wait=True):
+        """
+        Stops periodic pruning and shuts down the executor,
+        stopping its timer thread and worker pools.
+
+        """
+        if self._prune_timer is not None:
+            prune_timer = self._prune_timer
+            self._prune_timer = None
+            prune_timer.cancel()
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
         """
-        Currently does nothing. Will remove Jobs which are
-        finished and whose Results have been retrieved
-        from the scheduler in a future version.
+        Return a dictionary of gauges describing the scheduler's
+        current load and footprint: jobs held, running and finished,
+        result rows retained, jobs pruned so far, queued work,
+        pending timers and the peak resident set size of the process
+        in kilobytes (None where the platform does not report it).
 
         """
-        pass
+        jobs = list(self.jobs.values())
+        finished = sum(1 for job in jobs if job.completion().done())
+        result_rows = 0
+        for job in jobs:
+            if isinstance(job, MultiJob):
+                result_rows += sum(r.count_result_rows()
+                                   for r in job.results.messages()
+                                   if isinstance(r, mplane.model.Result))
+            elif job.result is not None:
+                result_rows += job.result.count_result_rows()
+
+        if resource is not None:
+            max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        else:
+            max_rss_kb = None
+
+        return {"jobs": len(jobs),
+                "multijobs": sum(1 for job in jobs if isinstance(job, MultiJob)),
+                "running": len(jobs) - finished,
+                "finished": finished,
+                "result_rows": result_rows,
+                "pruned": self._pruned_count,
+                "queued": self.executor.queue_length(),
+                "timers": self.executor.timer_count(),
+                "max_rss_kb": max_rss_kb}
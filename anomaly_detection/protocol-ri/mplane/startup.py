@@ -0,0 +1,203 @@
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+##
+# mPlane Protocol Reference Implementation
+# Startup profiling for mPlane entry points
+#
+# (c) 2015 mPlane Consortium (http://www.ict-mplane.eu)
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Measures how long mPlane entry points take to start.
+
+    python3 -m mplane.startup imports [module ...]
+
+reports the slowest imports of each module (by default mplane.component,
+mplane.client and mplane.supervisor), as measured by python -X importtime.
+
+    python3 -m mplane.startup component --config conf-file
+
+starts a component-initiated component from conf-file against a local
+stub client/supervisor, and reports the time from launch until its
+capabilities have been registered.
+
+"""
+
+import argparse
+import configparser
+import http.server
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mplane.utils
+
+DEFAULT_MODULES = ["mplane.component", "mplane.client", "mplane.supervisor"]
+
+_IMPORTTIME_PREFIX = "import time:"
+
+# run by the component process started by component_startup()
+_COMPONENT_RUNNER = """
+import configparser, sys
+import mplane.component
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read(sys.argv[1])
+mplane.component.InitiatorHttpComponent(config)
+"""
+
+def parse_importtime(text):
+    """
+    Parses the output of python -X importtime into a list of
+    (self_us, cumulative_us, module) tuples, in import order.
+
+    """
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith(_IMPORTTIME_PREFIX):
+            continue
+        fields = line[len(_IMPORTTIME_PREFIX):].split("|")
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except (IndexError, ValueError):
+            # the header line
+            continue
+        imports.append((self_us, cumulative_us, fields[2].strip()))
+    return imports
+
+def import_times(module):
+    """
+    Imports a module in a fresh interpreter and returns its
+    import times, as parse_importtime() does.
+
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime",
+                           "-c", "import " + module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        raise ValueError("Cannot import " + module + ": " + proc.stderr)
+    return parse_importtime(proc.stderr)
+
+def print_import_report(module, count=10):
+    imports = import_times(module)
+    total = max(cumulative for (self_us, cumulative, name) in imports)
+    print("%s: %.1f ms to import, %d modules" %
+          (module, total / 1000, len(imports)))
+    for (self_us, cumulative, name) in sorted(imports, reverse=True)[:count]:
+        print("  %8.1f ms self %8.1f ms cumulative  %s" %
+              (self_us / 1000, cumulative / 1000, name))
+
+class _StubClientHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Accepts capability registrations, as a client or supervisor would,
+    and notes when the first one arrives.
+
+    """
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.server.registered_at = time.perf_counter()
+        self.server.registered.set()
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # no specifications for the component
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def component_startup(conffile, timeout=60):
+    """
+    Starts an InitiatorHttpComponent configured from conffile in a new
+    process, pointed at a local stub client over plain HTTP, and returns
+    the number of seconds from launch until it registered its
+    capabilities, or None if it didn't within timeout seconds.
+
+    """
+    server = http.server.HTTPServer(("127.0.0.1", 0), _StubClientHandler)
+    server.registered = threading.Event()
+    server.registered_at = None
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(mplane.utils.search_path(conffile))
+    if "TLS" in config:
+        config.remove_section("TLS")
+    config["component"]["workflow"] = "component-initiated"
+    config["component"]["client_host"] = "127.0.0.1"
+    config["component"]["client_port"] = str(server.server_address[1])
+
+    (fd, stubconf) = tempfile.mkstemp(suffix=".conf")
+    with os.fdopen(fd, "w") as f:
+        config.write(f)
+
+    try:
+        started_at = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-c", _COMPONENT_RUNNER,
+                                 stubconf])
+        try:
+            if not server.registered.wait(timeout):
+                return None
+            return server.registered_at - started_at
+        finally:
+            proc.kill()
+            proc.wait()
+    finally:
+        server.shutdown()
+        os.remove(stubconf)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mPlane startup profiling")
+    subparsers = parser.add_subparsers(dest="COMMAND")
+    imports_parser = subparsers.add_parser("imports",
+                        help="report the slowest imports of modules")
+    imports_parser.add_argument("MODULES", nargs="*", default=DEFAULT_MODULES)
+    imports_parser.add_argument("--count", type=int, default=10,
+                        help="number of imports to list per module")
+    component_parser = subparsers.add_parser("component",
+                        help="time a component's capability registration")
+    component_parser.add_argument("--config", metavar="conf-file",
+                        dest="CONF", required=True,
+                        help="Configuration file for the component")
+    args = parser.parse_args()
+
+    if args.COMMAND == "imports":
+        for module in args.MODULES:
+            print_import_report(module, args.count)
+    elif args.COMMAND == "component":
+        elapsed = component_startup(args.CONF)
+        if elapsed is None:
+            print("Component did not register its capabilities")
+            exit(1)
+        print("Capabilities registered %.3f s after launch" % elapsed)
+    else:
+        parser.print_help()
+        exit(1)
@@ -23,10 +23,13 @@
 
 import mplane.model
 import mplane.client
+import mplane.resultstore
 import mplane.component
 import mplane.utils
 import mplane.tls
 
+import collections
+import concurrent.futures
 import queue
 import re
 import tornado.web
@@ -34,14 +37,132 @@ from time import sleep
 import threading
 from threading import Thread
 
+# how often a relay waiting for its result checks for interruption
+RELAY_INTERRUPT_INTERVAL = 1
+
+# results kept for relays that have not started waiting for them yet
+MAX_UNCLAIMED_RELAYS = 1000
+
+# client-initiated components are polled every DEFAULT_POLL_INTERVAL
+# seconds by up to DEFAULT_POLL_WORKERS at a time, and a request to one
+# gives up after DEFAULT_POLL_TIMEOUT seconds
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_POLL_WORKERS = 8
+DEFAULT_POLL_TIMEOUT = 30
+
+class PendingRelays(object):
+    """
+    Results awaited by RelayServices, by the token of the
+    specification they forwarded. The supervisor resolves a token
+    as its result arrives, waking the relay waiting on it at once;
+    a result arriving before its relay waits is kept until claimed.
+
+    """
+    def __init__(self, max_unclaimed=MAX_UNCLAIMED_RELAYS):
+        self._lock = threading.Lock()
+        self._futures = collections.OrderedDict()
+        self._max_unclaimed = max_unclaimed
+
+    def _future(self, token):
+        with self._lock:
+            try:
+                return self._futures[token]
+            except KeyError:
+                future = concurrent.futures.Future()
+                self._futures[token] = future
+                return future
+
+    def resolve(self, token, msg):
+        """
+        Hands msg to the relay waiting for token. Returns False if
+        token already had a result.
+
+        """
+        future = self._future(token)
+        if future.done():
+            return False
+        future.set_result(msg)
+        with self._lock:
+            # drop the oldest results nobody claimed
+            excess = len(self._futures) - self._max_unclaimed
+            if excess > 0:
+                for (old_token, old) in list(self._futures.items()):
+                    if excess == 0:
+                        break
+                    if old.done():
+                        del self._futures[old_token]
+                        excess -= 1
+        return True
+
+    def wait(self, token, timeout=None):
+        """
+        Returns the message resolving token, or None if none
+        arrived within timeout seconds.
+
+        """
+        future = self._future(token)
+        try:
+            msg = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+        self.discard(token)
+        return msg
+
+    def discard(self, token):
+        """ Forgets token and any result it has """
+        with self._lock:
+            self._futures.pop(token, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._futures)
+
+class ComponentPoller(object):
+    """
+    Polls client-initiated components on behalf of a supervisor's
+    client, each in a worker of its own, so a slow or unreachable
+    component only delays its own polling.
+
+    """
+    def __init__(self, client, urls, config):
+        self._client = client
+        self._urls = urls
+        self._interval = config["client"].getfloat("poll_interval",
+                                                   fallback=DEFAULT_POLL_INTERVAL)
+        self._workers = config["client"].getint("poll_workers",
+                                                fallback=DEFAULT_POLL_WORKERS)
+
+    def run(self):
+        """ Poll every component each interval, forever """
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers)
+        polls = {}
+        while True:
+            for url in self._urls:
+                # don't queue another poll behind one still running
+                if url in polls and not polls[url].done():
+                    continue
+                polls[url] = executor.submit(self.poll, url)
+            sleep(self._interval)
+
+    def poll(self, url):
+        """
+        Retrieve a component's capabilities and redeem the receipts
+        outstanding with it; results already received are not asked for
+        """
+        try:
+            self._client.retrieve_capabilities(url)
+            self._client.redeem_receipts(url)
+        except:
+            print(str(url) + " unreachable. Retrying in " +
+                  str(self._interval) + " seconds")
+
 class RelayService(mplane.scheduler.Service):
 
-    def __init__(self, cap, identity, client, lock, messages):
+    def __init__(self, cap, identity, client, pending):
         self.relay = True
         self._identity = identity
         self._client = client
-        self._lock = lock
-        self._messages = messages
+        self._pending = pending
         super(RelayService, self).__init__(cap)
 
     def run(self, spec, check_interrupt):
@@ -55,19 +176,14 @@ class RelayService(mplane.scheduler.Service):
             if check_interrupt() and not pending:
                 self._client.interrupt_capability(fwd_spec.get_token())
                 pending = True
-            sleep(1)
-            with self._lock:
-                if self._identity in self._messages:
-                    for msg in self._messages[self._identity]:
-                        if msg.get_token() == fwd_spec.get_token():
-                            if (isinstance(msg, mplane.model.Result) or
-                                isinstance(msg, mplane.model.Envelope)):
-                                print("Received result for " + trunc_label + " from " + self._identity)
-                            elif isinstance(msg, mplane.model.Exception):
-                                print("Received exception for " + trunc_label + " from " + self._identity)
-                            result = msg
-                            self._messages[self._identity].remove(msg)
-                            break
+            result = self._pending.wait(fwd_spec.get_token(),
+                                        RELAY_INTERRUPT_INTERVAL)
+
+        if (isinstance(result, mplane.model.Result) or
+            isinstance(result, mplane.model.Envelope)):
+            print("Received result for " + trunc_label + " from " + self._identity)
+        elif isinstance(result, mplane.model.Exception):
+            print("Received exception for " + trunc_label + " from " + self._identity)
 
         if (not isinstance(result, mplane.model.Exception)
            and not isinstance(result, mplane.model.Envelope)):
@@ -81,6 +197,11 @@ class BaseSupervisor(object):
         self._caps = []
         self.config = config
 
+        # keep parsed registries on disk between runs
+        if "registry_cache" in config["component"]:
+            mplane.model.set_registry_cache(
+                config["component"]["registry_cache"])
+
         # preload any registries necessary
         if "registry_preload" in config["component"]:
             mplane.model.preload_registry(
@@ -96,19 +217,25 @@ class BaseSupervisor(object):
         tls_state = mplane.tls.TlsState(config)
 
         self.from_cli = queue.Queue()
-        self._lock = threading.RLock()
-        self._spec_messages = dict()
+        self._pending = PendingRelays()
         self._io_loop = tornado.ioloop.IOLoop.instance()
+        result_store = mplane.resultstore.store_from_config(config)
         if self.config["client"]["workflow"] == "component-initiated":
             self.cli_workflow = "component-initiated"
             self._client = mplane.client.HttpListenerClient(config=config,
                                                             tls_state=tls_state, supervisor=True,
                                                             exporter=self.from_cli,
-                                                            io_loop=self._io_loop)
+                                                            io_loop=self._io_loop,
+                                                            result_store=result_store)
         elif self.config["client"]["workflow"] == "client-initiated":
             self.cli_workflow = "client-initiated"
-            self._client = mplane.client.HttpInitiatorClient(tls_state=tls_state, supervisor=True,
-                                                             exporter=self.from_cli)
+            poll_timeout = self.config["client"].getfloat("poll_timeout",
+                                                          fallback=DEFAULT_POLL_TIMEOUT)
+            self._client = mplane.client.HttpInitiatorClient(config=config,
+                                                             tls_state=tls_state, supervisor=True,
+                                                             exporter=self.from_cli,
+                                                             result_store=result_store,
+                                                             timeout=poll_timeout)
             self._urls = self.config["client"]["component-urls"].split(",")
         else:
             raise ValueError("workflow setting in " + args.CONF + " can only be 'client-initiated' or 'component-initiated'")
@@ -133,18 +260,20 @@ class BaseSupervisor(object):
             t_poll = Thread(target=self.poll_in_background)
             t_poll.daemon = True
             t_poll.start()
+        self.dispatch_messages()
+
+    def dispatch_messages(self):
+        """ Handle messages from the client as soon as they arrive """
         while True:
-            if not self.from_cli.empty():
-                [msg, identity] = self.from_cli.get()
-                self.handle_message(msg, identity)
-            sleep(0.1)
+            [msg, identity] = self.from_cli.get()
+            self.handle_message(msg, identity)
 
     def handle_message(self, msg, identity):
         if isinstance(msg, mplane.model.Capability):
             if [msg.get_label(), identity] not in self._caps:
                 self._caps.append([msg.get_label(), identity])
                 serv = RelayService(msg, identity, self._client,
-                                    self._lock, self._spec_messages)
+                                    self._pending)
                 if self.comp_workflow == "client-initiated":
                     serv.set_capability_link(self.config["component"]["listen-cap-link"])
                 self._component.scheduler.add_service(serv)
@@ -156,8 +285,7 @@ class BaseSupervisor(object):
             
         elif (isinstance(msg, mplane.model.Result) or
             isinstance(msg, mplane.model.Exception)):
-            with self._lock:
-                mplane.utils.add_value_to(self._spec_messages, identity, msg)
+            self._pending.resolve(msg.get_token(), msg)
             
         elif isinstance(msg, mplane.model.Withdrawal):
             # not yet implemented
@@ -166,7 +294,7 @@ class BaseSupervisor(object):
         elif isinstance(msg, mplane.model.Envelope):
             for imsg in msg.messages():
                 if isinstance(imsg, mplane.model.Result):
-                    mplane.utils.add_value_to(self._spec_messages, identity, msg)
+                    self._pending.resolve(msg.get_token(), msg)
                     break
                 else:
                     self.handle_message(imsg, identity)
@@ -179,24 +307,4 @@ class BaseSupervisor(object):
 
     def poll_in_background(self):
         """ Periodically poll components """
-        while True:
-            for url in self._urls:
-                try:
-                    self._client.retrieve_capabilities(url)
-                except:
-                    print(str(url) + " unreachable. Retrying in 5 seconds")
-
-            # poll for results
-            for label in self._client.receipt_labels():
-                self._client.result_for(label)
-
-            for token in self._client.receipt_tokens():
-                self._client.result_for(token)
-
-            for label in self._client.result_labels():
-                self._client.result_for(label)
-
-            for token in self._client.result_tokens():
-                self._client.result_for(token)
-
-            sleep(5)
\ No newline at end of file
+        ComponentPoller(self._client, self._urls, self.config).run()
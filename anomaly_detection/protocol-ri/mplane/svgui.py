@@ -23,13 +23,10 @@ import traceback
 import urllib3
 import argparse
 import configparser
-from time import sleep
 
 import queue
 import re
 import tornado.web
-from time import sleep
-import threading
 from threading import Thread
 import logging
 
@@ -37,7 +34,9 @@ import mplane.model
 import mplane.tls
 import mplane.utils
 import mplane.client
+import mplane.resultstore
 import mplane.component
+import mplane.supervisor
 import mplane.svgui_handlers
 
 DUMMY_DN = "Identity.Unauthenticated.Default"
@@ -68,12 +67,11 @@ GUI_GETRESULT_PATH = "gui/get/result"
 
 class RelayService(mplane.scheduler.Service):
 
-    def __init__(self, cap, identity, client, lock, messages):
+    def __init__(self, cap, identity, client, pending):
         self.relay = True
         self._identity = identity
         self._client = client
-        self._lock = lock
-        self._messages = messages
+        self._pending = pending
         super(RelayService, self).__init__(cap)
 
     def run(self, spec, check_interrupt):
@@ -87,19 +85,14 @@ class RelayService(mplane.scheduler.Service):
             if check_interrupt() and not pending:
                 self._client.interrupt_capability(fwd_spec.get_token())
                 pending = True
-            sleep(1)
-            with self._lock:
-                if self._identity in self._messages:
-                    for msg in self._messages[self._identity]:
-                        if msg.get_token() == fwd_spec.get_token():
-                            if (isinstance(msg, mplane.model.Result) or
-                                isinstance(msg, mplane.model.Envelope)):
-                                print("Received result for " + trunc_label + " from " + self._identity)
-                            elif isinstance(msg, mplane.model.Exception):
-                                print("Received exception for " + trunc_label + " from " + self._identity)
-                            result = msg
-                            self._messages[self._identity].remove(msg)
-                            break
+            result = self._pending.wait(fwd_spec.get_token(),
+                                        mplane.supervisor.RELAY_INTERRUPT_INTERVAL)
+
+        if (isinstance(result, mplane.model.Result) or
+            isinstance(result, mplane.model.Envelope)):
+            print("Received result for " + trunc_label + " from " + self._identity)
+        elif isinstance(result, mplane.model.Exception):
+            print("Received exception for " + trunc_label + " from " + self._identity)
 
         if (not isinstance(result, mplane.model.Exception)
            and not isinstance(result, mplane.model.Envelope)):
@@ -136,6 +129,10 @@ class ClientShell(cmd.Cmd):
         # don't print tracebacks by default
         self._print_tracebacks = False
 
+        # keep parsed registries on disk between runs
+        if "registry_cache" in config["component"]:
+            mplane.model.set_registry_cache(config["component"]["registry_cache"])
+
         # preload any registries necessary
         # from_begin supervisor
         # preload any registries necessary
@@ -171,20 +168,26 @@ class ClientShell(cmd.Cmd):
         # from_begin supervisor.py
         
         self.from_cli = queue.Queue()
-        self._lock = threading.RLock()
-        self._spec_messages = dict()
+        self._pending = mplane.supervisor.PendingRelays()
         self._io_loop = tornado.ioloop.IOLoop.instance()
+        result_store = mplane.resultstore.store_from_config(config)
         
         if self.config["client"]["workflow"] == "component-initiated":
             self.cli_workflow = "component-initiated"
             self._client = mplane.client.HttpListenerClient(config=config,
                                                             tls_state=tls_state, supervisor=True,
                                                             exporter=self.from_cli,
-                                                            io_loop=self._io_loop)
+                                                            io_loop=self._io_loop,
+                                                            result_store=result_store)
         elif self.config["client"]["workflow"] == "client-initiated":
             self.cli_workflow = "client-initiated"
-            self._client = mplane.client.HttpInitiatorClient(tls_state=tls_state, supervisor=True,
-                                                             exporter=self.from_cli)
+            poll_timeout = self.config["client"].getfloat("poll_timeout",
+                                                          fallback=mplane.supervisor.DEFAULT_POLL_TIMEOUT)
+            self._client = mplane.client.HttpInitiatorClient(config=config,
+                                                             tls_state=tls_state, supervisor=True,
+                                                             exporter=self.from_cli,
+                                                             result_store=result_store,
+                                                             timeout=poll_timeout)
             self._urls = self.config["client"]["component-urls"].split(",")
         else:
             raise ValueError("workflow setting in " + args.CONF + " can only be 'client-initiated' or 'component-initiated'")
@@ -223,18 +226,20 @@ class ClientShell(cmd.Cmd):
             t_poll = Thread(target=self.poll_in_background)
             t_poll.daemon = True
             t_poll.start()
+        self.dispatch_messages()
+
+    def dispatch_messages(self):
+        """ Handle messages from the client as soon as they arrive """
         while True:
-            if not self.from_cli.empty():
-                [msg, identity] = self.from_cli.get()
-                self.handle_message(msg, identity)
-            sleep(0.1)
+            [msg, identity] = self.from_cli.get()
+            self.handle_message(msg, identity)
 
     def handle_message(self, msg, identity):
         if isinstance(msg, mplane.model.Capability):
             if [msg.get_label(), identity] not in self._caps:
                 self._caps.append([msg.get_label(), identity])
                 serv = RelayService(msg, identity, self._client,
-                                    self._lock, self._spec_messages)
+                                    self._pending)
                 if self.comp_workflow == "client-initiated":
                     serv.set_capability_link(self.config["component"]["listen-cap-link"])
                 self._component.scheduler.add_service(serv)
@@ -246,8 +251,7 @@ class ClientShell(cmd.Cmd):
             
         elif (isinstance(msg, mplane.model.Result) or
             isinstance(msg, mplane.model.Exception)):
-            with self._lock:
-                mplane.utils.add_value_to(self._spec_messages, identity, msg)
+            self._pending.resolve(msg.get_token(), msg)
             
         elif isinstance(msg, mplane.model.Withdrawal):
             # not yet implemented
@@ -256,7 +260,7 @@ class ClientShell(cmd.Cmd):
         elif isinstance(msg, mplane.model.Envelope):
             for imsg in msg.messages():
                 if isinstance(imsg, mplane.model.Result):
-                    mplane.utils.add_value_to(self._spec_messages, identity, msg)
+                    self._pending.resolve(msg.get_token(), msg)
                     break
                 else:
                     self.handle_message(imsg, identity)
@@ -269,27 +273,8 @@ class ClientShell(cmd.Cmd):
 
     def poll_in_background(self):
         """ Periodically poll components """
-        while True:
-            for url in self._urls:
-                try:
-                    self._client.retrieve_capabilities(url)
-                except:
-                    print(str(url) + " unreachable. Retrying in 5 seconds")
-
-            # poll for results
-            for label in self._client.receipt_labels():
-                self._client.result_for(label)
-
-            for token in self._client.receipt_tokens():
-                self._client.result_for(token)
-
-            for label in self._client.result_labels():
-                self._client.result_for(label)
-
-            for token in self._client.result_tokens():
-                self._client.result_for(token)
-
-            sleep(5)                                                            
+        mplane.supervisor.ComponentPoller(self._client, self._urls,
+                                          self.config).run()
                                                             
     """
     this is ClientShell stuff
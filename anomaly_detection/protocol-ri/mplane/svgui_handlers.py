@@ -226,12 +226,11 @@ class S_ResultHandler(mplane.client.MPlaneHandler):
             rec = mplane.model.parse_json(self.request.body.decode("utf-8"))
             if isinstance(rec, mplane.model.Redemption):    
                 # check if result is ready. if so, return it to client
-                for dn in self._supervisor._results:
-                    for r in self._supervisor._results[dn]:
-                        if str(r.get_token()) == str(rec.get_token()):
-                            self._respond_message(r)
-                            self._supervisor._results[dn].remove(r)
-                            return
+                r = self._supervisor._result_store.get(str(rec.get_token()))
+                if r is not None:
+                    self._respond_message(r)
+                    self._supervisor._result_store.remove(r.get_token())
+                    return
                 meas = self._supervisor.measurements()
                 
                 # if result is not ready, return the receipt
@@ -429,8 +428,9 @@ def match_filters(self, msg, filterlist):
             else:
                 _value = _msg._params[_filtname]._constraint                        
                 _filtvalue = _filtlist[ _filtname ]
+                # can_set_value() parses the filter value before checking it
                 if ( (isinstance( _value, mplane.model._SetConstraint ) and str( _value ).find( _filtvalue ) < 0)
-                        or (not isinstance( _value, mplane.model._SetConstraint ) and not _value.met_by( _filtvalue )) ):
+                        or (not isinstance( _value, mplane.model._SetConstraint ) and not _msg._params[_filtname].can_set_value( _filtvalue )) ):
                     # logging.debug("SKIPPED because of constraint " + str( _value ) + "is not equal to filter " + _filtvalue )
                     return False
             
@@ -536,7 +536,7 @@ class ListResultsHandler(mplane.client.MPlaneHandler):
         self._tls = tlsState
         self.dn = get_dn(self._supervisor, self.request)
         _flist = {}
-        # logging.debug(">>> ListResultsHandler.initialize:\n" + str(self._supervisor._results))
+        # logging.debug(">>> ListResultsHandler.initialize:\n" + str(self._supervisor.result_tokens()))
 
     def get(self):
         if self.get_secure_cookie("user") is None:
@@ -547,8 +547,11 @@ class ListResultsHandler(mplane.client.MPlaneHandler):
         # logging.debug("_flist = " + str( _flist ))
         try:
             msg = ""
-            for token in self._supervisor._results:
-                res = self._supervisor._results[token]
+            for token in self._supervisor.result_tokens():
+                res = self._supervisor._result_store.get(token)
+                if res is None:
+                    # expired since listing
+                    continue
                 # logging.debug("res (in json) = " + mplane.model.unparse_json(res))
                 dnMsg = ""
                 found = False
@@ -673,7 +676,7 @@ class GetResultHandler(mplane.client.MPlaneHandler):
         self._supervisor = supervisor
         self._tls = tlsState
         self.dn = get_dn(self._supervisor, self.request)
-        # logging.debug(">>> GetResultsHandler.initialize:\n" + str(self._supervisor._results))
+        # logging.debug(">>> GetResultsHandler.initialize:\n" + str(self._supervisor.result_tokens()))
 
     def get(self):
         if self.get_secure_cookie("user") is None:
@@ -683,12 +686,10 @@ class GetResultHandler(mplane.client.MPlaneHandler):
         try:
             token = self.get_argument("token")
             logging.debug(">>> GetResultsHandler token = " + token)
-            for dn in self._supervisor._results.keys():
-                # for res in self._supervisor._results[dn]:
-                res = self._supervisor._results[dn]
-                if res.get_token() == token:
-                    self._respond_json_text(200, mplane.model.unparse_json(res) )
-                    return
+            res = self._supervisor._result_store.get(token)
+            if res is not None:
+                self._respond_json_text(200, mplane.model.unparse_json(res) )
+                return
             
             self.write("{ERROR: \"result for token " + token + " is not found\"}")
         
@@ -701,19 +702,8 @@ class GetResultHandler(mplane.client.MPlaneHandler):
         toTS = datetime.datetime.fromtimestamp( queryJson["to"] / 1000 )        
         logging.debug( 'query time: ' + str(fromTS) + " - " + str(toTS))
         
-        selectedResults = []
-        for dn in self._supervisor._results.keys():
-            for res in self._supervisor._results[dn]:
-                skip = res.get_label() != queryJson["capability"]
-                for paramname in res.parameter_names():
-                    if str(res.get_parameter_value(paramname)) != queryJson["parameters"][paramname]:
-                        skip = True
-                (resstart,resend) = res.when().datetimes()
-                logging.debug( '   result time: ' + str(resstart) + " - " + str(resend) + ": " + str(resend < fromTS or resstart > toTS))
-
-                skip = skip or resend < fromTS or resstart > toTS
-                if not skip:
-                    selectedResults.append(res)
+        selectedResults = self._supervisor._result_store.query(
+                queryJson["capability"], queryJson["parameters"], fromTS, toTS)
         
         if len(selectedResults) == 0:
             self.write("{ERROR:\"No result was found\"}");
@@ -32,7 +32,9 @@ from mplane import scheduler
 from mplane import utils
 import configparser
 from os import path
+from datetime import datetime, timedelta
 
+import tornado.gen
 import tornado.httpserver
 import tornado.ioloop
 import tornado.web
@@ -40,6 +42,8 @@ import threading
 import urllib3
 import time
 import ssl
+import os
+from unittest import SkipTest
 
 
 
@@ -265,6 +269,22 @@ class SchedulerTestService(scheduler.Service):
     def run(self, specification, check_interrupt):
         return st_res
 
+class CpuBoundTestService(scheduler.Service):
+    # answers with the id of the process it ran in
+    cpu_bound = True
+
+    def run(self, specification, check_interrupt):
+        res = model.Result(specification=specification)
+        res.set_when(specification.when())
+        res.set_result_value("delay.twoway.icmp.count", os.getpid())
+        return res
+
+class SlowCpuBoundTestService(CpuBoundTestService):
+    # keeps its worker process busy for a while
+    def run(self, specification, check_interrupt):
+        time.sleep(0.5)
+        return super().run(specification, check_interrupt)
+
 st_cap = create_test_capability()
 st_spec = create_test_specification()
 st_receipt = model.Receipt(specification=st_spec)
@@ -380,6 +400,310 @@ def test_Job_get_reply_failed():
     # Job has failed.
     assert_true(isinstance(job_failure.get_reply(), model.Exception))
 
+# Class Executor tests:
+
+def test_Executor_runs_job():
+    executor = scheduler.Executor(max_workers=2)
+    pool_job = scheduler.Job(test_service, st_spec, executor=executor)
+    pool_job._schedule_now()
+    assert_true(pool_job.completion().result(timeout=5) is pool_job)
+    assert_true(pool_job.finished())
+    executor.shutdown()
+
+
+def test_Executor_service_limit():
+    executor = scheduler.Executor(max_workers=4, service_limits={"slow": 1})
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+    done = threading.Semaphore(0)
+
+    def work():
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+        done.release()
+
+    for i in range(3):
+        assert_true(executor.submit(work, key="slow"))
+    for i in range(3):
+        done.acquire()
+    assert_equal(state["peak"], 1)
+    assert_equal(executor.running_count("slow"), 0)
+    executor.shutdown()
+
+
+def test_Executor_queue_full():
+    executor = scheduler.Executor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    assert_true(executor.submit(release.wait))
+    # wait for the worker to pick up the first function
+    while executor.queue_length() > 0:
+        time.sleep(0.01)
+    assert_true(executor.submit(release.wait))
+    assert_false(executor.submit(release.wait))
+    release.set()
+    executor.shutdown()
+
+
+def test_Executor_dedicated():
+    executor = scheduler.Executor(max_workers=1)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def block():
+        started.release()
+        release.wait()
+
+    # the only pool worker is busy, yet dedicated functions all start
+    assert_true(executor.submit(block))
+    for i in range(3):
+        assert_true(executor.submit(block, key="relay", dedicated=True))
+    for i in range(4):
+        assert_true(started.acquire(timeout=5))
+    assert_equal(executor.running_count("relay"), 3)
+    release.set()
+    executor.shutdown()
+
+
+def test_Executor_process_pool():
+    executor = scheduler.Executor(max_workers=1, process_workers=1)
+    res = executor.run_service(CpuBoundTestService(st_cap), st_spec,
+                               lambda: False)
+    assert_true(isinstance(res, model.Result))
+    assert_equal(res.get_token(), st_spec.get_token())
+    assert_equal(res.get_parameter_value("destination.ip4"),
+                 st_spec.get_parameter_value("destination.ip4"))
+    assert_true(res._resultcolumns["delay.twoway.icmp.count"][0] != os.getpid())
+    executor.shutdown()
+
+
+def test_Executor_process_pool_frees_worker():
+    cpu_cap = create_test_capability()
+    cpu_cap.set_label("cpu-test")
+    executor = scheduler.Executor(max_workers=1, process_workers=1,
+                                  service_limits={"cpu-test": 1})
+    cpu_job = scheduler.Job(SlowCpuBoundTestService(cpu_cap), st_spec,
+                            executor=executor)
+    cpu_job._schedule_now()
+
+    # the only worker thread is free while a process runs the job,
+    # but the job still counts against its service's limit
+    ran = threading.Event()
+    assert_true(executor.submit(ran.set))
+    assert_true(ran.wait(5))
+    assert_false(cpu_job.completion().done())
+    assert_equal(executor.running_count("cpu-test"), 1)
+
+    assert_true(cpu_job.completion().result(timeout=10) is cpu_job)
+    assert_true(isinstance(cpu_job.get_reply(), model.Result))
+    for i in range(50):
+        if executor.running_count("cpu-test") == 0:
+            break
+        time.sleep(0.1)
+    assert_equal(executor.running_count("cpu-test"), 0)
+    executor.shutdown()
+
+
+def test_DelayQueue_order():
+    timers = scheduler.DelayQueue()
+    fired = []
+    done = threading.Event()
+    timers.call_later(0.06, lambda: (fired.append(2), done.set()))
+    timers.call_later(0.02, lambda: fired.append(1))
+    assert_true(done.wait(5))
+    assert_equal(fired, [1, 2])
+
+
+def test_DelayQueue_cancel():
+    timers = scheduler.DelayQueue()
+    fired = []
+    done = threading.Event()
+    handle = timers.call_later(0.02, lambda: fired.append(1))
+    timers.call_later(0.05, done.set)
+    assert_equal(len(timers), 2)
+    assert_true(handle.cancel())
+    assert_false(handle.cancel())
+    assert_equal(len(timers), 1)
+    assert_true(done.wait(5))
+    assert_equal(fired, [])
+    assert_equal(len(timers), 0)
+
+
+def test_DelayQueue_close():
+    timers = scheduler.DelayQueue()
+    fired = []
+    timers.call_later(5, lambda: fired.append(1))
+    thread = timers._thread
+    timers.close()
+    assert_false(thread.is_alive())
+    assert_equal(len(timers), 0)
+    assert_equal(fired, [])
+    assert_raises(RuntimeError, timers.call_later, 0, lambda: None)
+
+
+def test_Job_interrupt_before_start():
+    executor = scheduler.Executor(max_workers=1)
+    late_spec = model.Specification(capability=st_cap)
+    late_spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    late_spec.set_when("2037-12-24 22:18:42 + 1m / 1s")
+    late_job = scheduler.Job(test_service, late_spec, executor=executor)
+    late_job.schedule()
+    assert_equal(executor.timer_count(), 2)
+    late_job.interrupt()
+    assert_equal(executor.timer_count(), 0)
+    assert_true(late_job.completion().done())
+    assert_true(isinstance(late_job.get_reply(), model.Exception))
+
+    # nor is one interrupted before it is scheduled
+    now_spec = model.Specification(capability=st_cap)
+    now_spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    now_spec.set_when("now + 1m / 1s")
+    now_job = scheduler.Job(test_service, now_spec, executor=executor)
+    now_job.interrupt()
+    now_job.schedule()
+    assert_true(now_job.completion().done())
+    assert_true(now_job._started_at is None)
+    assert_true(isinstance(now_job.get_reply(), model.Exception))
+    executor.shutdown()
+
+
+def test_MultiJob_jobs_per_instance():
+    executor = scheduler.Executor(max_workers=2)
+    rep_spec = model.Specification(capability=st_cap)
+    rep_spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    rep_spec.set_when("repeat now + 2s / 1s { now + 1s / 1s }")
+    multijob_a = scheduler.MultiJob(test_service, rep_spec, executor=executor)
+    multijob_b = scheduler.MultiJob(test_service, rep_spec, executor=executor)
+    assert_false(multijob_a.jobs is multijob_b.jobs)
+    multijob_a.schedule()
+    assert_true(multijob_a.completion().result(timeout=10) is multijob_a)
+    assert_equal(len(multijob_b.jobs), 0)
+    assert_true(isinstance(multijob_a.get_reply(), model.Envelope))
+    assert_true(multijob_a.finished())
+    assert_true(multijob_a.redeemed())
+    executor.shutdown()
+
+
+def test_MultiJob_interrupt_while_scheduling():
+    racers = []
+
+    class RacingExecutor(scheduler.Executor):
+        # interrupts the multijob from another thread just as the
+        # timer for its first sub-job is being set
+        def call_later(self, delay, fn):
+            if fn == multijob._schedule_job and not racers:
+                racer = threading.Thread(target=multijob.interrupt)
+                racers.append(racer)
+                racer.start()
+                racer.join(0.2)
+            return super().call_later(delay, fn)
+
+    executor = RacingExecutor(max_workers=1)
+    rep_spec = model.Specification(capability=st_cap)
+    rep_spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    rep_spec.set_when("repeat now + 1m / 1s { now + 1s / 1s }")
+    multijob = scheduler.MultiJob(test_service, rep_spec, executor=executor)
+    multijob.schedule()
+    racers[0].join(5)
+    assert_equal(executor.timer_count(), 0)
+    assert_true(multijob.completion().done())
+
+    # a sub-job due after the interrupt is never created
+    multijob = scheduler.MultiJob(test_service, rep_spec, executor=executor)
+    multijob._subspec = next(rep_spec.subspec_iterator())
+    multijob.interrupt()
+    multijob._schedule_job()
+    assert_equal(multijob.jobs, [])
+    assert_true(multijob.completion().done())
+    executor.shutdown()
+
+
+def test_Scheduler_shutdown():
+    sched = scheduler.Scheduler()
+    assert_true(sched._prune_timer is not None)
+    assert_equal(sched.executor.timer_count(), 1)
+    timer_thread = sched.executor._timers._thread
+    sched.shutdown()
+    assert_true(sched._prune_timer is None)
+    assert_equal(sched.executor.timer_count(), 0)
+    assert_false(timer_thread.is_alive())
+
+
+def test_Scheduler_prune_jobs():
+    sched = scheduler.Scheduler()
+    redeemed_job = scheduler.Job(test_service, st_spec, executor=sched.executor)
+    redeemed_job._run()
+    redeemed_job.get_reply()
+    stale_job = scheduler.Job(test_service, st_spec, executor=sched.executor)
+    stale_job._run()
+    pending_job = scheduler.Job(test_service, st_spec, executor=sched.executor)
+    sched.jobs = {"redeemed": redeemed_job, "stale": stale_job,
+                  "pending": pending_job}
+
+    assert_equal(sched.stats()["finished"], 2)
+    assert_equal(sched.prune_jobs(), 1)
+    assert_equal(sorted(sched.jobs.keys()), ["pending", "stale"])
+    later = stale_job._ended_at + timedelta(seconds=sched._job_ttl)
+    assert_equal(sched.prune_jobs(now=later), 1)
+    assert_equal(list(sched.jobs.keys()), ["pending"])
+    assert_equal(sched.stats()["jobs"], 1)
+    assert_equal(sched.stats()["pruned"], 2)
+    sched.shutdown()
+
+
+def test_Scheduler_service_index():
+    sched = scheduler.Scheduler()
+    old_cap = create_test_capability()
+    old_cap.set_when("2000-01-01 ... 2001-01-01")
+    old_service = SchedulerTestService(old_cap)
+    sched.add_service(old_service)
+    sched.add_service(test_service)
+    assert_equal(len(sched._service_index), 1)
+
+    # the first service has the right schema but the wrong temporal scope
+    reply = sched.submit_job(None, st_spec)
+    assert_true(isinstance(reply, model.Receipt))
+    assert_true(sched.jobs[reply.get_token()].service is test_service)
+
+    sched.remove_service(test_service)
+    other_spec = model.Specification(capability=st_cap)
+    other_spec.set_parameter_value("destination.ip4", "10.0.37.3")
+    other_spec.set_when(st_spec.when())
+    assert_true(isinstance(sched.submit_job(None, other_spec), model.Exception))
+    sched.remove_service(old_service)
+    assert_equal(len(sched._service_index), 0)
+    sched.shutdown(wait=False)
+
+
+def test_Scheduler_process_envelope():
+    sched = scheduler.Scheduler()
+    job = scheduler.Job(test_service, st_spec, executor=sched.executor)
+    job._run()
+    sched.jobs = {st_spec.get_token(): job}
+    other_spec = model.Specification(capability=st_cap)
+    other_spec.set_parameter_value("destination.ip4", "10.0.37.3")
+    other_spec.set_when(st_spec.when())
+
+    env = model.Envelope()
+    env.append_message(model.Redemption(receipt=st_receipt))
+    env.append_message(model.Redemption(
+                            receipt=model.Receipt(specification=other_spec)))
+    reply = sched.process_message(None, env)
+    assert_true(isinstance(reply, model.Envelope))
+    replies = list(reply.messages())
+    assert_true(isinstance(replies[0], model.Result))
+    assert_true(isinstance(replies[1], model.Exception))
+    assert_equal(replies[1].get_token(), other_spec.get_token())
+    sched.shutdown()
+
+def test_parse_service_limits():
+    assert_equal(scheduler._parse_service_limits(""), {})
+    assert_equal(scheduler._parse_service_limits("ping-detail-ip4:2, tstat:1"),
+                 {"ping-detail-ip4": 2, "tstat": 1})
+
 #
 # utils tests
 #
@@ -447,3 +771,744 @@ def test_split_stmt_list():
     caps.append(cap)
     # using repr as no __eq__ methos is implemented fot capability objects
     assert_equal(repr(res[0]), repr(caps[0]))
+
+###
+### startup.py tests
+###
+
+def test_parse_importtime():
+    from mplane import startup
+    text = ("import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   _json\n"
+            "import time:       900 |       1020 | json\n")
+    assert_equal(startup.parse_importtime(text),
+                 [(120, 120, "_json"), (900, 1020, "json")])
+
+###
+### latency.py tests
+###
+
+def test_relay_latency():
+    from mplane import latency
+    (dispatch, relay) = latency.relay_latency(2)
+    assert_equal(len(dispatch), 2)
+    assert_equal(len(relay), 2)
+    # results are handled as they arrive, not on a polling tick
+    assert_true(max(dispatch) < 0.1)
+    assert_true(max(relay) < 0.5)
+
+###
+### hashing.py tests
+###
+
+def test_hash_times():
+    from mplane import hashing
+    times = hashing.hash_times(10, "fast")
+    assert_equal([stage for (stage, seconds) in times],
+                 ["first retoken", "5x schema+pv+mpcv hash",
+                  "change when, then retoken"])
+    assert_true(all(seconds >= 0 for (stage, seconds) in times))
+    # the default digest is restored afterwards
+    assert_equal(model._token_digest, model._md5_digest)
+
+###
+### cronbench.py tests
+###
+
+def test_cron_times():
+    from mplane import cronbench
+    times = cronbench.cron_times()
+    assert_equal([(stage, fires, stepper_seconds)
+                  for (stage, fires, seconds, stepper_seconds) in times],
+                 [("a year of a monthly cron", 12, None),
+                  ("a week of a daily cron", 7, None)])
+
+###
+### timebench.py tests
+###
+
+def test_timestamp_times():
+    from mplane import timebench
+    times = timebench.timestamp_times(20)
+    assert_equal([stage for (stage, slow, fast) in times],
+                 ["unparse, microsecond precision", "unparse, second precision",
+                  "parse, distinct microsecond", "parse, second stamps, 10/second"])
+    assert_true(all(slow >= 0 and fast >= 0 for (stage, slow, fast) in times))
+
+###
+### supervisor.py tests
+###
+
+def test_PendingRelays():
+    from mplane import supervisor
+    pending = supervisor.PendingRelays(max_unclaimed=2)
+
+    # a result arriving before its relay waits is kept
+    assert_true(pending.resolve("early", "result-early"))
+    assert_false(pending.resolve("early", "again"))
+    assert_equal(pending.wait("early", 0), "result-early")
+    assert_equal(len(pending), 0)
+
+    assert_equal(pending.wait("missing", 0.01), None)
+    pending.discard("missing")
+
+    # waiters are woken by their own token only
+    got = {}
+    def waiter(token):
+        got[token] = pending.wait(token, 5)
+    threads = [threading.Thread(target=waiter, args=(token,))
+               for token in ("a", "b")]
+    for t in threads:
+        t.start()
+    pending.resolve("b", "result-b")
+    pending.resolve("a", "result-a")
+    for t in threads:
+        t.join()
+    assert_equal(got, {"a": "result-a", "b": "result-b"})
+
+    # unclaimed results beyond the limit are dropped oldest first
+    for token in ("x", "y", "z"):
+        pending.resolve(token, "result-" + token)
+    assert_equal(len(pending), 2)
+    assert_equal(pending.wait("x", 0), None)
+    assert_equal(pending.wait("z", 0), "result-z")
+
+def test_RelayService_beyond_pool_size():
+    from mplane import supervisor
+    pending = supervisor.PendingRelays()
+    invoked = []
+    invoked_lock = threading.Lock()
+
+    class HeldClient(object):
+        # forwards specifications, whose results arrive only when
+        # the test resolves them
+        def invoke_capability(self, label, when, params):
+            spec = model.Specification(capability=st_cap)
+            spec.set_when(when)
+            for (pname, pval) in params.items():
+                spec.set_parameter_value(pname, pval)
+            with invoked_lock:
+                invoked.append(spec)
+            return spec
+
+        def interrupt_capability(self, token):
+            pass
+
+    executor = scheduler.Executor()
+    serv = supervisor.RelayService(st_cap, "test-component",
+                                   HeldClient(), pending)
+    count = scheduler.DEFAULT_MAX_WORKERS + 8
+    jobs = []
+    for i in range(count):
+        spec = model.Specification(capability=st_cap)
+        spec.set_label("relay-test-" + str(i))
+        spec.set_when(st_spec.when())
+        spec.set_parameter_value("destination.ip4",
+                                 "10.0.%d.%d" % (i // 256, i % 256))
+        job = scheduler.Job(serv, spec, executor=executor)
+        job._schedule_now()
+        jobs.append(job)
+
+    # every relay forwards its specification while all are still waiting
+    deadline = time.time() + 5
+    while len(invoked) < count and time.time() < deadline:
+        time.sleep(0.01)
+    assert_equal(len(invoked), count)
+
+    for fwd_spec in invoked:
+        pending.resolve(fwd_spec.get_token(),
+                        model.Result(specification=fwd_spec))
+    for job in jobs:
+        assert_true(job.completion().result(timeout=5).finished())
+    executor.shutdown()
+
+def test_ComponentPoller():
+    import configparser
+    from mplane import supervisor
+
+    class PollRecorder(object):
+        """ Notes the polls it gets; one component is unreachable """
+        def __init__(self):
+            self.polled = []
+        def retrieve_capabilities(self, url):
+            if url == "down":
+                raise ConnectionError(url)
+            self.polled.append(("capabilities", url))
+        def redeem_receipts(self, url):
+            self.polled.append(("receipts", url))
+
+    config = configparser.ConfigParser()
+    config.read_dict({"client": {"poll_interval": "0.5"}})
+    cli = PollRecorder()
+    poller = supervisor.ComponentPoller(cli, ["up", "down"], config)
+    poller.poll("up")
+    poller.poll("down")
+    assert_equal(cli.polled, [("capabilities", "up"), ("receipts", "up")])
+
+###
+### resultstore.py tests
+###
+
+# results in the store tests are timed a year from now, within the
+# test capability's "now ... future" scope
+_STORE_DAY = (datetime.utcnow() + timedelta(days=365)).strftime("%Y-%m-%d")
+
+def _result_at(start, dest):
+    spec = model.Specification(capability=st_cap)
+    spec.set_parameter_value("destination.ip4", dest)
+    spec.set_when(start + " + 1m / 1s")
+    res = model.Result(specification=spec)
+    res.set_when(start + " ... " + start[:-2] + "59")
+    res.set_result_value("delay.twoway.icmp.us.min", 33155)
+    res.set_label("test-ping")
+    return res
+
+def check_result_store(store):
+    results = [_result_at(_STORE_DAY + " 22:%02d:00" % m, dest)
+               for m in range(10) for dest in ("10.0.37.2", "10.0.37.3")]
+    for res in reversed(results):
+        store.add(res, res.get_label())
+    assert_equal(len(store), 20)
+    assert_equal(store.get(results[0].get_token()).get_token(),
+                 results[0].get_token())
+    assert_equal(store.get_by_label("test-ping").get_token(),
+                 results[0].get_token())
+
+    found = store.query("test-ping",
+                        {"source.ip4": "10.0.27.2",
+                         "destination.ip4": "10.0.37.3"},
+                        model.parse_time(_STORE_DAY + " 22:02:30"),
+                        model.parse_time(_STORE_DAY + " 22:04:00"))
+    assert_equal([r.get_token() for r in found],
+                 [r.get_token() for r in results[5:10:2]])
+    # parameters the results don't have are ignored
+    found = store.query("test-ping",
+                        {"source.ip4": "10.0.27.2",
+                         "destination.ip4": "10.0.37.3",
+                         "resultName": "delay.twoway.icmp.us.min"},
+                        model.parse_time(_STORE_DAY + " 22:02:30"),
+                        model.parse_time(_STORE_DAY + " 22:04:00"))
+    assert_equal(len(found), 3)
+    assert_equal(store.query("test-ping", {"destination.ip4": "10.0.37.3"}), [])
+    assert_equal(len(store.query("test-ping")), 20)
+    assert_equal(store.query("no-such-label"), [])
+
+    store.remove(results[5].get_token())
+    assert_equal(store.get(results[5].get_token()), None)
+    assert_equal(len(store.query("test-ping",
+                        start=model.parse_time(_STORE_DAY + " 22:02:30"),
+                        end=model.parse_time(_STORE_DAY + " 22:02:40"))), 1)
+
+def test_MemoryResultStore():
+    from mplane import resultstore
+    check_result_store(resultstore.MemoryResultStore())
+
+    store = resultstore.MemoryResultStore(max_results=3)
+    for m in range(5):
+        store.add(_result_at(_STORE_DAY + " 22:%02d:00" % m, "10.0.37.2"))
+    assert_equal(len(store), 3)
+    assert_equal(len(store.query("test-ping")), 3)
+
+def test_SqliteResultStore():
+    import tempfile
+    from mplane import resultstore
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbpath = path.join(tmpdir, "results.db")
+        store = resultstore.SqliteResultStore(dbpath)
+        check_result_store(store)
+        store.close()
+
+        # results persist, and retention limits apply on reopening
+        store = resultstore.SqliteResultStore(dbpath, max_results=3)
+        assert_equal(len(store), 19)
+        store.add(_result_at(_STORE_DAY + " 23:00:00", "10.0.37.2"))
+        assert_equal(len(store), 3)
+        store.close()
+
+###
+### client.py tests
+###
+
+def test_SpecificationHandler_long_poll():
+    import asyncio
+    from mplane import client
+    config = configparser.ConfigParser()
+    config.read_dict({"client": {
+        "listen-port": "18899",
+        "listen-spec-link": "http://127.0.0.1:18899/",
+        "registration-path": "register/capability",
+        "specification-path": "show/specification",
+        "result-path": "register/result"}})
+    started = threading.Event()
+    listener = {}
+
+    def run_listener():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        io_loop = tornado.ioloop.IOLoop.current()
+        listener["client"] = client.HttpListenerClient(config,
+                                tls_state=tls.TlsState(config), io_loop=io_loop)
+        listener["io_loop"] = io_loop
+        started.set()
+        io_loop.start()
+
+    threading.Thread(target=run_listener, daemon=True).start()
+    started.wait(5)
+    listener_client = listener["client"]
+    pool = urllib3.HTTPConnectionPool("127.0.0.1", 18899)
+    try:
+        # without wait, answers at once
+        res = pool.request("GET", "/show/specification")
+        assert_equal(res.status, 200)
+        assert_equal(res.getheader(client.LONG_POLL_HEADER), None)
+
+        # with wait, answers as soon as a specification is queued
+        def push():
+            while not listener_client._spec_waiters:
+                time.sleep(0.01)
+            identity = list(listener_client._spec_waiters)[0]
+            spec = model.Specification(capability=st_cap)
+            spec.set_label("test-ping")
+            spec.set_parameter_value("destination.ip4", "10.0.37.2")
+            listener_client._push_outgoing(identity, spec)
+        threading.Thread(target=push).start()
+        started_at = time.time()
+        res = pool.request("GET", "/show/specification?wait=10")
+        assert_true(time.time() - started_at < 5)
+        assert_equal(res.getheader(client.LONG_POLL_HEADER), "10.0")
+        env = model.parse_json(res.data.decode("utf-8"))
+        assert_equal(len(list(env.messages())), 1)
+
+        # or when the wait runs out
+        res = pool.request("GET", "/show/specification?wait=0.2")
+        assert_equal(len(list(model.parse_json(
+                        res.data.decode("utf-8")).messages())), 0)
+        assert_equal(listener_client._spec_waiters, {})
+
+        # bad waits are refused, negative ones answered at once
+        for wait in ("soon", "nan", "inf"):
+            res = pool.request("GET", "/show/specification?wait=" + wait)
+            assert_equal(res.status, 400)
+        res = pool.request("GET", "/show/specification?wait=-5")
+        assert_equal(res.status, 200)
+        assert_equal(res.getheader(client.LONG_POLL_HEADER), None)
+    finally:
+        listener["io_loop"].add_callback(listener["io_loop"].stop)
+
+def test_BaseClient_result_for():
+    from mplane import client
+    from mplane import resultstore
+
+    class ExpiringStore(resultstore.MemoryResultStore):
+        """ Counts lookups; results expire after their first one """
+        lookups = 0
+        def get(self, token):
+            self.lookups += 1
+            result = super().get(token)
+            self.remove(token)
+            return result
+
+    store = ExpiringStore()
+    cli = client.BaseClient(None, result_store=store)
+    store.add(st_res)
+    assert_true(cli.result_for(st_res.get_token()) is st_res)
+    assert_equal(store.lookups, 1)
+    assert_raises(KeyError, cli.result_for, st_res.get_token())
+
+def test_HttpInitiatorClient_redeem_receipts():
+    from mplane import client
+
+    class RedemptionRecorder(client.HttpInitiatorClient):
+        """ Notes the messages it would send instead of sending them """
+        def send_message(self, msg, dst_url=None):
+            self.sent.append((msg, str(dst_url)))
+
+    cli = RedemptionRecorder(None, None)
+    cli.sent = []
+    links = {}
+    for (i, link) in enumerate(["https://10.0.0.1:8888/",
+                                "https://10.0.0.1:8888/",
+                                "https://10.0.0.2:8888/"]):
+        spec = model.Specification(capability=st_cap)
+        spec.set_parameter_value("destination.ip4", "10.0.37." + str(i))
+        spec.set_when(st_spec.when())
+        cli.handle_message(model.Receipt(specification=spec))
+        cli._receipt_urls[spec.get_token()] = link
+        links[spec.get_token()] = link
+
+    # all of a component's redemptions go in one envelope
+    cli.redeem_receipts("10.0.0.1:8888/")
+    assert_equal(len(cli.sent), 1)
+    (msg, dst_url) = cli.sent[0]
+    assert_true(isinstance(msg, model.Envelope))
+    assert_equal(dst_url, "https://10.0.0.1:8888/")
+    tokens = [imsg.get_token() for imsg in msg.messages()]
+    assert_equal(sorted(links[token] for token in tokens),
+                 ["https://10.0.0.1:8888/", "https://10.0.0.1:8888/"])
+
+    # a single redemption is sent bare
+    cli.sent = []
+    cli.redeem_receipts("10.0.0.2:8888/")
+    assert_equal(len(cli.sent), 1)
+    assert_true(isinstance(cli.sent[0][0], model.Redemption))
+
+    # results already received are not asked for again
+    cli.sent = []
+    for token in list(links):
+        cli._remove_receipt(cli._receipts[token])
+    cli.redeem_receipts()
+    assert_equal(cli.sent, [])
+    assert_equal(cli._receipt_urls, {})
+
+###
+### component.py tests
+###
+
+def test_negotiate_content_type():
+    if model.msgpack is None:
+        raise SkipTest("msgpack is not installed")
+    json = model.CONTENT_TYPE_JSON
+    binary = model.CONTENT_TYPE_MSGPACK
+    assert_equal(model.negotiate_content_type(None), json)
+    assert_equal(model.negotiate_content_type("*/*"), json)
+    assert_equal(model.negotiate_content_type(binary + ", " + json), binary)
+    assert_equal(model.negotiate_content_type(binary + ";q=0, " + json), json)
+    assert_equal(model.negotiate_content_type(binary + ";q=0"), json)
+    assert_equal(model.negotiate_content_type(
+                    binary + ";q=0.5, " + json + ";q=0.9"), json)
+    assert_equal(model.negotiate_content_type(
+                    binary + ";q=0.8, */*;q=0.1"), binary)
+
+def test_MPlaneHandler_msgpack():
+    if model.msgpack is None:
+        raise SkipTest("msgpack is not installed")
+    import asyncio
+    from mplane import component
+
+    class ReceiptHandler(component.MPlaneHandler):
+        @tornado.gen.coroutine
+        def get(self):
+            yield self._respond_message(st_receipt)
+
+    started = threading.Event()
+    server = {}
+
+    def run_server():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        io_loop = tornado.ioloop.IOLoop.current()
+        app = tornado.web.Application([(r"/", ReceiptHandler)])
+        app.listen(18898, address="127.0.0.1")
+        server["io_loop"] = io_loop
+        started.set()
+        io_loop.start()
+
+    threading.Thread(target=run_server, daemon=True).start()
+    started.wait(5)
+    pool = urllib3.HTTPConnectionPool("127.0.0.1", 18898)
+    try:
+        for (accept, ctype) in [
+                (", ".join(model.message_content_types()),
+                 model.CONTENT_TYPE_MSGPACK),
+                (model.CONTENT_TYPE_MSGPACK + ";q=0, " +
+                 model.CONTENT_TYPE_JSON, model.CONTENT_TYPE_JSON),
+                (None, model.CONTENT_TYPE_JSON)]:
+            headers = {} if accept is None else {"Accept": accept}
+            res = pool.request("GET", "/", headers=headers)
+            assert_equal(res.status, 200)
+            assert_equal(res.getheader("Content-Type"), ctype)
+            msg = model.parse_message(res.data, res.getheader("Content-Type"))
+            assert_true(isinstance(msg, model.Receipt))
+            assert_equal(msg.get_token(), st_receipt.get_token())
+    finally:
+        server["io_loop"].add_callback(server["io_loop"].stop)
+
+def test_MPlaneHandler_streams_json():
+    import asyncio
+    from mplane import component
+
+    res = model.Result(specification=st_spec)
+    res.set_when("2017-12-24 22:18:42.993000 ... " +
+                 "2017-12-24 22:19:42.991000")
+    res.append_rows(((i,) for i in range(200000)),
+                    ["delay.twoway.icmp.count"])
+    unflushed = []
+
+    class ResultHandler(component.MPlaneHandler):
+        # notes any chunk written while an earlier flush is pending
+        def initialize(self):
+            self.flushes = []
+
+        def flush(self, *args, **kwargs):
+            future = super().flush(*args, **kwargs)
+            self.flushes.append(future)
+            return future
+
+        def write(self, chunk):
+            if not all(future.done() for future in self.flushes):
+                unflushed.append(len(chunk))
+            super().write(chunk)
+
+        @tornado.gen.coroutine
+        def get(self):
+            yield self._respond_message(res)
+
+    started = threading.Event()
+    server = {}
+
+    def run_server():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        io_loop = tornado.ioloop.IOLoop.current()
+        app = tornado.web.Application([(r"/", ResultHandler)])
+        app.listen(18896, address="127.0.0.1")
+        server["io_loop"] = io_loop
+        started.set()
+        io_loop.start()
+
+    threading.Thread(target=run_server, daemon=True).start()
+    started.wait(5)
+    # a slow peer: ask for the result, then leave it unread for a while
+    import socket
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    try:
+        sock.connect(("127.0.0.1", 18896))
+        sock.sendall(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                     b"Accept: " + model.CONTENT_TYPE_JSON.encode() +
+                     b"\r\nConnection: close\r\n\r\n")
+        time.sleep(1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        data = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data.append(chunk)
+        data = b"".join(data)
+        assert_true(data.startswith(b"HTTP/1.1 200"))
+        assert_true(data.endswith(b"0\r\n\r\n"))
+        assert_equal(unflushed, [])
+    finally:
+        sock.close()
+        server["io_loop"].add_callback(server["io_loop"].stop)
+
+def test_MessagePostHandler_does_not_block():
+    import asyncio
+    from mplane import component
+
+    class SlowTestService(scheduler.Service):
+        """ Answers once released """
+        def __init__(self, cap):
+            super().__init__(cap)
+            self.started = threading.Event()
+            self.release = threading.Event()
+
+        def run(self, specification, check_interrupt):
+            self.started.set()
+            self.release.wait(5)
+            res = model.Result(specification=specification)
+            res.set_when("2037-12-24 22:18:42 ... 2037-12-24 22:18:43")
+            res.set_result_value("delay.twoway.icmp.count", 1)
+            return res
+
+    sched = scheduler.Scheduler()
+    slow_service = SlowTestService(st_cap)
+    sched.add_service(slow_service)
+    tls_state = tls.TlsState(configparser.ConfigParser())
+    started = threading.Event()
+    server = {}
+
+    def run_server():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        io_loop = tornado.ioloop.IOLoop.current()
+        app = tornado.web.Application([(r"/", component.MessagePostHandler,
+                                        {"scheduler": sched,
+                                         "tlsState": tls_state})])
+        app.listen(18897, address="127.0.0.1")
+        server["io_loop"] = io_loop
+        started.set()
+        io_loop.start()
+
+    threading.Thread(target=run_server, daemon=True).start()
+    started.wait(5)
+    pool = urllib3.HTTPConnectionPool("127.0.0.1", 18897, maxsize=2)
+    spec = model.Specification(capability=st_cap)
+    spec.set_parameter_value("destination.ip4", "10.0.37.2")
+    spec.set_when("now + 1s / 1s")
+    posted = {}
+
+    def post():
+        posted["res"] = pool.request("POST", "/",
+                            body=model.unparse_json(spec),
+                            headers={"Content-Type": "application/x-mplane+json"})
+    post_thread = threading.Thread(target=post)
+    try:
+        post_thread.start()
+        assert_true(slow_service.started.wait(5))
+
+        # the IOLoop answers other requests while the POST waits
+        res = pool.request("GET", "/")
+        assert_equal(res.status, 200)
+        assert_true(post_thread.is_alive())
+
+        slow_service.release.set()
+        post_thread.join(10)
+        assert_equal(posted["res"].status, 200)
+        msg = model.parse_json(posted["res"].data.decode("utf-8"))
+        assert_true(isinstance(msg, model.Result))
+        assert_equal(msg.get_token(), spec.get_token())
+    finally:
+        slow_service.release.set()
+        server["io_loop"].add_callback(server["io_loop"].stop)
+        sched.shutdown(wait=False)
+
+class UploadRecorder(object):
+    """Stands in for an InitiatorHttpComponent, recording uploads."""
+
+    class Response(object):
+        def __init__(self, status):
+            self.status = status
+            self.data = b""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.posted = []
+        self.reported = []
+        self.first_post = threading.Event()
+        self.release = threading.Event()
+
+    def _post_message(self, pool, path, msg):
+        self.posted.append(msg)
+        self.first_post.set()
+        self.release.wait(5)
+        return self.Response(self.statuses.pop(0) if self.statuses else 200)
+
+    def _report_upload(self, msg, res):
+        self.reported.append(msg)
+
+def test_MessageUploader_batches():
+    from mplane import component
+    recorder = UploadRecorder([])
+    uploader = component._MessageUploader(recorder, None, "/result", 3, 0)
+    receipts = [model.Receipt(specification=st_spec) for i in range(5)]
+
+    # the first message goes alone; the ones queued meanwhile are batched
+    uploader.put(receipts[0])
+    recorder.first_post.wait(5)
+    for receipt in receipts[1:]:
+        uploader.put(receipt)
+    recorder.release.set()
+    for i in range(50):
+        if len(recorder.reported) == 5:
+            break
+        time.sleep(0.1)
+
+    assert_equal(recorder.posted[0], receipts[0])
+    assert_true(isinstance(recorder.posted[1], model.Envelope))
+    assert_equal(list(recorder.posted[1].messages()), receipts[1:4])
+    assert_equal(recorder.posted[2], receipts[4])
+    assert_equal(recorder.reported, receipts)
+
+def test_MessageUploader_retries():
+    from mplane import component
+    recorder = UploadRecorder([503])
+    recorder.release.set()
+    uploader = component._MessageUploader(recorder, None, "/result", 3, 0)
+    uploader.put(st_receipt)
+    for i in range(50):
+        if recorder.reported:
+            break
+        time.sleep(0.1)
+    assert_equal(recorder.posted, [st_receipt, st_receipt])
+    assert_equal(recorder.reported, [st_receipt])
+
+def test_MessageUploader_gives_up():
+    from mplane import component
+    recorder = UploadRecorder([503, 503])
+    recorder.release.set()
+    uploader = component._MessageUploader(recorder, None, "/result", 1, 0,
+                                          max_attempts=2, backoff=0.01)
+    other = model.Receipt(specification=create_test_specification())
+    uploader.put(st_receipt)
+    uploader.put(other)
+    for i in range(50):
+        if recorder.reported:
+            break
+        time.sleep(0.1)
+    # the failing message is dropped, and doesn't hold up the next
+    assert_equal(recorder.posted, [st_receipt, st_receipt, other])
+    assert_equal(recorder.reported, [other])
+
+def test_MessageUploader_survives_errors():
+    from mplane import component
+
+    class FailingRecorder(UploadRecorder):
+        def _report_upload(self, msg, res):
+            if not self.reported:
+                self.reported.append(None)
+                raise ValueError("report failed")
+            self.reported.append(msg)
+
+    recorder = FailingRecorder([])
+    recorder.release.set()
+    uploader = component._MessageUploader(recorder, None, "/result", 1, 0)
+    uploader.put(st_receipt)
+    uploader.put(st_receipt)
+    for i in range(50):
+        if len(recorder.reported) == 2:
+            break
+        time.sleep(0.1)
+    assert_equal(recorder.reported, [None, st_receipt])
+
+def test_post_message_not_retried_by_urllib3():
+    from mplane import component
+
+    class RecordingPool(object):
+        def urlopen(self, method, path, body=None, **kwargs):
+            self.body = b"".join(body)
+            self.kwargs = kwargs
+            return UploadRecorder.Response(200)
+
+    comp = component.InitiatorHttpComponent.__new__(
+                component.InitiatorHttpComponent)
+    comp._content_type = model.CONTENT_TYPE_JSON
+    comp._compact_json = False
+    pool = RecordingPool()
+    comp._post_message(pool, "/result", st_receipt)
+    # the streamed body can't be replayed, so _MessageUploader retries
+    assert_true(pool.kwargs["retries"] is False)
+    assert_true(pool.kwargs["chunked"])
+    assert_equal(model.parse_json(pool.body.decode("utf-8")).get_token(),
+                 st_receipt.get_token())
+
+def test_check_for_specs_survives_errors():
+    from mplane import component
+
+    class StopPolling(Exception):
+        pass
+
+    class FlakyPool(object):
+        """ Times out, then asks for registration, then stops the test """
+        def __init__(self):
+            self.calls = 0
+
+        def request(self, method, path, **kwargs):
+            self.calls += 1
+            if self.calls == 1:
+                raise urllib3.exceptions.ReadTimeoutError(self, path,
+                                                          "timed out")
+            if self.calls == 2:
+                res = UploadRecorder.Response(428)
+                res.getheader = lambda name: None
+                return res
+            raise StopPolling()
+
+    comp = component.InitiatorHttpComponent.__new__(
+                component.InitiatorHttpComponent)
+    comp.pool = FlakyPool()
+    comp.specification_path = "/show/specification"
+    comp._spec_poll_interval = 0.01
+    comp._spec_long_poll = 30
+    registered = []
+    comp.register_to_client = lambda caps=None: registered.append(caps)
+    assert_raises(StopPolling, comp.check_for_specs)
+    assert_equal(comp.pool.calls, 3)
+    assert_equal(registered, [None])
@@ -0,0 +1,88 @@
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+##
+# mPlane Protocol Reference Implementation
+# Timestamp parsing and formatting timing
+#
+# (c) 2015 mPlane Consortium (http://www.ict-mplane.eu)
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Measures how long mPlane timestamps take to parse and unparse.
+
+    python3 -m mplane.timebench [--count N]
+
+formats and parses N timestamps with parse_time() and unparse_time(),
+and with the regular expression and strptime/strftime they fall back
+to, and reports both times for
+
+  - unparsing at microsecond and at second precision,
+  - parsing distinct microsecond stamps, each in a second of its own,
+  - parsing second stamps in runs of ten within the same second.
+
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import mplane.model
+
+_BASE = datetime(2015, 6, 1)
+
+def _timed(fn, values):
+    started_at = time.perf_counter()
+    for value in values:
+        fn(value)
+    return time.perf_counter() - started_at
+
+def timestamp_times(count=1000000):
+    """
+    Returns a list of (stage, strptime/strftime seconds, mplane
+    seconds) for count timestamps.
+
+    """
+    distinct = [_BASE + timedelta(microseconds=i * 1000037)
+                for i in range(count)]
+    runs = [_BASE + timedelta(seconds=i // 10) for i in range(count)]
+
+    times = []
+    for (precision, stage) in (("us", "unparse, microsecond precision"),
+                               ("s", "unparse, second precision")):
+        fmt = mplane.model._iso8601_fmt[precision]
+        times.append((stage,
+                      _timed(lambda dt: dt.strftime(fmt), distinct),
+                      _timed(lambda dt: mplane.model.unparse_time(dt, precision),
+                             distinct)))
+
+    for (stamps, precision, stage) in ((distinct, "us", "parse, distinct microsecond"),
+                                       (runs, "s", "parse, second stamps, 10/second")):
+        valstrs = [mplane.model.unparse_time(dt, precision) for dt in stamps]
+        mplane.model._parse_time_fixed.cache_clear()
+        times.append((stage,
+                      _timed(mplane.model._parse_time_strptime, valstrs),
+                      _timed(mplane.model.parse_time, valstrs)))
+
+    return times
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mPlane timestamp parsing time")
+    parser.add_argument("--count", type=int, default=1000000,
+                        help="number of timestamps to parse and unparse")
+    args = parser.parse_args()
+
+    print("%-34s %18s %8s" % ("", "strptime/strftime", "mplane"))
+    for (stage, slow, fast) in timestamp_times(args.count):
+        print("%-34s %17.2fs %7.2fs" % (stage + ":", slow, fast))
@@ -36,7 +36,6 @@
 import urllib3
 import ssl
 import functools
-import tornado.httpserver
 from socket import socket
 import mplane.utils
 
@@ -156,7 +155,9 @@ class TlsState:
                 c.connect((url_or_req.host, url_or_req.port))
                 cert = c.getpeercert()
                 c.close()
-            elif isinstance(url_or_req, tornado.httpserver.HTTPRequest):
+            elif hasattr(url_or_req, "get_ssl_certificate"):
+                # a tornado.httputil.HTTPServerRequest; checked by duck
+                # typing so clients need not import tornado
                 cert = url_or_req.get_ssl_certificate()
             else:
                 raise ValueError("Passed argument is not a urllib3.util.url.Url or tornado.httpserver.HTTPRequest")
@@ -22,7 +22,6 @@ import os.path
 import re
 import mplane.model
 import json
-import urllib3
 
 def read_setting(filepath, param):
     """
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
-from distutils.core import setup
-from setuptools import find_packages
+from setuptools import setup, find_packages
 
 long_description = '''
 This module contains the mPlane Software Development Kit.
@@ -36,6 +35,9 @@ setup(name='mplane-sdk',
       package_data={'mplane': ['registry.json']},
       scripts=['scripts/mpcli', 'scripts/mpcom', 'scripts/mpsup'],
       install_requires=['pyyaml', 'tornado', 'urllib3', 'nose'],
+      extras_require={'msgpack': ['msgpack'],
+                      'fast': ['xxhash'],
+                      'numpy': ['numpy']},
       classifiers=["Development Status :: 3 - Alpha",
                    "Intended Audience :: Developers",
                    "License :: OSI Approved :: "
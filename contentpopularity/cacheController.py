@@ -35,7 +35,6 @@ sys.path.append(pri)
 import mplane.model
 import mplane.scheduler
 import mplane.utils
-import mplane.component
 
 _module_path = os.path.dirname(os.path.abspath(__file__))
 _capabilitypath = os.path.join(_module_path, "capabilities")
@@ -133,6 +132,9 @@ class cacheControllerService(mplane.scheduler.Service):
 
 def main():
     """docstring for main"""
+    # only needed when run standalone, not when loaded as a component module
+    import mplane.component
+
     global args
     parser = argparse.ArgumentParser(
         description='run a Cache Controller mPlane proxy')